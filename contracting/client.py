@@ -151,9 +151,6 @@ class AbstractContract:
                                   environment=environment,
                                   metering=metering)
 
-        if executor.production:
-            executor.sandbox.terminate()
-
         if output['status_code'] == 1:
             raise output['result']
 
@@ -0,0 +1,81 @@
+import marshal
+import dis
+
+# Basic block costs. Straight-line code between two branch points always runs to the end (short of an error), so its
+# stamps can be added up once when the contract is submitted. The tracer then charges a whole block when its first
+# instruction runs instead of charging every instruction, while the total for a transaction stays the same.
+#
+# Block costs depend on the cost schedule they were added up with, so they are stored along with its version.
+
+# Instructions after which execution never simply carries on with the next one
+BLOCK_ENDS = {dis.opmap[name] for name in ('RETURN_VALUE', 'RAISE_VARARGS', 'YIELD_VALUE', 'YIELD_FROM', 'RERAISE')
+              if name in dis.opmap}
+
+JUMPS = set(dis.hasjrel) | set(dis.hasjabs)
+
+EXTENDED_ARG = dis.opmap['EXTENDED_ARG']
+
+
+def code_objects(code):
+    # The code object and every code object nested in it, depth first. Tables are stored in this order.
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, type(code)):
+            yield from code_objects(const)
+
+
+def leaders(code):
+    # Offsets where a basic block starts: the first instruction, every jump target and whatever follows a jump or the
+    # end of a block
+    starts = {0}
+    for instruction in dis.get_instructions(code):
+        if instruction.opcode in JUMPS:
+            starts.add(instruction.argval)
+            starts.add(instruction.offset + 2)
+        elif instruction.opcode in BLOCK_ENDS:
+            starts.add(instruction.offset + 2)
+
+    return {s for s in starts if s < len(code.co_code)}
+
+
+def block_costs_for_code(code, costs):
+    # ((offset, cost), ...) for every block of a single code object. The instruction after an EXTENDED_ARG is executed
+    # along with it and is never charged by itself, so it is skipped here as well.
+    starts = sorted(leaders(code))
+    ops = code.co_code[::2]
+
+    blocks = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(code.co_code)
+
+        cost = 0
+        previous = None
+        for op in ops[start // 2:end // 2]:
+            if previous != EXTENDED_ARG:
+                cost += costs[op]
+            previous = op
+
+        blocks.append((start, cost))
+
+    return tuple(blocks)
+
+
+def block_costs(code, costs):
+    return tuple(block_costs_for_code(c, costs) for c in code_objects(code))
+
+
+def dump_block_costs(code, schedule):
+    return marshal.dumps((schedule.version, block_costs(code, schedule.costs)))
+
+
+def load_block_costs(tracer, code, blob, schedule):
+    if type(blob) != bytes:
+        blob = bytes.fromhex(blob)
+
+    # Costs added up with another schedule are added up again with the current one
+    version, tables = marshal.loads(blob)
+    if version != schedule.version:
+        tables = block_costs(code, schedule.costs)
+
+    for c, table in zip(code_objects(code), tables):
+        tracer.set_block_costs(c, table)
@@ -24,3 +24,17 @@ READ_COST_PER_BYTE = 1
 WRITE_COST_PER_BYTE = 25
 
 STAMPS_PER_TAU = 20
+
+# Most a single transaction can cost under the default cost schedule, in the tracer's units
+MAX_STAMPS = 6500000
+
+# Most bytes a single transaction can have allocated at once under the default cost schedule
+MAX_MEMORY = 8 * 1024 * 1024
+
+MODULE_CACHE_SIZE = 1024
+
+# Most bytes of values read from the database a driver keeps cached
+STATE_CACHE_SIZE = 64 * 1024 * 1024
+
+# Levels of interior nodes in the state tree. Keys are spread over 16 ** MERKLE_DEPTH leaf buckets.
+MERKLE_DEPTH = 4
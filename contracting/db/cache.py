@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from contracting import config
+import sys
+
+# Returned by StateCache.lookup for keys it knows nothing about. None is a value: the key is known to be absent.
+MISSING = object()
+
+
+def entry_size(key, value):
+    # Rough memory held by a cached entry. Values are not encoded to size them, that would cost as much as reading them.
+    return len(key) + sys.getsizeof(value)
+
+
+class StateCache:
+    # The values a CacheDriver holds in memory, in two tiers. Dirty entries are values written and not yet committed,
+    # they are the only copy of the state and are never evicted. Clean entries are values read from or committed to
+    # the database, absent keys included, and are evicted least recently used first once they take up more than maxsize
+    # bytes. Clean entries are kept from block to block, except for volatile ones: values a contract could change in
+    # place, which are dropped with the pending state.
+    def __init__(self, maxsize=config.STATE_CACHE_SIZE):
+        self.maxsize = maxsize
+
+        self.dirty = {}
+        self.clean = OrderedDict()
+        self.clean_size = 0
+
+        # Size of every clean entry as it was when cached. Values can change in place after, so the size they are
+        # taken off clean_size with is the one they were added with.
+        self.clean_sizes = {}
+        self.volatile = set()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        # The value of a key for a read, MISSING if it has to be read from the database
+        value = self.dirty.get(key, MISSING)
+
+        if value is MISSING:
+            value = self.clean.get(key, MISSING)
+
+            if value is MISSING:
+                self.misses += 1
+                return MISSING
+
+            self.clean.move_to_end(key)
+
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def fill(self, key, value, durable=True):
+        # Caches a committed value. Returns the keys evicted to make room for it.
+        if key in self.dirty:
+            return []
+
+        self.discard(key)
+
+        size = entry_size(key, value)
+        if size > self.maxsize:
+            return []
+
+        self.clean[key] = value
+        self.clean_sizes[key] = size
+        self.clean_size += size
+
+        if not durable:
+            self.volatile.add(key)
+
+        evicted = []
+        while self.clean_size > self.maxsize:
+            k, v = self.clean.popitem(last=False)
+            self.clean_size -= self.clean_sizes.pop(k)
+            self.volatile.discard(k)
+            self.evictions += 1
+
+            evicted.append(k)
+
+        return evicted
+
+    def commit(self, key, value, durable=True):
+        # A write that was committed is clean from then on, unless it was written over since
+        if self.dirty.get(key, MISSING) is not value:
+            return []
+
+        del self.dirty[key]
+        return self.fill(key, value, durable=durable)
+
+    def discard(self, key):
+        value = self.clean.pop(key, MISSING)
+        if value is not MISSING:
+            self.clean_size -= self.clean_sizes.pop(key)
+            self.volatile.discard(key)
+
+    def clear_pending(self):
+        # Drops the dirty and volatile entries, returning their keys
+        dropped = list(self.dirty.keys()) + list(self.volatile)
+
+        self.dirty.clear()
+        for key in list(self.volatile):
+            self.discard(key)
+
+        return dropped
+
+    def get(self, key, default=None):
+        value = self.dirty.get(key, MISSING)
+        if value is MISSING:
+            value = self.clean.get(key, default)
+
+        return value
+
+    def pop(self, key, default=None):
+        value = self.dirty.pop(key, MISSING)
+        if value is MISSING:
+            value = self.clean.get(key, default)
+            self.discard(key)
+
+        return value
+
+    def keys(self):
+        return self.dirty.keys() | self.clean.keys()
+
+    def copy(self):
+        cache = StateCache(maxsize=self.maxsize)
+
+        cache.dirty = dict(self.dirty)
+        cache.clean = OrderedDict(self.clean)
+        cache.clean_size = self.clean_size
+        cache.clean_sizes = dict(self.clean_sizes)
+        cache.volatile = set(self.volatile)
+
+        return cache
+
+    def clear(self):
+        self.dirty.clear()
+        self.clean.clear()
+        self.clean_size = 0
+        self.clean_sizes.clear()
+        self.volatile.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self),
+            'bytes': self.clean_size
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        # Written values go to the dirty tier
+        self.discard(key)
+        self.dirty[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+
+        self.pop(key)
+
+    def __contains__(self, key):
+        return key in self.dirty or key in self.clean
+
+    def __len__(self):
+        return len(self.dirty) + len(self.clean)
@@ -1,7 +1,12 @@
-from contracting.db.encoder import encode, decode, encode_kv
-from contracting.execution.runtime import rt
-from contracting.stdlib.bridge.time import Datetime
+from contracting.db.encoder import encode, decode, encode_value, decode_value, JSON
+from contracting.execution.runtime import rt, get_runtime
+from contracting.execution.cache import invalidate_contract, clear_contract_caches
+from contracting.db.cache import StateCache, MISSING
+from contracting.db.merkle import MerkleTree, NODE_PREFIX
+from contracting.stdlib.bridge.time import Datetime, Timedelta
 from contracting.stdlib.bridge.decimal import ContractingDecimal
+from contracting.compilation.blocks import dump_block_costs
+from contracting.execution.metering.costs import commit_height
 from contracting import config
 from datetime import datetime
 import marshal
@@ -13,6 +18,9 @@ from pathlib import Path
 import shutil
 import hashlib
 import lmdb
+import bisect
+import itertools
+import re
 
 FILE_EXT = '.d'
 HASH_EXT = '.x'
@@ -27,13 +35,60 @@ AUTHOR_KEY = '__author__'
 OWNER_KEY = '__owner__'
 TIME_KEY = '__submitted__'
 COMPILED_KEY = '__compiled__'
+BLOCK_COSTS_KEY = '__costs__'
 DEVELOPER_KEY = '__developer__'
 
 
+def prefix_successor(prefix: str):
+    # The smallest string greater than every string starting with prefix, or None if there is no such string. Keys
+    # under a prefix are then the range [prefix, successor), which the database can answer from its _id index.
+    chars = list(prefix)
+    while chars:
+        c = ord(chars.pop()) + 1
+
+        # Surrogates cannot be stored, skip over them
+        if 0xD800 <= c <= 0xDFFF:
+            c = 0xE000
+
+        if c <= 0x10FFFF:
+            return ''.join(chars) + chr(c)
+
+    return None
+
+
+def prefix_range(prefix: str, start_after=None):
+    if start_after is not None and start_after >= prefix:
+        query = {'$gt': start_after}
+    else:
+        query = {'$gte': prefix}
+
+    successor = prefix_successor(prefix)
+    if successor is not None:
+        query['$lt'] = successor
+
+    if NODE_PREFIX.startswith(prefix) and not listed(NODE_PREFIX, prefix):
+        query['$not'] = re.compile('^' + re.escape(NODE_PREFIX))
+
+    return query
+
+
+def listed(key: str, prefix: str=''):
+    # Merkle tree nodes are kept in the same store as the state, but are not part of it. They are only listed when they
+    # are asked for by their own prefix.
+    return not key.startswith(NODE_PREFIX) or prefix.startswith(NODE_PREFIX)
+
+
 class Driver:
-    def __init__(self, db='lamden', collection='state'):
+    def __init__(self, db='lamden', collection='state', encoding=JSON):
         self.client = pymongo.MongoClient()
         self.db = self.client[db][collection]
+        self.encoding = encoding
+
+    def _encode(self, value):
+        # JSON is kept as a string so existing documents keep their format
+        if self.encoding == JSON:
+            return encode(value)
+        return encode_value(value, self.encoding)
 
     def get(self, item: str):
         v = self.db.find_one({'_id': item})
@@ -41,15 +96,35 @@ class Driver:
         if v is None:
             return None
 
-        return decode(v['v'])
+        return decode_value(v['v'], self.encoding)
+
+    def get_many(self, keys):
+        # One query for every key. Keys that do not exist map to None.
+        values = dict.fromkeys(keys)
+        for entry in self.db.find({'_id': {'$in': list(values)}}):
+            values[entry['_id']] = decode_value(entry['v'], self.encoding)
+
+        return values
 
     def set(self, key, value):
         if value is None:
             self.__delitem__(key)
         else:
-            v = encode(value)
+            v = self._encode(value)
             self.db.update_one({'_id': key}, {'$set': {'v': v}}, upsert=True, )
 
+    def batch_set(self, writes: dict):
+        # Applies all of the writes in one round trip. A value of None deletes the key, like set does.
+        ops = []
+        for key, value in writes.items():
+            if value is None:
+                ops.append(pymongo.DeleteOne({'_id': key}))
+            else:
+                ops.append(pymongo.UpdateOne({'_id': key}, {'$set': {'v': self._encode(value)}}, upsert=True))
+
+        if len(ops) > 0:
+            self.db.bulk_write(ops)
+
     def flush(self):
         self.db.drop()
 
@@ -57,23 +132,24 @@ class Driver:
         self.__delitem__(key)
 
     def iter(self, prefix: str, length=0):
-        cur = self.db.find({'_id': {'$regex': f'^{prefix}'}})
+        # Range scan over the _id index, returning only the keys
+        cur = self.db.find({'_id': prefix_range(prefix)}, {'_id': 1}).sort('_id', pymongo.ASCENDING)
+        if length > 0:
+            cur = cur.limit(length)
 
-        keys = []
-        for entry in cur:
-            keys.append(entry['_id'])
-            if 0 < length <= len(keys):
-                break
+        return [entry['_id'] for entry in cur]
 
-        keys.sort()
-        return keys
+    def iter_items(self, prefix: str='', start_after=None, limit=None):
+        # Yields (key, value) pairs in key order. Sorting, paging and limiting are done by the database.
+        cur = self.db.find({'_id': prefix_range(prefix, start_after)}).sort('_id', pymongo.ASCENDING)
+        if limit:
+            cur = cur.limit(limit)
+
+        for entry in cur:
+            yield entry['_id'], decode_value(entry['v'], self.encoding)
 
     def keys(self):
-        k = []
-        for entry in self.db.find({}):
-            k.append(entry['_id'])
-        k.sort()
-        return k
+        return self.iter('')
 
     def __getitem__(self, item: str):
         value = self.get(item)
@@ -89,23 +165,35 @@ class Driver:
 
 
 class InMemDriver(Driver):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, encoding=JSON):
+        super().__init__(encoding=encoding)
         self.db = {}
 
+        # Sorted copy of the keys in db so prefix scans are a bisect and a bounded walk
+        self.sorted_keys = []
+
     def get(self, item):
         key = item.encode()
         value = self.db.get(key)
-        return decode(value)
+        return decode_value(value, self.encoding)
+
+    def get_many(self, keys):
+        return {k: decode_value(self.db.get(k.encode()), self.encoding) for k in keys}
 
     def set(self, key: str, value):
         k = key.encode()
         if value is None:
             self.__delitem__(key)
         else:
-            v = encode(value).encode()
+            v = encode_value(value, self.encoding)
+            if k not in self.db:
+                bisect.insort(self.sorted_keys, k)
             self.db[k] = v
 
+    def batch_set(self, writes: dict):
+        for key, value in writes.items():
+            self.set(key, value)
+
     def delete(self, key: str):
         self.__delitem__(key)
 
@@ -113,19 +201,48 @@ class InMemDriver(Driver):
         p = prefix.encode()
 
         l = []
-        for k in sorted(self.db.keys()):
-            if k.startswith(p):
-                l.append(k.decode())
+        i = bisect.bisect_left(self.sorted_keys, p)
+        while i < len(self.sorted_keys) and self.sorted_keys[i].startswith(p):
+            k = self.sorted_keys[i].decode()
+            i += 1
+
+            if not listed(k, prefix):
+                continue
+
+            l.append(k)
             if 0 < length <= len(l):
                 break
 
         return l
 
+    def iter_items(self, prefix: str='', start_after=None, limit=None):
+        p = prefix.encode()
+
+        i = bisect.bisect_left(self.sorted_keys, p)
+        if start_after is not None:
+            i = max(i, bisect.bisect_right(self.sorted_keys, start_after.encode()))
+
+        n = 0
+        while i < len(self.sorted_keys) and self.sorted_keys[i].startswith(p):
+            if limit and n >= limit:
+                return
+
+            k = self.sorted_keys[i]
+            i += 1
+
+            key = k.decode()
+            if not listed(key, prefix):
+                continue
+
+            yield key, decode_value(self.db[k], self.encoding)
+            n += 1
+
     def keys(self):
-        return sorted([k.decode() for k in self.db.keys()])
+        return self.iter('')
 
     def flush(self):
         self.db.clear()
+        self.sorted_keys.clear()
 
     def __getitem__(self, item: str):
         value = self.get(item)
@@ -141,38 +258,49 @@ class InMemDriver(Driver):
         try:
             del self.db[k]
         except KeyError:
-            pass
+            return
+
+        i = bisect.bisect_left(self.sorted_keys, k)
+        del self.sorted_keys[i]
 
 
 class FSDriver:
     OS_KEY_LIMIT = (256 - 1) - len(FILE_EXT)
 
-    def __init__(self, root='fs'):
+    def __init__(self, root='fs', encoding=JSON):
         self.root = os.path.join(Path.home(), root)
+        self.encoding = encoding
 
     def get(self, item: str):
         try:
             filename = self._key_to_file(item)
-            with open(filename, 'r') as f:
+            with open(filename, 'rb') as f:
                 v = f.read()
 
         except FileNotFoundError:
             return None
 
-        return decode(v)
+        return decode_value(v, self.encoding)
+
+    def get_many(self, keys):
+        return {k: self.get(k) for k in keys}
 
     def set(self, key, value):
         if value is None:
             self.__delitem__(key)
         else:
-            v = encode(value)
+            v = encode_value(value, self.encoding)
             filename = self._key_to_file(key)
 
             os.makedirs(filename.parents[0], exist_ok=True)
 
-            with open(filename, 'w') as f:
+            with open(filename, 'wb') as f:
                 f.write(v)
 
+    def batch_set(self, writes: dict):
+        for key, value in writes.items():
+            self.set(key, value)
+
     def flush(self):
         try:
             shutil.rmtree(self.root)
@@ -191,7 +319,11 @@ class FSDriver:
 
             for f in files:
                 if f.endswith(FILE_EXT) and f.startswith(prefix):
-                    keys.append(self.path_to_key(os.path.join(base, f)))
+                    key = self.path_to_key(os.path.join(base, f))
+
+                    # Files don't keep the delimiters of a key, so tree nodes come back as ~merkle.<node>
+                    if listed(key.replace(config.INDEX_SEPARATOR, config.DELIMITER, 1), prefix):
+                        keys.append(key)
 
                 if 0 < length <= len(keys):
                     break
@@ -203,6 +335,13 @@ class FSDriver:
 
         return keys
 
+    def iter_items(self, prefix: str='', start_after=None, limit=None):
+        keys = [k for k in self.iter(prefix=prefix) if start_after is None or k > start_after]
+        if limit:
+            keys = keys[:limit]
+
+        yield from self.get_many(keys).items()
+
     def _iter(self, prefix: str='', length=0):
         keys = []
 
@@ -282,8 +421,9 @@ class FSDriver:
 
 
 class LMDBDriver:
-    def __init__(self, filename=STORAGE_HOME.joinpath('state')):
+    def __init__(self, filename=STORAGE_HOME.joinpath('state'), encoding=JSON):
         self.filename = filename
+        self.encoding = encoding
         self.filename.mkdir(exist_ok=True, parents=True)
 
         self.db_writer = lmdb.open(path=str(self.filename), map_size=int(1e12), readonly=False)
@@ -296,15 +436,34 @@ class LMDBDriver:
         if v is None:
             return None
 
-        return decode(v)
+        return decode_value(v, self.encoding)
+
+    def get_many(self, keys):
+        # All keys are read in the same transaction
+        values = {}
+        with self.db_reader.begin() as tx:
+            for k in keys:
+                v = tx.get(k.encode())
+                values[k] = None if v is None else decode_value(v, self.encoding)
+
+        return values
 
     def set(self, key, value):
         if value is None:
             self.__delitem__(key)
         else:
-            v = encode(value)
+            v = encode_value(value, self.encoding)
             with self.db_writer.begin(write=True) as tx:
-                tx.put(key.encode(), v.encode())
+                tx.put(key.encode(), v)
+
+    def batch_set(self, writes: dict):
+        # One write transaction for all of the writes instead of one per key
+        with self.db_writer.begin(write=True) as tx:
+            for key, value in writes.items():
+                if value is None:
+                    tx.delete(key.encode())
+                else:
+                    tx.put(key.encode(), encode_value(value, self.encoding))
 
     def flush(self):
         with self.db_writer.begin(write=True) as tx:
@@ -329,6 +488,9 @@ class LMDBDriver:
                     if not key.startswith(prefix.encode()):
                         break
 
+                    if not listed(key.decode(), prefix):
+                        continue
+
                     keys.append(key.decode())
 
                     if len(keys) >= length > 0:
@@ -336,15 +498,33 @@ class LMDBDriver:
 
         return keys
 
-    def keys(self):
-        keys = []
+    def iter_items(self, prefix: str='', start_after=None, limit=None):
+        p = prefix.encode()
+        start = p if start_after is None else max(p, start_after.encode())
 
+        n = 0
         with self.db_reader.begin() as tx:
             cursor = tx.cursor()
-            for key, _ in cursor:
-                keys.append(key.decode())
 
-        return keys
+            if not cursor.set_range(start):
+                return
+
+            for key, value in cursor:
+                if not key.startswith(p) or (limit and n >= limit):
+                    return
+
+                if start_after is not None and key == start_after.encode():
+                    continue
+
+                k = key.decode()
+                if not listed(k, prefix):
+                    continue
+
+                yield k, decode_value(value, self.encoding)
+                n += 1
+
+    def keys(self):
+        return self.iter('')
 
     def __getitem__(self, item: str):
         value = self.get(item)
@@ -377,52 +557,252 @@ class WebDriver(InMemDriver):
         r = requests.get(f'{self.masternode}/contracts/{contract}/{variable}?key={keys}')
         return decode(r.json()['value'])
 
+    def get_many(self, keys):
+        return {k: self.get(k) for k in keys}
+
+
+def convert_encoding(driver, encoding, batch_size=1000):
+    # Rewrites every value in the driver's store with the new encoding. Values are read with the encoding the driver
+    # currently has, one batch at a time, and written back with one batch_set per batch.
+    source = driver.encoding
+    keys = driver.keys() + driver.iter(NODE_PREFIX)
+
+    for i in range(0, len(keys), batch_size):
+        driver.encoding = source
+        values = driver.get_many(keys[i:i + batch_size])
+
+        driver.encoding = encoding
+        driver.batch_set({k: v for k, v in values.items() if v is not None})
+
+    driver.encoding = encoding
+
+
+# Values of these types are never changed in place, so their metered sizes and cached values can be kept
+SIZED_TYPES = {int, str, bool, float, bytes, type(None), ContractingDecimal, Datetime, Timedelta}
+
+
+class Layer:
+    # The state changes soft applied for one HLC. A layer is never changed once it is pushed.
+    def __init__(self, hlc, changes):
+        self.hlc = hlc
+        self.changes = changes
+
+        # What keys were below the layer when it was pushed, for the ones that could be told without reading the db
+        self.before = {}
+
+        # Uncommitted writes the layer took the place of, put back if it is rolled back
+        self.shadowed = {}
+
+        # Contracts whose code the layer changes
+        self.contracts = []
+
+        # Metered sizes of the values, filled in as they are read
+        self.sizes = {}
+
 
 class CacheDriver:
-    def __init__(self, driver: Driver=Driver()):
+    def __init__(self, driver: Driver=Driver(), cache_size=config.STATE_CACHE_SIZE, merkle=False):
         self.driver = driver
-        self.cache = {}
+
+        # A Merkle tree over what is committed through this driver, kept in the same store, for state roots and proofs
+        self.tree = MerkleTree(driver) if merkle else None
+
+        # Uncommitted writes, and a bounded number of committed values kept from block to block. Keys known to be
+        # absent are cached as None.
+        self.cache = StateCache(maxsize=cache_size)
+
+        # Metered size (encoded key + value) of cached values, filled in the first time a value is metered
+        self.sizes = {}
 
         self.reads = set()
         self.pending_writes = {}
 
-        self.pending_deltas = {}
+        # Keys read since the pending state was last cleared. The first read of a committed value in a block is marked,
+        # the same as if every block started with an empty cache.
+        self.touched = set()
 
-    def soft_apply(self, hcl: str, state_changes: dict):
+        # Soft applied state changes, as layers between the cache and the db ordered by HLC, oldest first. Each key
+        # that is in a layer maps to the newest layer it is in.
+        self.layers = []
+        self.layered = {}
+
+        # Bumped by every change to the state the driver shows, so copies of it (a sandbox's workers) can tell when they
+        # are out of date. Commits leave it, as the values shown stay the same.
+        self.version = 0
+
+        # Height of the newest block the pending writes were made in, recorded as committed when they are
+        self.height = None
+
+    @property
+    def pending_deltas(self):
+        # {hlc: {key: (before, after)}} for every layer. Befores that were not known when a layer was pushed are read
+        # from the db, which the layers below them never changed.
         deltas = {}
+        for layer in self.layers:
+            deltas[layer.hlc] = {k: (layer.before[k] if k in layer.before else self.driver.get(k), v)
+                                 for k, v in layer.changes.items()}
+
+        return deltas
+
+    def soft_apply(self, hcl: str, state_changes: dict):
+        # Pushes the changes as a new layer. Nothing is read from the db or metered to do so.
+        layer = Layer(hcl, {})
+        self.version += 1
 
         for k, v in state_changes.items():
-            current = self.get(k)
-            deltas[k] = (current, v)
+            if type(v) == decimal.Decimal or type(v) == float:
+                v = ContractingDecimal(str(v))
+
+            layer.changes[k] = v
+
+            current = self.cache.pop(k, None)
+            self.sizes.pop(k, None)
+
+            if current is not None:
+                layer.before[k] = current
+            elif k in self.layered:
+                layer.before[k] = self.layered[k].changes[k]
+
+            if k in self.pending_writes:
+                layer.shadowed[k] = self.pending_writes.pop(k)
+
+            if k.endswith(COMPILED_KEY):
+                layer.contracts.append(k[:-len(COMPILED_KEY) - 1])
+                invalidate_contract(layer.contracts[-1])
+
+        # HLCs almost always come in order, so this rarely looks past the newest layer
+        i = len(self.layers)
+        while i > 0 and self.layers[i - 1].hlc > hcl:
+            i -= 1
+
+        self.layers.insert(i, layer)
+
+        for k in layer.changes:
+            holder = self.layered.get(k)
+            if holder is None or holder.hlc <= hcl:
+                self.layered[k] = layer
 
-            self.set(k, v)
+    def metered_size(self, runtime, key, value, sizes=None):
+        # Nothing is encoded unless the tracer of the runtime is running
+        if not runtime.tracer.is_started():
+            return 0
 
-        self.pending_deltas[hcl] = deltas
+        if sizes is None:
+            sizes = self.sizes
+
+        size = sizes.get(key)
+        if size is None:
+            size = len(key.encode()) + len(encode(value))
+
+            if type(value) in SIZED_TYPES:
+                sizes[key] = size
+
+        return size
 
     def get(self, key: str, mark=True):
         # Try to get from cache
-        v = self.cache.get(key)
-        if v is not None:
-            rt.deduct_read(*encode_kv(key, v))
-            return v
+        v = self.cache.lookup(key)
+        if v is not MISSING:
+            return self.cached(key, v, mark=mark)
+
+        # Then from the layers, which are never cached so that dropping them leaves nothing behind
+        layer = self.layered.get(key)
+        if layer is not None:
+            return self.layered_value(layer, key, mark=mark)
 
         # If it doesn't exist, get from db, add to cache
-        dv = self.driver.get(key)
-        rt.deduct_read(*encode_kv(key, dv))
+        return self.fetched(key, self.driver.get(key), mark=mark)
+
+    def layered_value(self, layer, key, mark=True):
+        v = layer.changes[key]
 
-        self.cache[key] = dv
+        runtime = get_runtime()
+        runtime.deduct_read_size(self.metered_size(runtime, key, v, sizes=layer.sizes), key=key)
+
+        if mark:
+            self.reads.add(key)
+
+        return v
+
+    def get_many(self, keys, mark=True):
+        # Same as calling get for every key, but the keys that are not cached are fetched from the db at once
+        values = {}
+        missing = []
+
+        for key in keys:
+            v = self.cache.lookup(key)
+            if v is not MISSING:
+                values[key] = self.cached(key, v, mark=mark)
+            elif key in self.layered:
+                values[key] = self.layered_value(self.layered[key], key, mark=mark)
+            else:
+                missing.append(key)
+
+        if missing:
+            for key, v in self.driver.get_many(missing).items():
+                values[key] = self.fetched(key, v, mark=mark)
+
+        return {k: values[k] for k in keys}
+
+    def cached(self, key, value, mark=True):
+        runtime = get_runtime()
+        runtime.deduct_read_size(self.metered_size(runtime, key, value), key=key)
+        return self.touch(key, value, mark=mark)
+
+    def touch(self, key, value, mark=True):
+        # Absent keys are marked every time they are read, as they used to be fetched every time
+        if value is None or (key not in self.touched and key not in self.cache.dirty):
+            self.touched.add(key)
+
+            if mark:
+                self.reads.add(key)
+
+        return value
+
+    def prefetch(self, keys):
+        # Loads the keys that are not in memory yet from the db in one round trip. Nothing is metered or marked: they are
+        # when the keys are read, the same as if they were fetched then.
+        missing = {key for key in keys if key not in self.cache and key not in self.layered}
+        if not missing:
+            return
+
+        for key, value in self.driver.get_many(list(missing)).items():
+            self.sizes.pop(key, None)
+            self.touched.discard(key)
+
+            self.forget(self.cache.fill(key, value, durable=type(value) in SIZED_TYPES))
+
+    def fetched(self, key, value, mark=True):
+        # Meters and caches a value that was just read from the db
+        self.sizes.pop(key, None)
+
+        runtime = get_runtime()
+        runtime.deduct_read_size(self.metered_size(runtime, key, value), key=key)
+
+        self.forget(self.cache.fill(key, value, durable=type(value) in SIZED_TYPES))
+        self.touched.add(key)
 
         # Add key to reads
         if mark:
             self.reads.add(key)
 
-        return dv
+        return value
 
     def set(self, key, value, mark=True):
-        rt.deduct_write(*encode_kv(key, value))
+        self.sizes.pop(key, None)
+
+        runtime = get_runtime()
+        runtime.deduct_write_size(self.metered_size(runtime, key, value), key=key)
 
         if type(value) == decimal.Decimal or type(value) == float:
             value = ContractingDecimal(str(value))
+            self.sizes.pop(key, None)
+
+        # New code for a contract makes its loaded module stale
+        if key.endswith(COMPILED_KEY):
+            invalidate_contract(key[:-len(COMPILED_KEY) - 1])
+
+        self.version += 1
 
         self.cache[key] = value
         if mark:
@@ -431,51 +811,120 @@ class CacheDriver:
     def delete(self, key, mark=True):
         self.set(key, None, mark=mark)
 
+    def peek(self, key: str):
+        # Same as get, but a cached value is returned without being metered. For bookkeeping done between transactions,
+        # when the tracer is stopped and metering a value would only cost time.
+        v = self.cache.lookup(key)
+        if v is not MISSING:
+            return self.touch(key, v)
+
+        layer = self.layered.get(key)
+        if layer is not None:
+            return layer.changes[key]
+
+        return self.fetched(key, self.driver.get(key))
+
+    def put(self, key, value):
+        # Same as set, without metering or converting the value. Only for values that are already contracting types.
+        self.sizes.pop(key, None)
+        self.version += 1
+
+        self.cache[key] = value
+        self.pending_writes[key] = value
+
+    def forget(self, keys):
+        for key in keys:
+            self.sizes.pop(key, None)
+
     def commit(self):
-        for k, v in self.pending_writes.items():
-            if v is None:
-                self.driver.delete(k)
-            else:
-                self.driver.set(k, v)
+        self.driver.batch_set(self.with_tree(self.pending_writes))
+
+        # Committed writes stay cached for the blocks after this one
+        for key, value in self.pending_writes.items():
+            self.forget(self.cache.commit(key, value, durable=type(value) in SIZED_TYPES))
+
+        self.touched.update(self.pending_writes)
+
+        if self.height is not None:
+            commit_height(self.height)
+            self.height = None
+
+    def at_height(self, block_num):
+        # Called for every transaction executed in a block. Clearing the pending state leaves it, as the stamps a failed
+        # transaction paid are still committed in its block.
+        if block_num is not None and (self.height is None or block_num > self.height):
+            self.height = block_num
 
     def hard_apply(self, hlc):
-        # see if the HCL even exists
-        if self.pending_deltas.get(hlc) is None:
+        # Writes every layer up to the one for hlc to the db, in one batch
+        n = next((i + 1 for i, layer in enumerate(self.layers) if layer.hlc == hlc), 0)
+        if n == 0:
             return
 
-        # Run through the sorted HCLs from oldest to newest applying each one until the hcl committed is
+        applied = self.layers[:n]
+        self.layers = self.layers[n:]
+        self.version += 1
 
-        to_delete = []
-        for _hlc, _deltas in sorted(self.pending_deltas.items()):
+        writes = {}
+        for layer in applied:
+            writes.update(layer.changes)
 
-            # Run through all state changes, taking the second value, which is the post delta
-            for key, delta in _deltas.items():
-                self.driver.set(key, delta[1])
+        self.driver.batch_set(self.with_tree(writes))
 
-                try:
-                    self.cache.pop(key)
-                except KeyError:
-                    pass
+        # Keys no newer layer holds are read from the cache from now on
+        for layer in applied:
+            for key, value in layer.changes.items():
+                if self.layered.get(key) is layer:
+                    del self.layered[key]
 
-            # Add the key (
-            to_delete.append(_hlc)
-            if _hlc == hlc:
-                break
+                    self.sizes.pop(key, None)
+                    self.forget(self.cache.fill(key, value, durable=type(value) in SIZED_TYPES))
 
-        # Remove the deltas from the set
-        [self.pending_deltas.pop(key) for key in to_delete]
+    def with_tree(self, writes):
+        # Writes to the db, with the tree nodes they change stored in the same batch
+        if self.tree is None:
+            return writes
 
-    def rollback(self):
-        # Run through the state changes in reverse, reversing the newest to the oldest
-        for _hlc, _deltas in reversed(sorted(self.pending_deltas.items())):
-            # Run through all state changes, taking the first value, which is the pre delta
-            for key, delta in _deltas.items():
-                self.set(key, delta[0])
+        return {**writes, **self.tree.nodes(writes)}
 
-        self.pending_deltas.clear()
+    def rollback(self):
+        # Drops every layer, putting back the uncommitted writes they took the place of. Anything else written on top
+        # of them is left for clear_pending_state.
+        layers = self.layers
+
+        self.layers = []
+        self.layered = {}
+        self.version += 1
+
+        for layer in reversed(layers):
+            for key, value in layer.shadowed.items():
+                self.sizes.pop(key, None)
+                self.cache[key] = value
+                self.pending_writes[key] = value
+
+            for name in layer.contracts:
+                invalidate_contract(name)
+
+    def state_root(self):
+        # Hex digest of the committed state
+        assert self.tree is not None, 'State roots are only kept by drivers made with merkle=True.'
+        return self.tree.root()
+
+    def state_proof(self, key):
+        # Proves the committed value of key under state_root, see merkle.verify
+        assert self.tree is not None, 'State roots are only kept by drivers made with merkle=True.'
+        return self.tree.proof(key)
+
+    def rebuild_state_tree(self):
+        # Hashes the whole committed state into the tree again, for state it never saw
+        assert self.tree is not None, 'State roots are only kept by drivers made with merkle=True.'
+        self.tree.rebuild(self.driver.iter_items())
 
     def clear_pending_state(self):
-        self.cache.clear()
+        # Committed values stay cached
+        self.version += 1
+        self.forget(self.cache.clear_pending())
+        self.touched.clear()
         self.reads.clear()
         self.pending_writes.clear()
 
@@ -485,23 +934,58 @@ class ContractDriver(CacheDriver):
         super().__init__(*args, **kwargs)
         self.delimiter = '.'
 
-    def items(self, prefix=''):
-        # Get all of the items in the cache currently
-        _items = {}
-        keys = set()
-        for k, v in self.cache.items():
-            if k.startswith(prefix) and v is not None:
-                _items[k] = v
-                keys.add(k)
+    def iter_items(self, prefix='', start_after=None, limit=None):
+        # Yields (key, value) pairs under prefix in key order, merging uncommitted and soft applied writes with a cursor
+        # over the db. Written values take precedence (None meaning deleted), and only the values coming from the db are
+        # metered and added to the cache, the same as get.
+        cached = sorted({k for k in itertools.chain(self.cache.dirty.keys(), self.layered.keys())
+                         if k.startswith(prefix) and (start_after is None or k > start_after)})
+
+        # Deleted keys in the cache can hide as many keys in the db
+        stored = self.driver.iter_items(prefix=prefix, start_after=start_after,
+                                        limit=limit + len(cached) if limit else None)
+
+        c = iter(cached)
+        ck = next(c, None)
+        sk, sv = next(stored, (None, None))
+
+        n = 0
+        while ck is not None or sk is not None:
+            if limit and n >= limit:
+                return
+
+            if sk is None or (ck is not None and ck <= sk):
+                key, value = ck, self.pending_value(ck)
+
+                if ck == sk:
+                    sk, sv = next(stored, (None, None))
+                ck = next(c, None)
+
+            else:
+                # Values cached before this block are metered as if they were fetched
+                key = sk
+                if key in self.touched and key in self.cache:
+                    value = self.cache[key]
+                else:
+                    value = self.fetched(key, sv)
 
-        # Get all of the keys we need
-        db_keys = set(self.driver.iter(prefix=prefix))
+                sk, sv = next(stored, (None, None))
 
-        # Subtract the already gotten keys
-        for k in db_keys - keys:
-            _items[k] = self.get(k) # Cache get will add the keys to the cache
+            if value is None:
+                continue
 
-        return _items
+            yield key, value
+            n += 1
+
+    def pending_value(self, key):
+        # The value of a key that is cached or layered, unmetered
+        if key in self.cache or key not in self.layered:
+            return self.cache.get(key)
+
+        return self.layered[key].changes[key]
+
+    def items(self, prefix=''):
+        return dict(self.iter_items(prefix=prefix))
 
     def keys(self, prefix=''):
         return list(self.items(prefix).keys())
@@ -538,6 +1022,9 @@ class ContractDriver(CacheDriver):
     def get_compiled(self, name):
         return self.get_var(name, COMPILED_KEY)
 
+    def get_block_costs(self, name, mark=True):
+        return self.get_var(name, BLOCK_COSTS_KEY, mark=mark)
+
     def set_contract(self, name, code, owner=None, overwrite=False, timestamp=Datetime._from_datetime(datetime.now()), developer=None):
         if self.get_contract(name) is None:
             code_obj = compile(code, '', 'exec')
@@ -545,23 +1032,33 @@ class ContractDriver(CacheDriver):
 
             self.set_var(name, CODE_KEY, value=code)
             self.set_var(name, COMPILED_KEY, value=code_blob)
+            self.set_var(name, BLOCK_COSTS_KEY, value=dump_block_costs(code_obj, rt.cost_schedule))
             self.set_var(name, OWNER_KEY, value=owner)
             self.set_var(name, TIME_KEY, value=timestamp)
             self.set_var(name, DEVELOPER_KEY, value=developer)
 
     def delete_contract(self, name):
+        invalidate_contract(name)
+        self.version += 1
+
+        deleted = {}
         for key in self.keys(name):
-            if self.cache.get(key) is not None:
-                del self.cache[key]
+            self.cache.pop(key)
+            self.sizes.pop(key, None)
 
             if self.pending_writes.get(key) is not None:
                 del self.pending_writes[key]
 
-            self.driver.delete(key)
+            deleted[key] = None
+
+        self.driver.batch_set(self.with_tree(deleted))
 
     def flush(self):
         self.driver.flush()
         self.clear_pending_state()
+        self.cache.clear()
+        self.sizes.clear()
+        clear_contract_caches()
 
     def get_contract_keys(self, name):
         return self.keys(name)
@@ -579,3 +1076,29 @@ class ContractDriver(CacheDriver):
     #     self.cache[key] = None
     #     self.pending_writes[key] = None
 
+
+
+class ReadOnlyDriver(ContractDriver):
+    # The committed state of a database, for one simulation. Reads are cached here, so they never touch the cache of the
+    # driver executing blocks, and any write fails before it is metered or recorded. Values it read are never read again,
+    # so it does not see state committed after them.
+    def set(self, key, value, mark=True):
+        raise AssertionError('State cannot be changed in a simulation.')
+
+    def put(self, key, value):
+        raise AssertionError('State cannot be changed in a simulation.')
+
+    def soft_apply(self, hcl, state_changes):
+        raise AssertionError('State cannot be changed in a simulation.')
+
+    def hard_apply(self, hlc):
+        raise AssertionError('State cannot be changed in a simulation.')
+
+    def delete_contract(self, name):
+        raise AssertionError('State cannot be changed in a simulation.')
+
+    def flush(self):
+        raise AssertionError('State cannot be changed in a simulation.')
+
+    def commit(self):
+        pass
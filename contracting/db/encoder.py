@@ -1,5 +1,6 @@
 import json
 import decimal
+import struct
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from contracting.stdlib.bridge.decimal import ContractingDecimal, MAX_LOWER_PRECISION, fix_precision
 from contracting.config import INDEX_SEPARATOR, DELIMITER
@@ -59,8 +60,14 @@ class Encoder(json.JSONEncoder):
         return super().default(o)
 
 
+PRIMITIVES = {int, str, bool, type(None)}
+
+
 # JSON library from Python 3 doesn't let you instantiate your custom Encoder. You have to pass it as an obj to json
 def encode(data: str):
+    # Plain values never reach Encoder.default, so they can skip building one
+    if type(data) in PRIMITIVES:
+        return json.dumps(data)
     return json.dumps(data, cls=Encoder, separators=(',', ':'))
 
 
@@ -91,6 +98,221 @@ def decode(data):
         return None
 
 
+##
+# BINARY ENCODING
+# A compact alternative to JSON for storage. Every value is a one byte tag followed by its payload. Variable length
+# payloads are prefixed with their length as an unsigned LEB128 varint. Lists and dicts are prefixed with their number
+# of items, and dicts keep their insertion order, so the output is deterministic in the same way JSON is.
+#
+# Decimals are stored as the same fixed precision string the JSON encoder uses, so values read back identically with
+# either encoding. All tags are control characters that never start a JSON document, so decode_binary can fall back to
+# JSON for values that were written before a store was switched over.
+##
+
+TAG_NONE = 0x00
+TAG_FALSE = 0x01
+TAG_TRUE = 0x02
+TAG_INT = 0x03
+TAG_FLOAT = 0x04
+TAG_STR = 0x05
+TAG_BYTES = 0x06
+TAG_FIXED = 0x07
+TAG_TIME = 0x08
+TAG_DELTA = 0x09
+TAG_LIST = 0x0A
+TAG_DICT = 0x0B
+
+FLOAT = struct.Struct('>d')
+TIME = struct.Struct('>HBBBBBI')
+DELTA = struct.Struct('>iI')
+
+JSON = 'json'
+BINARY = 'binary'
+
+
+def _varint(n: int):
+    b = bytearray()
+    while n > 0x7F:
+        b.append((n & 0x7F) | 0x80)
+        n >>= 7
+    b.append(n)
+    return bytes(b)
+
+
+def _int_bytes(i: int):
+    return i.to_bytes((i.bit_length() + 8) // 8, 'big', signed=True)
+
+
+def _sized(tag: int, payload: bytes):
+    return bytes((tag,)) + _varint(len(payload)) + payload
+
+
+def _dict_key(k):
+    # Same key coercion json.dumps does
+    if isinstance(k, str):
+        return k
+    elif k is True:
+        return 'true'
+    elif k is False:
+        return 'false'
+    elif k is None:
+        return 'null'
+    elif isinstance(k, (int, float)):
+        return json.dumps(k)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {k.__class__.__name__}')
+
+
+def _encode_binary(o, out: list):
+    t = type(o)
+
+    if t is str:
+        out.append(_sized(TAG_STR, o.encode()))
+    elif t is int:
+        out.append(_sized(TAG_INT, _int_bytes(o)))
+    elif o is None:
+        out.append(bytes((TAG_NONE,)))
+    elif t is bool:
+        out.append(bytes((TAG_TRUE if o else TAG_FALSE,)))
+    elif t is dict or isinstance(o, dict):
+        out.append(bytes((TAG_DICT,)) + _varint(len(o)))
+        for k, v in o.items():
+            out.append(_sized(TAG_STR, _dict_key(k).encode()))
+            _encode_binary(v, out)
+    elif t is list or t is tuple or isinstance(o, (list, tuple)):
+        out.append(bytes((TAG_LIST,)) + _varint(len(o)))
+        for v in o:
+            _encode_binary(v, out)
+    elif isinstance(o, Datetime) or t.__name__ == Datetime.__name__:
+        out.append(bytes((TAG_TIME,)) + TIME.pack(o.year, o.month, o.day, o.hour, o.minute, o.second, o.microsecond))
+    elif isinstance(o, Timedelta) or t.__name__ == Timedelta.__name__:
+        out.append(bytes((TAG_DELTA,)) + DELTA.pack(o._timedelta.days, o._timedelta.seconds))
+    elif isinstance(o, bytes):
+        out.append(_sized(TAG_BYTES, o))
+    elif isinstance(o, decimal.Decimal) or t.__name__ == decimal.Decimal.__name__:
+        out.append(_sized(TAG_FIXED, str(fix_precision(o)).encode()))
+    elif isinstance(o, ContractingDecimal) or t.__name__ == ContractingDecimal.__name__:
+        out.append(_sized(TAG_FIXED, str(fix_precision(o._d)).encode()))
+    elif isinstance(o, float):
+        out.append(bytes((TAG_FLOAT,)) + FLOAT.pack(o))
+    elif isinstance(o, int):
+        out.append(_sized(TAG_INT, _int_bytes(int(o))))
+    elif isinstance(o, str):
+        out.append(_sized(TAG_STR, str(o).encode()))
+    else:
+        raise TypeError(f'Object of type {t.__name__} is not serializable')
+
+
+def encode_binary(data) -> bytes:
+    # Fast path for the values most state holds
+    t = type(data)
+    if t is int:
+        return _sized(TAG_INT, _int_bytes(data))
+    elif t is str:
+        return _sized(TAG_STR, data.encode())
+
+    out = []
+    _encode_binary(data, out)
+    return b''.join(out)
+
+
+def _read_varint(data: bytes, i: int):
+    n = 0
+    shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+
+def _read_sized(data: bytes, i: int):
+    n, i = _read_varint(data, i)
+    return data[i:i + n], i + n
+
+
+def _decode_binary(data: bytes, i: int):
+    tag = data[i]
+    i += 1
+
+    if tag == TAG_STR:
+        b, i = _read_sized(data, i)
+        return b.decode(), i
+    elif tag == TAG_INT:
+        b, i = _read_sized(data, i)
+        return int.from_bytes(b, 'big', signed=True), i
+    elif tag == TAG_NONE:
+        return None, i
+    elif tag == TAG_FALSE:
+        return False, i
+    elif tag == TAG_TRUE:
+        return True, i
+    elif tag == TAG_FIXED:
+        b, i = _read_sized(data, i)
+        return ContractingDecimal(b.decode()), i
+    elif tag == TAG_DICT:
+        n, i = _read_varint(data, i)
+        d = {}
+        for _ in range(n):
+            k, i = _decode_binary(data, i)
+            d[k], i = _decode_binary(data, i)
+        return d, i
+    elif tag == TAG_LIST:
+        n, i = _read_varint(data, i)
+        l = []
+        for _ in range(n):
+            v, i = _decode_binary(data, i)
+            l.append(v)
+        return l, i
+    elif tag == TAG_FLOAT:
+        return FLOAT.unpack_from(data, i)[0], i + FLOAT.size
+    elif tag == TAG_BYTES:
+        b, i = _read_sized(data, i)
+        return bytes(b), i
+    elif tag == TAG_TIME:
+        return Datetime(*TIME.unpack_from(data, i)), i + TIME.size
+    elif tag == TAG_DELTA:
+        days, seconds = DELTA.unpack_from(data, i)
+        return Timedelta(days=days, seconds=seconds), i + DELTA.size
+
+    raise ValueError(f'Unknown tag {tag} at position {i - 1}')
+
+
+def decode_binary(data):
+    if data is None:
+        return None
+
+    if isinstance(data, str):
+        return decode(data)
+
+    if len(data) == 0 or data[0] > TAG_DICT:
+        # Written as JSON before the store was converted
+        return decode(data)
+
+    try:
+        value, i = _decode_binary(data, 0)
+    except (ValueError, IndexError, struct.error, UnicodeDecodeError):
+        return None
+
+    if i != len(data):
+        return None
+
+    return value
+
+
+def encode_value(data, encoding=JSON) -> bytes:
+    if encoding == BINARY:
+        return encode_binary(data)
+    return encode(data).encode()
+
+
+def decode_value(data, encoding=JSON):
+    if encoding == BINARY:
+        return decode_binary(data)
+    return decode(data)
+
+
 def make_key(contract, variable, args=[]):
     contract_variable = INDEX_SEPARATOR.join((contract, variable))
     if args:
@@ -0,0 +1,179 @@
+from contracting.db.encoder import encode
+from contracting import config
+import hashlib
+
+# A Merkle tree over the committed state, kept in the same store as the state itself. Keys are placed by the sha3 of
+# the key: the first MERKLE_DEPTH hex digits pick one of 16 ** MERKLE_DEPTH leaf buckets, each holding the hash of every
+# key and value in it. Interior nodes hold the hashes of their 16 children. Only the nodes above the keys that were
+# written are read, hashed again and stored, so the cost of a commit depends on the writes and not on the size of the
+# state. Empty subtrees are never stored and hash to EMPTY.
+
+# Contract names can't contain '~', so no key of the state itself starts with it. Drivers leave keys under it out of
+# what they list, unless they are asked for them by this prefix.
+NODE_PREFIX = '~merkle:'
+
+EMPTY = '0' * 64
+
+NIBBLES = '0123456789abcdef'
+
+# Keys hashed at once when the tree is built again from the whole state
+REBUILD_BATCH = 10000
+
+
+def digest(*parts):
+    h = hashlib.sha3_256()
+    for part in parts:
+        h.update(part)
+
+    return h.hexdigest()
+
+
+def path_of(key, depth):
+    return hashlib.sha3_256(key.encode()).hexdigest()[:depth]
+
+
+def key_bytes(key):
+    # Length prefixed, so no key can be read as the start of another
+    k = key.encode()
+    return len(k).to_bytes(4, 'big') + k
+
+
+def entry_hash(key, value):
+    return digest(key_bytes(key), encode(value).encode())
+
+
+def bucket_hash(bucket):
+    # Keys are hashed in along with their entries, so a bucket can't be passed off with its entries under other keys
+    if not bucket:
+        return EMPTY
+
+    return digest(b'\x00', *(key_bytes(k) + bytes.fromhex(bucket[k]) for k in sorted(bucket)))
+
+
+def node_hash(children):
+    if not children:
+        return EMPTY
+
+    return digest(b'\x01', *(bytes.fromhex(children.get(n, EMPTY)) for n in NIBBLES))
+
+
+def bucket_key(path):
+    return '{}b{}'.format(NODE_PREFIX, path)
+
+
+def node_key(path):
+    return '{}n{}'.format(NODE_PREFIX, path)
+
+
+def verify(root, key, value, proof):
+    # Whether proof shows key holds value under root. A value of None checks that the key is absent.
+    bucket, nodes = proof[0], proof[1:]
+    path = path_of(key, len(nodes))
+
+    # Every key of the bucket the key is placed in goes in that bucket
+    if any(path_of(k, len(nodes)) != path for k in bucket):
+        return False
+
+    if value is None:
+        if key in bucket:
+            return False
+    elif bucket.get(key) != entry_hash(key, value):
+        return False
+
+    h = bucket_hash(bucket)
+    for level, node in zip(range(len(nodes) - 1, -1, -1), nodes):
+        if node.get(path[level], EMPTY) != h:
+            return False
+
+        h = node_hash(node)
+
+    return h == root
+
+
+class MerkleTree:
+    def __init__(self, store, depth=config.MERKLE_DEPTH):
+        self.store = store
+        self.depth = depth
+
+    def update(self, writes):
+        self.store.batch_set(self.nodes(writes))
+
+    def nodes(self, writes):
+        # The nodes to store for writes to be in the tree, {node key: node}, None deleting a node. Drivers store them in
+        # the same batch as the writes, so the tree never differs from the state it is over.
+        if not writes:
+            return {}
+
+        changes = {}
+        for key, value in writes.items():
+            changes.setdefault(path_of(key, self.depth), {})[key] = value
+
+        nodes = {}
+        hashes = {}
+
+        buckets = self.store.get_many([bucket_key(path) for path in changes])
+        for path, values in changes.items():
+            bucket = buckets[bucket_key(path)] or {}
+
+            for key, value in values.items():
+                if value is None:
+                    bucket.pop(key, None)
+                else:
+                    bucket[key] = entry_hash(key, value)
+
+            nodes[bucket_key(path)] = bucket or None
+            hashes[path] = bucket_hash(bucket)
+
+        # Then every level up to the root, one round trip each
+        for level in range(self.depth - 1, -1, -1):
+            parents = {}
+            for path, h in hashes.items():
+                parents.setdefault(path[:level], {})[path[level]] = h
+
+            loaded = self.store.get_many([node_key(path) for path in parents])
+
+            hashes = {}
+            for path, children in parents.items():
+                node = loaded[node_key(path)] or {}
+
+                for nibble, h in children.items():
+                    if h == EMPTY:
+                        node.pop(nibble, None)
+                    else:
+                        node[nibble] = h
+
+                nodes[node_key(path)] = node or None
+                hashes[path] = node_hash(node)
+
+        return nodes
+
+    def root(self):
+        return node_hash(self.store.get(node_key('')) or {})
+
+    def proof(self, key):
+        # The bucket the key is placed in, then every interior node above it up to the root. It proves the value of the
+        # key, or that it is absent.
+        path = path_of(key, self.depth)
+        keys = [bucket_key(path)] + [node_key(path[:level]) for level in range(self.depth - 1, -1, -1)]
+
+        loaded = self.store.get_many(keys)
+
+        return [loaded[k] or {} for k in keys]
+
+    def rebuild(self, items):
+        # Builds the tree again from (key, value) pairs of the whole state. For a store that has state the tree never
+        # saw, such as one written before the tree was kept.
+        self.store.batch_set({key: None for key in self.store.iter(NODE_PREFIX)})
+
+        batch = {}
+        for key, value in items:
+            if key.startswith(NODE_PREFIX):
+                continue
+
+            batch[key] = value
+
+            if len(batch) >= REBUILD_BATCH:
+                self.update(batch)
+                batch = {}
+
+        self.update(batch)
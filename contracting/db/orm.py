@@ -97,6 +97,21 @@ class Hash(Datum):
         prefix = self._prefix_for_args(args)
         return self._driver.items(prefix=prefix)
 
+    def iter(self, *args, start_after=None, limit=None):
+        # Lazily yields (key, value) pairs under args in key order. Keys are relative to the hash, so the last key of
+        # one page can be passed as start_after to get the next.
+        prefix = self._prefix_for_args(args)
+        base = len(self._key) + len(self._delimiter)
+
+        if start_after is not None:
+            start_after = '{}{}{}'.format(self._key, self._delimiter, self._validate_key(start_after))
+
+        for k, v in self._driver.iter_items(prefix=prefix, start_after=start_after, limit=limit):
+            if type(v) == float or type(v) == ContractingDecimal:
+                v = ContractingDecimal(str(v))
+
+            yield k[base:], v
+
     def clear(self, *args):
         kvs = self._items(*args)
         for k in kvs.keys():
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from contracting import config
+import threading
+
+
+class LRUCache:
+    def __init__(self, maxsize=config.MODULE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+        # Shared by the runtimes of every thread
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, validate=None):
+        with self.lock:
+            value = self.entries.get(key)
+
+            # Entries that fail validation are stale and are dropped
+            if value is not None and validate is not None and not validate(value):
+                del self.entries[key]
+                value = None
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            return self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries)
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ScheduledCache:
+    # An LRUCache for every cost schedule. Cached code carries block costs and warm modules a recorded cost, both priced
+    # with the schedule of the runtime that cached them, so runtimes on different schedules (a simulation on another
+    # thread) each use the entries of their own instead of dropping the other's.
+    def __init__(self, maxsize=config.MODULE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.caches = {}
+
+        # Shared by the runtimes of every thread, and by the cache of every schedule
+        self.lock = threading.RLock()
+
+    def cache(self):
+        # The cache of the schedule the runtime of the current context prices with
+        version = _schedule_version.get()
+
+        with self.lock:
+            cache = self.caches.get(version)
+            if cache is None:
+                cache = LRUCache(maxsize=self.maxsize)
+                cache.lock = self.lock
+                self.caches[version] = cache
+
+            return cache
+
+    @property
+    def entries(self):
+        return self.cache().entries
+
+    @entries.setter
+    def entries(self, entries):
+        self.cache().entries = entries
+
+    def get(self, key, validate=None):
+        return self.cache().get(key, validate=validate)
+
+    def set(self, key, value):
+        self.cache().set(key, value)
+
+    def pop(self, key):
+        # Dropped for every schedule
+        with self.lock:
+            values = [cache.pop(key) for cache in self.caches.values()]
+
+        return next((v for v in values if v is not None), None)
+
+    def clear(self):
+        with self.lock:
+            for cache in self.caches.values():
+                cache.clear()
+
+    @property
+    def hits(self):
+        return sum(cache.hits for cache in list(self.caches.values()))
+
+    @property
+    def misses(self):
+        return sum(cache.misses for cache in list(self.caches.values()))
+
+    @property
+    def evictions(self):
+        return sum(cache.evictions for cache in list(self.caches.values()))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': sum(len(cache) for cache in list(self.caches.values()))
+        }
+
+    def reset_stats(self):
+        for cache in list(self.caches.values()):
+            cache.reset_stats()
+
+    def __contains__(self, key):
+        return key in self.cache()
+
+    def __len__(self):
+        return len(self.cache())
+
+
+# Version of the cost schedule the runtime of the current context prices with, see price_contract_caches
+_schedule_version = ContextVar('schedule_version', default=None)
+
+# Unmarshalled contract code keyed by contract name. Entries are (code hash, code object).
+CODE_CACHE = ScheduledCache()
+
+# Executed contract namespaces keyed by contract name. An entry is only reused while its code hash matches the code
+# cached for the contract.
+NAMESPACE_CACHE = ScheduledCache()
+
+
+def invalidate_contract(name):
+    CODE_CACHE.pop(name)
+    NAMESPACE_CACHE.pop(name)
+
+
+def clear_contract_caches():
+    CODE_CACHE.clear()
+    NAMESPACE_CACHE.clear()
+
+
+def price_contract_caches(schedule):
+    # Called by a runtime whenever it prices with a schedule, so the current context uses the caches of that schedule
+    _schedule_version.set(schedule.version)
@@ -1,12 +1,17 @@
-import importlib
 from contracting.execution import runtime
-from contracting.db.driver import ContractDriver
+from contracting.db.driver import ContractDriver, ReadOnlyDriver, CODE_KEY, COMPILED_KEY, BLOCK_COSTS_KEY, OWNER_KEY
+from contracting.db.orm import Datum, Hash
+from contracting.execution.cache import CODE_CACHE, NAMESPACE_CACHE
 from contracting.execution.module import install_database_loader, uninstall_builtins, enable_restricted_imports, disable_restricted_imports
+from contracting.execution import parallel
+from contracting.execution.sandbox import Sandbox
+from contracting.execution.metering.costs import schedule_at
+from contracting.execution.stamps import StampLedger
 from contracting.stdlib.bridge.decimal import ContractingDecimal, CONTEXT
-from contracting.stdlib.bridge.random import Seeded
 from contracting import config
 from copy import deepcopy
 import decimal
+import multiprocessing
 from logging import getLogger
 
 log = getLogger('CONTRACTING')
@@ -14,7 +19,8 @@ import traceback
 
 class Executor:
     def __init__(self, production=False, driver=None, metering=True,
-                 currency_contract='currency', balances_hash='balances', bypass_privates=False):
+                 currency_contract='currency', balances_hash='balances', bypass_privates=False, instrumentation=None,
+                 processes=None):
 
         self.metering = metering
 
@@ -27,8 +33,20 @@ class Executor:
         self.currency_contract = currency_contract
         self.balances_hash = balances_hash
 
+        # Checks and charges what senders pay for stamps
+        self.stamps = StampLedger(currency_contract=currency_contract, balances_hash=balances_hash)
+
         self.bypass_privates = bypass_privates
 
+        # An Instrumentation that every executed transaction is profiled into
+        self.instrumentation = instrumentation
+
+        # In production mode transactions are executed by a pool of worker processes. Instrumented executors measure
+        # every transaction themselves, so they always execute in process.
+        self.sandbox = None
+        if production and instrumentation is None and 'fork' in multiprocessing.get_all_start_methods():
+            self.sandbox = Sandbox(self, processes=processes)
+
         runtime.rt.env.update({'__Driver': self.driver})
 
     def wipe_modules(self):
@@ -41,57 +59,94 @@ class Executor:
                 driver=None,
                 stamps=1000000,
                 stamp_cost=config.STAMPS_PER_TAU,
-                metering=None) -> dict:
+                metering=None,
+                profile=False) -> dict:
 
         if not self.bypass_privates:
             assert not function_name.startswith(config.PRIVATE_METHOD_PREFIX), 'Private method not callable.'
 
+        tx = {
+            'sender': sender,
+            'contract_name': contract_name,
+            'function_name': function_name,
+            'kwargs': kwargs,
+            'environment': environment,
+            'stamps': stamps,
+            'stamp_cost': stamp_cost,
+            'metering': metering,
+            'profile': profile
+        }
+
+        # The block's height is recorded as committed along with its writes
+        (driver or self.driver).at_height(environment.get('block_num'))
+
+        # The sandbox's workers only keep up with the executor's own driver
+        if self.sandbox is not None and (driver is None or driver is self.driver):
+            return self.sandbox.execute(tx, auto_commit=auto_commit)
+
+        return self.execute_in_process(**tx, auto_commit=auto_commit, driver=driver)
+
+    def execute_in_process(self, sender, contract_name, function_name, kwargs,
+                           environment={},
+                           auto_commit=False,
+                           driver=None,
+                           stamps=1000000,
+                           stamp_cost=config.STAMPS_PER_TAU,
+                           metering=None,
+                           profile=False,
+                           simulation=False) -> dict:
+
         if metering is None:
             metering = self.metering
 
-        runtime.rt.env.update({'__Driver': self.driver})
+        # Simulations are not instrumented, as they can run on other threads while blocks are executed
+        instrumentation = self.instrumentation if not simulation else None
+
+        # The runtime of this context, looked up once rather than on every access
+        rt = runtime.get_runtime()
+
+        requested_profile = profile
+        if instrumentation is not None:
+            profile = True
+            self.instrumentation.start(rt.tracer)
+
+        # A simulation leaves the runtime reading through the driver it had
+        previous = rt.env.get('__Driver', self.driver), rt.loader_driver
+
+        rt.env.update({'__Driver': self.driver})
 
         if driver:
-            runtime.rt.env.update({'__Driver': driver})
+            rt.env.update({'__Driver': driver})
         else:
-            driver = runtime.rt.env.get('__Driver')
+            driver = rt.env.get('__Driver')
 
         install_database_loader(driver=driver)
 
-        balances_key = None
         try:
-            if metering:
-                balances_key = '{}{}{}{}{}'.format(self.currency_contract,
-                                                   config.INDEX_SEPARATOR,
-                                                   self.balances_hash,
-                                                   config.DELIMITER,
-                                                   sender)
-
-                balance = driver.get(balances_key)
-                if balance is None:
-                    balance = 0
-
-                assert balance * stamp_cost >= stamps, 'Sender does not have enough stamps for the transaction. \
-                                                               Balance at key {} is {}'.format(balances_key,
-                                                                                               balance)
-
-            runtime.rt.env.update(environment)
+            if metering and not simulation:
+                assert self.stamps.can_pay(driver, sender, stamps, stamp_cost), \
+                    'Sender does not have enough stamps for the transaction. Balance at key {} is {}'.format(
+                        self.stamps.key(sender), self.stamps.balance(driver, sender))
+
+            rt.env.update(environment)
+            rt.use_cost_schedule(schedule_at(rt.env.get('block_num')))
+
             status_code = 0
-            runtime.rt.set_up(stmps=stamps * 1000, meter=metering) # Multiply stamps by 1000 because we divide by it later
+            rt.set_up(stmps=stamps * 1000, meter=metering, profile=profile) # Multiply stamps by 1000 because we divide by it later
 
-            runtime.rt.context._base_state = {
+            rt.context._base_state = {
                 'signer': sender,
                 'caller': sender,
                 'this': contract_name,
                 'owner': driver.get_owner(contract_name)
             }
 
-            if runtime.rt.context.owner is not None and runtime.rt.context.owner != runtime.rt.context.caller:
-                raise Exception(f'Caller {runtime.rt.context.caller} is not the owner {runtime.rt.context.owner}!')
+            if rt.context.owner is not None and rt.context.owner != rt.context.caller:
+                raise Exception(f'Caller {rt.context.caller} is not the owner {rt.context.owner}!')
 
             decimal.setcontext(CONTEXT)
 
-            module = importlib.import_module(contract_name)
+            module = rt.import_contract(contract_name)
             func = getattr(module, function_name)
 
             for k, v in kwargs.items():
@@ -114,10 +169,13 @@ class Executor:
             if auto_commit:
                 driver.clear_pending_state()
 
-        runtime.rt.tracer.stop()
+        rt.tracer.stop()
+
+        if profile:
+            profile = rt.profile()
 
         # Deduct the stamps if that is enabled
-        stamps_used = runtime.rt.tracer.get_stamp_used()
+        stamps_used = rt.tracer.get_stamp_used()
 
         stamps_used = stamps_used // 1000
         stamps_used += 1
@@ -126,39 +184,153 @@ class Executor:
         if stamps_used > stamps:
             stamps_used = stamps
 
-        if metering:
-            assert balances_key is not None, 'Balance key was not set properly. Cannot deduct stamps.'
-
-            to_deduct = stamps_used
-
-            to_deduct /= stamp_cost
-
-            to_deduct = ContractingDecimal(to_deduct)
-
-            balance = driver.get(balances_key)
-            if balance is None:
-                balance = 0
+        if metering and not simulation:
+            self.stamps.deduct(driver, sender, stamps_used, stamp_cost)
 
-            balance = max(balance - to_deduct, 0)
-
-            driver.set(balances_key, balance)
-                       #mark=False)  # This makes sure that the key isnt modified every time in the block
             if auto_commit:
                 driver.commit()
 
-        Seeded.s = False
-        runtime.rt.clean_up()
-        runtime.rt.env.update({'__Driver': driver})
+        rt.clean_up()
+
+        if simulation:
+            rt.env['__Driver'], rt.loader_driver = previous
+        else:
+            rt.env.update({'__Driver': driver})
 
         output = {
             'status_code': status_code,
             'result': result,
             'stamps_used': stamps_used,
-            'writes': deepcopy(driver.pending_writes),
             'reads': driver.reads
         }
 
+        # A simulation has nothing to write
+        if not simulation:
+            output['writes'] = deepcopy(driver.pending_writes)
+
+        # What each contract, function, line and key cost, when asked for
+        if profile:
+            output['profile'] = profile
+
+        if instrumentation is not None:
+            instrumentation.stop(output)
+
+            if not requested_profile:
+                del output['profile']
+
         disable_restricted_imports()
 
         return output
 
+    def simulate(self, sender, contract_name, function_name, kwargs,
+                 environment={},
+                 driver=None,
+                 stamps=1000000,
+                 metering=None,
+                 profile=False) -> dict:
+        # Executes a read only call, such as a balance check or a stamp estimate, without changing any state. Nothing is
+        # charged, the first write fails the call, and the output has no writes. Without a ReadOnlyDriver, the call
+        # reads the committed state through a new one, so it can run on another thread while blocks are executed and
+        # sees every block committed before it.
+        if not self.bypass_privates:
+            assert not function_name.startswith(config.PRIVATE_METHOD_PREFIX), 'Private method not callable.'
+
+        if driver is None:
+            driver = ReadOnlyDriver(driver=self.driver.driver)
+
+        assert isinstance(driver, ReadOnlyDriver), 'Simulations need a ReadOnlyDriver.'
+
+        return self.execute_in_process(sender=sender, contract_name=contract_name, function_name=function_name,
+                                       kwargs=kwargs, environment=environment, driver=driver, stamps=stamps,
+                                       metering=metering, profile=profile, simulation=True)
+
+    def access_list(self, tx, driver):
+        # Keys a transaction is likely to read: the sender's balance, the contract's owner and code, and the variables
+        # of the contract, with hashes keyed by the sender and by every string argument. Variables are only known for
+        # contracts whose namespace is warm.
+        sender, name = tx['sender'], tx['contract_name']
+        keys = [self.stamps.key(sender), driver.make_key(name, OWNER_KEY)]
+
+        if name not in CODE_CACHE:
+            keys.extend(driver.make_key(name, k) for k in (CODE_KEY, COMPILED_KEY, BLOCK_COSTS_KEY))
+
+        with NAMESPACE_CACHE.lock:
+            warm = NAMESPACE_CACHE.entries.get(name)
+
+        if warm is not None:
+            arguments = [sender] + [v for v in tx['kwargs'].values() if isinstance(v, str)]
+
+            for value in warm.scope.values():
+                if isinstance(value, Hash):
+                    keys.extend(value._delimiter.join((value._key, a)) for a in arguments)
+                elif isinstance(value, Datum):
+                    keys.append(value._key)
+
+        return keys
+
+    def prefetch(self, transactions, driver=None):
+        # Loads what the transactions are likely to read in one round trip, so the block pays for it once up front
+        # rather than key by key inside contract code
+        driver = driver or self.driver
+
+        keys = []
+        for tx in transactions:
+            keys.extend(self.access_list(tx, driver))
+
+        driver.prefetch(keys)
+
+    def execute_bag(self, transactions, environment={}, auto_commit=False, driver=None) -> list:
+        # Each transaction is a dict of the keyword arguments to execute. A transaction can carry its own
+        # 'environment', which is applied on top of the one shared by the whole bag.
+
+        # Workers in the sandbox read through their own drivers, so there is only something to prefetch in process.
+        if self.sandbox is None or (driver is not None and driver is not self.driver):
+            self.prefetch(transactions, driver=driver)
+
+        # Senders' balances are kept for the whole bag
+        self.stamps.begin(driver or self.driver)
+
+        try:
+            outputs = []
+            for tx in transactions:
+                output = self.execute(**self.with_environment(tx, environment), auto_commit=auto_commit, driver=driver)
+                outputs.append(output)
+        finally:
+            self.stamps.end()
+
+        return outputs
+
+    def execute_parallel(self, transactions, environment={}, auto_commit=False, driver=None, processes=None) -> list:
+        # Same as execute_bag, but transactions are first run speculatively across a pool of forked processes and only
+        # the ones that conflict with an earlier transaction are executed again
+        # Instrumented executors run every transaction themselves, so that all of them are measured
+        if processes == 1 or len(transactions) < 2 or 'fork' not in multiprocessing.get_all_start_methods() \
+                or self.instrumentation is not None:
+            return self.execute_bag(transactions, environment=environment, auto_commit=auto_commit, driver=driver)
+
+        transactions = [self.with_environment(tx, environment) for tx in transactions]
+
+        for tx in transactions:
+            (driver or self.driver).at_height(tx['environment'].get('block_num'))
+
+        if self.sandbox is not None and (driver is None or driver is self.driver):
+            outputs = self.sandbox.execute_parallel(transactions, auto_commit=auto_commit)
+        else:
+            # Prefetched values are in the snapshot every worker starts from
+            self.prefetch(transactions, driver=driver)
+            outputs = parallel.execute_parallel(self, transactions, driver=driver or self.driver,
+                                                auto_commit=auto_commit, processes=processes)
+
+        runtime.rt.env.update({'__Driver': driver or self.driver})
+
+        return outputs
+
+    @staticmethod
+    def with_environment(tx, environment):
+        tx = dict(tx)
+
+        tx_environment = dict(environment)
+        tx_environment.update(tx.pop('environment', {}))
+        tx['environment'] = tx_environment
+
+        return tx
@@ -0,0 +1,116 @@
+import contracting
+from contracting import config
+from array import array
+import dis
+import os
+
+# Cost schedules. A schedule prices every opcode of the interpreter and caps the stamps and memory a transaction can
+# use. Each has a version and the block height it takes effect at, so opcodes can be re-priced by registering a new
+# schedule instead of rebuilding the tracer. All nodes must register the same schedules for metering to agree.
+
+CU_COSTS_PATH = os.path.join(contracting.__path__[0], 'execution', 'metering', 'cu_costs.const')
+
+OPCODE_COUNT = 256
+
+# Price of opcodes a schedule has no entry for. Only the default schedule can have any: its table prices every opcode of
+# Python 3.6 to 3.10, and opcodes of newer interpreters cost this until the table prices them. Registered schedules
+# must price every opcode of the interpreter.
+UNKNOWN_OPCODE_COST = 4
+
+
+def read_costs(path=CU_COSTS_PATH):
+    # One 'opcode,cost' pair per line
+    costs = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                opcode, cost = line.split(',')
+                costs[int(opcode)] = int(cost)
+
+    return costs
+
+
+def unpriced_opcodes(costs: dict):
+    return sorted(name for name, opcode in dis.opmap.items() if opcode not in costs)
+
+
+def validate_costs(costs: dict, complete=True):
+    for opcode, cost in costs.items():
+        if type(opcode) != int or not 0 <= opcode < OPCODE_COUNT:
+            raise ValueError('{} is not an opcode.'.format(opcode))
+
+        if type(cost) != int or cost < 0:
+            raise ValueError('Cost of opcode {} must be a positive integer.'.format(opcode))
+
+    if not complete:
+        return
+
+    missing = unpriced_opcodes(costs)
+    if len(missing) > 0:
+        raise ValueError('Cost table has no price for {}.'.format(', '.join(missing)))
+
+
+class CostSchedule:
+    def __init__(self, version: int, costs: dict, max_stamps=config.MAX_STAMPS, max_memory=config.MAX_MEMORY, height=0):
+        validate_costs(costs, complete=False)
+
+        # Opcodes of this interpreter that are charged UNKNOWN_OPCODE_COST
+        self.unpriced = unpriced_opcodes(costs)
+
+        self.version = version
+        self.costs = [costs.get(opcode, UNKNOWN_OPCODE_COST) for opcode in range(OPCODE_COUNT)]
+        self.max_stamps = max_stamps
+        self.max_memory = max_memory
+        self.height = height
+
+    def buffer(self):
+        # The layout Tracer.set_costs expects
+        return array('Q', self.costs).tobytes()
+
+
+SCHEDULES = {}
+
+
+def register_schedule(schedule: CostSchedule):
+    if schedule.version in SCHEDULES:
+        raise ValueError('Cost schedule {} is already registered.'.format(schedule.version))
+
+    if len(schedule.unpriced) > 0:
+        raise ValueError('Cost schedule {} has no price for {}.'.format(schedule.version, ', '.join(schedule.unpriced)))
+
+    SCHEDULES[schedule.version] = schedule
+
+
+def unregister_schedule(version: int):
+    if version == DEFAULT_SCHEDULE.version:
+        raise ValueError('The default cost schedule cannot be removed.')
+
+    SCHEDULES.pop(version, None)
+
+
+# Height of the newest block committed in this process. Drivers set it as they commit blocks, and nodes that start on an
+# existing chain set it to the chain's height before executing anything.
+_committed_height = None
+
+
+def commit_height(block_num):
+    global _committed_height
+
+    if _committed_height is None or block_num > _committed_height:
+        _committed_height = block_num
+
+
+def schedule_at(block_num=None):
+    # The schedule in effect at a block height. Without one, the schedule in effect at the last committed height is used,
+    # so calls made outside of a block never use a schedule registered for a block still to come.
+    if block_num is None:
+        block_num = _committed_height if _committed_height is not None else 0
+
+    schedules = [s for s in SCHEDULES.values() if s.height <= block_num]
+    return max(schedules, key=lambda s: (s.height, s.version))
+
+
+# Registered without checking that it prices every opcode, so the package can be imported on any interpreter
+DEFAULT_SCHEDULE = CostSchedule(version=1, costs=read_costs())
+SCHEDULES[DEFAULT_SCHEDULE.version] = DEFAULT_SCHEDULE
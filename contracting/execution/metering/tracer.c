@@ -6,10 +6,8 @@
 #include "structmember.h"
 #include "frameobject.h"
 
-#include <sys/resource.h>
 
-
-#include <stdio.h>          /* For reading CU cu_costs */
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 
@@ -33,14 +31,67 @@
 #define RET_OK      0
 #define RET_ERROR   -1
 
-unsigned long long cu_costs[] = {2, 4, 5, 2, 4, 1000, 1000, 1000, 2, 2, 3, 2, 1000, 1000, 4, 1000, 1000, 1000, 30, 3,
-                                1000, 4, 3, 3, 3, 4, 4, 4, 5, 1000, 1000, 1000, 1000, 6, 30, 7, 12, 1000, 1610, 4, 7,
-                                1000, 6, 6, 6, 6, 6, 2, 15, 15, 2, 126, 1000, 4, 4, 4, 4, 2, 2, 8, 8, 2, 6, 6, 4, 4,
-                                1000, 2, 2, 2, 5, 8, 7, 4, 4, 38, 126, 4, 4, 4, 4, 4, 4, 3, 1000, 1000, 2, 4, 2, 3,
-                                1000, 2, 2, 2, 1000, 1000, 1000, 5, 9, 7, 12, 1000, 7, 2, 2, 2, 1000, 1000, 12, 12, 15,
-                                2, 8, 8, 5, 2, 5, 7, 9, 2, 8, 15, 30, 7, 8, 4};
+/* Until a cost table is set from Python, every opcode is charged this much */
+#define DEFAULT_OPCODE_COST 4
+#define DEFAULT_MAX_STAMPS 6500000
+#define DEFAULT_MAX_MEMORY (8 * 1024 * 1024)
+#define OPCODE_COUNT 256
+
+/* Interned once so checking a frame's globals doesn't allocate */
+static PyObject *contract_key = NULL;
+
+/* Code objects known to belong to a contract are flagged in their co_extra slot */
+static Py_ssize_t contract_code_index = -1;
+#define CONTRACT_CODE ((void *) 1)
+
+/* Code objects loaded with their basic block costs carry a table instead of the flag, indexed by instruction. Only the
+   first instruction of a block is charged, for the whole block. */
+#define NOT_A_BLOCK ((unsigned long long) -1)
+
+typedef struct {
+    Py_ssize_t length;
+    unsigned long long costs[];
+} BlockCosts;
 
-unsigned long long MAX_STAMPS = 6500000;
+static void
+free_code_extra(void *extra)
+{
+    if (extra != CONTRACT_CODE) {
+        PyMem_Free(extra);
+    }
+}
+
+/* Python 3.7+ can emit an event per opcode. Older versions only report lines, in which case only the first opcode of
+   each line is charged. */
+#if PY_VERSION_HEX >= 0x03070000
+#define OPCODE_EVENTS 1
+#else
+#define OPCODE_EVENTS 0
+#endif
+
+/* The current thread state, without failing when there is none */
+#if PY_VERSION_HEX >= 0x030D0000
+#define CURRENT_THREAD_STATE() PyThreadState_GetUnchecked()
+#else
+#define CURRENT_THREAD_STATE() _PyThreadState_UncheckedGet()
+#endif
+
+/* f_lasti counts code units from 3.10 and bytes before */
+#if PY_VERSION_HEX >= 0x030A0000
+#define LASTI_OFFSET(frame) ((frame)->f_lasti * sizeof(_Py_CODEUNIT))
+#else
+#define LASTI_OFFSET(frame) ((frame)->f_lasti)
+#endif
+
+/* Blocks allocated while a transaction runs are kept in an open addressing table of pointer to size, so that freeing
+   them gives the bytes back. Freed slots are left as tombstones until the table is rebuilt. */
+#define FREED_BLOCK ((void *) 1)
+#define MIN_ALLOCATIONS 1024
+
+typedef struct {
+    void *ptr;
+    size_t size;
+} Allocation;
 
 
 /* The Tracer type. */
@@ -48,31 +99,362 @@ unsigned long long MAX_STAMPS = 6500000;
 typedef struct {
     PyObject_HEAD
 
+    /* Price of each opcode and the most any transaction may cost, set with set_costs */
+    unsigned long long opcode_costs[OPCODE_COUNT];
+    unsigned long long max_stamps;
+
+    /* Most bytes a transaction may have allocated at once, set with set_costs */
+    unsigned long long max_memory;
+
     /* Variables to keep track of metering */
     unsigned long long cost;
     unsigned long long stamp_supplied;
-    long last_frame_mem_usage;
-    long total_mem_usage;
     int started;
-    char *cu_cost_fname;
+
+    /* Bytes allocated by the running transaction and not freed yet, and the most there have been at once */
+    unsigned long long memory;
+    unsigned long long peak_memory;
+
+    /* Whether allocations are being counted, and whether counting is paused while the tracer itself allocates */
+    int counting;
+    int paused;
+
+    /* Blocks the running transaction allocated. Only capacity is allocated when empty. */
+    Allocation *allocations;
+    size_t allocations_capacity;
+    size_t allocations_used;
+    size_t allocations_live;
+
+    /* While profiling, the cost charged to each line of contract code as {(code, line): cost}. NULL otherwise. */
+    PyObject *profile;
 
 } Tracer;
 
 static int
 Tracer_init(Tracer *self, PyObject *args, PyObject *kwds)
 {
-    //char *fname = getenv("CU_COST_FNAME");
-
-    //read_cu_costs(fname, self->cu_costs); // Read cu cu_costs from ones interpreted in Python
+    for (int i = 0; i < OPCODE_COUNT; i++) {
+        self->opcode_costs[i] = DEFAULT_OPCODE_COST;
+    }
+    self->max_stamps = DEFAULT_MAX_STAMPS;
+    self->max_memory = DEFAULT_MAX_MEMORY;
 
     self->started = 0;
     self->cost = 0;
-    self->last_frame_mem_usage = 0;
-    self->total_mem_usage = 0;
+    self->memory = 0;
+    self->peak_memory = 0;
+    self->counting = 0;
+    self->paused = 0;
+    self->allocations = NULL;
+    self->allocations_capacity = 0;
+    self->allocations_used = 0;
+    self->allocations_live = 0;
+    self->profile = NULL;
 
     return RET_OK;
 }
 
+/*
+ * Memory accounting. While any tracer is started, the allocators of the object and mem domains are wrapped so that
+ * every block a thread allocates while one of its contract frames is executing is counted against the transaction its
+ * tracer is metering, until it is freed. What the executor, drivers and caches allocate in their own frames is never
+ * counted or refused, so it can't make a transaction fail depending on what a node has cached. Both domains are only
+ * used with the GIL held. The raw domain, used by the table itself, is left alone.
+ */
+
+static int
+Tracer_trace(Tracer *self, PyFrameObject *frame, int what, PyObject *arg);
+
+/* Tracers counting allocations. The allocators are wrapped while there are any. */
+static int counting_tracers = 0;
+static PyMemAllocatorEx original_mem_allocator;
+static PyMemAllocatorEx original_obj_allocator;
+
+static size_t
+allocation_slot(void *ptr, size_t capacity)
+{
+    // Blocks are at least 8 byte aligned, so the low bits carry nothing. The rest are mixed so that blocks next to each
+    // other spread over the table.
+    unsigned long long h = (unsigned long long)(uintptr_t)ptr >> 3;
+    h ^= h >> 33;
+    h *= 0xff51afd7ed558ccdULL;
+    h ^= h >> 33;
+
+    return (size_t)h & (capacity - 1);
+}
+
+static int
+Tracer_rebuild_allocations(Tracer *self)
+{
+    // Rebuilding drops the tombstones. The table only grows when most of it holds blocks that are still allocated.
+    size_t capacity = self->allocations_capacity;
+    if (capacity == 0) {
+        capacity = MIN_ALLOCATIONS;
+    }
+    else if (self->allocations_live * 4 > capacity) {
+        capacity *= 2;
+    }
+
+    Allocation *allocations = PyMem_RawCalloc(capacity, sizeof(Allocation));
+    if (allocations == NULL) {
+        return RET_ERROR;
+    }
+
+    size_t used = 0;
+    for (size_t i = 0; i < self->allocations_capacity; i++) {
+        Allocation *a = &self->allocations[i];
+        if (a->ptr != NULL && a->ptr != FREED_BLOCK) {
+            size_t slot = allocation_slot(a->ptr, capacity);
+            while (allocations[slot].ptr != NULL) {
+                slot = (slot + 1) & (capacity - 1);
+            }
+            allocations[slot] = *a;
+            used++;
+        }
+    }
+
+    PyMem_RawFree(self->allocations);
+    self->allocations = allocations;
+    self->allocations_capacity = capacity;
+    self->allocations_used = used;
+
+    return RET_OK;
+}
+
+static void
+Tracer_track(Tracer *self, void *ptr, size_t size)
+{
+    if ((self->allocations_used + 1) * 2 > self->allocations_capacity && Tracer_rebuild_allocations(self) != RET_OK) {
+        // Without room to remember the block it is still counted, it just never gives its bytes back
+        self->memory += size;
+    }
+    else {
+        // Allocators hand freed addresses out again right away, so the first tombstone on the way is reused
+        Allocation *entry = NULL;
+        size_t slot = allocation_slot(ptr, self->allocations_capacity);
+
+        while (self->allocations[slot].ptr != NULL) {
+            Allocation *a = &self->allocations[slot];
+
+            if (a->ptr == ptr) {
+                // Freed where it couldn't be seen, by another thread, and handed out again
+                self->memory -= a->size;
+                self->allocations_live--;
+                entry = a;
+                break;
+            }
+
+            if (a->ptr == FREED_BLOCK && entry == NULL) {
+                entry = a;
+            }
+
+            slot = (slot + 1) & (self->allocations_capacity - 1);
+        }
+
+        if (entry == NULL) {
+            entry = &self->allocations[slot];
+            self->allocations_used++;
+        }
+
+        entry->ptr = ptr;
+        entry->size = size;
+        self->allocations_live++;
+        self->memory += size;
+    }
+
+    if (self->memory > self->peak_memory) {
+        self->peak_memory = self->memory;
+    }
+}
+
+static int
+Tracer_untrack(Tracer *self, void *ptr)
+{
+    // Whether the block was counted
+    if (self->allocations_capacity == 0 || ptr == NULL) {
+        return 0;
+    }
+
+    // Blocks allocated before the transaction started, or outside of contract frames, are not in the table
+    size_t slot = allocation_slot(ptr, self->allocations_capacity);
+    while (self->allocations[slot].ptr != NULL) {
+        if (self->allocations[slot].ptr == ptr) {
+            self->memory -= self->allocations[slot].size;
+            self->allocations[slot].ptr = FREED_BLOCK;
+            self->allocations_live--;
+            return 1;
+        }
+        slot = (slot + 1) & (self->allocations_capacity - 1);
+    }
+
+    return 0;
+}
+
+static void
+Tracer_clear_allocations(Tracer *self)
+{
+    if (self->allocations != NULL) {
+        memset(self->allocations, 0, self->allocations_capacity * sizeof(Allocation));
+    }
+    self->allocations_used = 0;
+    self->allocations_live = 0;
+    self->memory = 0;
+    self->peak_memory = 0;
+}
+
+static Tracer *
+metering_tracer(PyThreadState *tstate)
+{
+    // The tracer metering the thread, if it is counting
+    if (tstate == NULL || tstate->c_tracefunc != (Py_tracefunc)Tracer_trace) {
+        return NULL;
+    }
+
+    Tracer *tracer = (Tracer *)tstate->c_traceobj;
+    return tracer->counting ? tracer : NULL;
+}
+
+static Tracer *
+allocating_tracer(void)
+{
+    // The tracer to count an allocation against: only while a contract frame is executing. Code objects are flagged as
+    // contract code when their frames are called, so this never has to look at globals or allocate.
+    PyThreadState *tstate = CURRENT_THREAD_STATE();
+    Tracer *tracer = metering_tracer(tstate);
+    if (tracer == NULL || tracer->paused || tstate->frame == NULL) {
+        return NULL;
+    }
+
+    void *extra = NULL;
+    if (contract_code_index < 0
+            || _PyCode_GetExtra((PyObject *)tstate->frame->f_code, contract_code_index, &extra) != 0
+            || extra == NULL) {
+        return NULL;
+    }
+
+    return tracer;
+}
+
+static void *
+counted_malloc(void *ctx, size_t size)
+{
+    PyMemAllocatorEx *allocator = (PyMemAllocatorEx *)ctx;
+    Tracer *tracer = allocating_tracer();
+
+    // A single block bigger than the limit can never be paid for, so a contract asking for one is refused outright
+    if (tracer != NULL && size > tracer->max_memory) {
+        return NULL;
+    }
+
+    void *ptr = allocator->malloc(allocator->ctx, size);
+    if (ptr != NULL && tracer != NULL) {
+        Tracer_track(tracer, ptr, size);
+    }
+
+    return ptr;
+}
+
+static void *
+counted_calloc(void *ctx, size_t nelem, size_t elsize)
+{
+    PyMemAllocatorEx *allocator = (PyMemAllocatorEx *)ctx;
+    Tracer *tracer = allocating_tracer();
+
+    if (tracer != NULL && elsize != 0 && nelem > tracer->max_memory / elsize) {
+        return NULL;
+    }
+
+    void *ptr = allocator->calloc(allocator->ctx, nelem, elsize);
+    if (ptr != NULL && tracer != NULL) {
+        Tracer_track(tracer, ptr, nelem * elsize);
+    }
+
+    return ptr;
+}
+
+static void *
+counted_realloc(void *ctx, void *ptr, size_t new_size)
+{
+    PyMemAllocatorEx *allocator = (PyMemAllocatorEx *)ctx;
+    Tracer *tracer = allocating_tracer();
+
+    if (tracer != NULL && new_size > tracer->max_memory) {
+        return NULL;
+    }
+
+    void *new_ptr = allocator->realloc(allocator->ctx, ptr, new_size);
+    if (new_ptr == NULL) {
+        return NULL;
+    }
+
+    // A block the transaction allocated stays counted whoever grows it
+    Tracer *metering = tracer != NULL ? tracer : metering_tracer(CURRENT_THREAD_STATE());
+    if (metering != NULL && Tracer_untrack(metering, ptr) && tracer == NULL) {
+        tracer = metering;
+    }
+
+    if (tracer != NULL) {
+        Tracer_track(tracer, new_ptr, new_size);
+    }
+
+    return new_ptr;
+}
+
+static void
+counted_free(void *ctx, void *ptr)
+{
+    PyMemAllocatorEx *allocator = (PyMemAllocatorEx *)ctx;
+
+    // Blocks are given back wherever they are freed
+    Tracer *tracer = metering_tracer(CURRENT_THREAD_STATE());
+
+    if (tracer != NULL) {
+        Tracer_untrack(tracer, ptr);
+    }
+
+    allocator->free(allocator->ctx, ptr);
+}
+
+static void
+Tracer_count_allocations(Tracer *self)
+{
+    if (self->counting) {
+        return;
+    }
+
+    self->counting = 1;
+    if (counting_tracers++ > 0) {
+        return;
+    }
+
+    PyMemAllocatorEx mem = {&original_mem_allocator, counted_malloc, counted_calloc, counted_realloc, counted_free};
+    PyMemAllocatorEx obj = {&original_obj_allocator, counted_malloc, counted_calloc, counted_realloc, counted_free};
+
+    PyMem_GetAllocator(PYMEM_DOMAIN_MEM, &original_mem_allocator);
+    PyMem_GetAllocator(PYMEM_DOMAIN_OBJ, &original_obj_allocator);
+
+    PyMem_SetAllocator(PYMEM_DOMAIN_MEM, &mem);
+    PyMem_SetAllocator(PYMEM_DOMAIN_OBJ, &obj);
+}
+
+static void
+Tracer_stop_counting_allocations(Tracer *self)
+{
+    if (!self->counting) {
+        return;
+    }
+
+    self->counting = 0;
+    if (--counting_tracers > 0) {
+        return;
+    }
+
+    // Blocks allocated while counting are freed through the original allocators from now on, which is where they
+    // came from
+    PyMem_SetAllocator(PYMEM_DOMAIN_MEM, &original_mem_allocator);
+    PyMem_SetAllocator(PYMEM_DOMAIN_OBJ, &original_obj_allocator);
+}
+
 static void
 Tracer_dealloc(Tracer *self)
 {
@@ -80,6 +462,11 @@ Tracer_dealloc(Tracer *self)
         PyEval_SetTrace(NULL, NULL);
     }
 
+    Tracer_stop_counting_allocations(self);
+    PyMem_RawFree(self->allocations);
+
+    Py_XDECREF(self->profile);
+
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -88,82 +475,199 @@ Tracer_dealloc(Tracer *self)
  * The Trace Function
  */
 
- static long get_memory_usage() {
-    struct rusage r_usage;
-    getrusage(RUSAGE_SELF,&r_usage);
+static int
+is_contract_frame(PyFrameObject *frame)
+{
+    // IF, Frame object globals contains __contract__, it is contract code
+    void *extra = NULL;
+    PyObject *code = (PyObject *)frame->f_code;
 
-//    printf("%ld\n", r_usage.ru_maxrss);
+    if (contract_code_index >= 0 && _PyCode_GetExtra(code, contract_code_index, &extra) == 0 && extra != NULL) {
+        return 1;
+    }
 
-    return r_usage.ru_maxrss;
- }
+    if (PyDict_GetItem(frame->f_globals, contract_key) == NULL) {
+        return 0;
+    }
 
- static int
- Tracer_trace(Tracer *self, PyFrameObject *frame, int what, PyObject *arg)
- {
-    unsigned long long estimate = 0;
-    unsigned long long factor = 1000;
-    const char *str;
-     // IF, Frame object globals contains __contract__ and it is true, continue
+    if (contract_code_index >= 0) {
+        _PyCode_SetExtra(code, contract_code_index, CONTRACT_CODE);
+    }
 
-     PyObject *kv = PyUnicode_FromString("__contract__");
-     int t = PyDict_Contains(frame->f_globals, kv);
-     Py_DECREF(kv);
+    return 1;
+}
 
-     if (t != 1) {
-        return RET_OK;
-     }
+static int
+Tracer_fail(Tracer *self, const char *message)
+{
+    PyErr_SetString(PyExc_AssertionError, message);
+    PyEval_SetTrace(NULL, NULL);
+    Tracer_stop_counting_allocations(self);
+    self->started = 0;
+    return RET_ERROR;
+}
 
-     if (self->last_frame_mem_usage == 0) {
-        self->last_frame_mem_usage = get_memory_usage();
-     }
+static int
+Tracer_check_memory(Tracer *self)
+{
+    if (self->peak_memory > self->max_memory) {
+        return Tracer_fail(self, "Transaction exceeded memory usage!\n");
+    }
 
-     int opcode;
+    return RET_OK;
+}
 
-     switch (what) {
-         case PyTrace_LINE:      /* 2 */
-             // printf("LINE\n");
-             str = PyBytes_AS_STRING(frame->f_code->co_code);
-             opcode = str[frame->f_lasti];
+static int
+Tracer_check_stamps(Tracer *self)
+{
+    if ((self->cost > self->stamp_supplied) || self->cost > self->max_stamps) {
+        return Tracer_fail(self, "The cost has exceeded the stamp supplied!\n");
+    }
 
-             if (opcode < 0) opcode = -opcode;
+    return RET_OK;
+}
 
-             estimate = (self->cost + cu_costs[opcode]) / factor;
-             estimate = estimate + 1;
+static BlockCosts *
+get_block_costs(PyCodeObject *code)
+{
+    void *extra = NULL;
 
-             long new_memory_usage = get_memory_usage();
+    if (contract_code_index < 0 || _PyCode_GetExtra((PyObject *)code, contract_code_index, &extra) != 0) {
+        return NULL;
+    }
 
-             if (new_memory_usage > self->last_frame_mem_usage) {
-                self->total_mem_usage += (new_memory_usage - self->last_frame_mem_usage);
-             }
+    if (extra == CONTRACT_CODE) {
+        return NULL;
+    }
 
-             self->last_frame_mem_usage = new_memory_usage;
+    return (BlockCosts *)extra;
+}
 
-             //estimate = estimate * factor;
-             if ((self->cost > self->stamp_supplied) || self->cost > MAX_STAMPS) {
-                 PyErr_SetString(PyExc_AssertionError, "The cost has exceeded the stamp supplied!\n");
-                 PyEval_SetTrace(NULL, NULL);
-                 self->started = 0;
-                 return RET_ERROR;
-             }
+static int
+Tracer_record(Tracer *self, PyFrameObject *frame, unsigned long long cost)
+{
+    // Add the cost to the line being executed. Blocks are charged to the line they start on.
+    int line = PyCode_Addr2Line(frame->f_code, (int)LASTI_OFFSET(frame));
+    PyObject *key = Py_BuildValue("(Oi)", frame->f_code, line);
+    if (key == NULL) {
+        return RET_ERROR;
+    }
 
-             if (self->total_mem_usage > 2000) {
-                 PyErr_SetString(PyExc_AssertionError, "Transaction exceeded memory usage!\n");
-                 PyEval_SetTrace(NULL, NULL);
-                 self->started = 0;
-                 return RET_ERROR;
-             }
+    unsigned long long total = cost;
+    PyObject *previous = PyDict_GetItem(self->profile, key);
+    if (previous != NULL) {
+        total += PyLong_AsUnsignedLongLong(previous);
+    }
 
-             self->cost += cu_costs[opcode];
-             break;
+    PyObject *value = PyLong_FromUnsignedLongLong(total);
+    int result = value == NULL ? -1 : PyDict_SetItem(self->profile, key, value);
 
-         default:
-             break;
-     }
+    Py_DECREF(key);
+    Py_XDECREF(value);
+
+    return result == 0 ? RET_OK : RET_ERROR;
+}
+
+static int
+Tracer_charge(Tracer *self, PyFrameObject *frame)
+{
+    size_t offset = LASTI_OFFSET(frame);
+    unsigned long long cost;
+
+#if OPCODE_EVENTS
+    BlockCosts *blocks = get_block_costs(frame->f_code);
+#else
+    // Lines don't line up with blocks, so without opcode events every contract is charged per line
+    BlockCosts *blocks = NULL;
+#endif
+
+    if (blocks != NULL) {
+        // Charge the block starting here, if one does
+        cost = blocks->costs[offset / sizeof(_Py_CODEUNIT)];
+        if (cost == NOT_A_BLOCK) {
+            return RET_OK;
+        }
+    }
+    else {
+        // Charge the opcode about to be executed
+        unsigned char opcode = (unsigned char)PyBytes_AS_STRING(frame->f_code->co_code)[offset];
+        cost = self->opcode_costs[opcode];
+    }
+
+    if (Tracer_check_stamps(self) != RET_OK) {
+        return RET_ERROR;
+    }
+
+    self->cost += cost;
+
+    if (self->profile != NULL) {
+        // What the profile itself allocates is not the transaction's
+        self->paused = 1;
+        int result = Tracer_record(self, frame, cost);
+        self->paused = 0;
 
+        if (result != RET_OK) {
+            return RET_ERROR;
+        }
+    }
+
+    return Tracer_check_memory(self);
+}
+
+static void
+trace_opcodes(PyFrameObject *frame)
+{
+#if OPCODE_EVENTS
+    // Every opcode of the frame is reported from now on, and its lines no longer are
+    frame->f_trace_opcodes = 1;
+    frame->f_trace_lines = 0;
+#endif
+}
+
+static int
+Tracer_trace(Tracer *self, PyFrameObject *frame, int what, PyObject *arg)
+{
+    switch (what) {
+        case PyTrace_CALL:
+            if (!is_contract_frame(frame)) {
+#if OPCODE_EVENTS
+                frame->f_trace_lines = 0;
+#endif
+                return RET_OK;
+            }
+
+            trace_opcodes(frame);
+
+            if (Tracer_check_stamps(self) != RET_OK) {
+                return RET_ERROR;
+            }
+
+            return Tracer_check_memory(self);
+
+        case PyTrace_LINE:
+            // Frames that were already running when the tracer started still report lines
+            if (!is_contract_frame(frame)) {
+                return RET_OK;
+            }
+
+#if OPCODE_EVENTS
+            // The opcode event for this instruction follows right after, and is charged there
+            trace_opcodes(frame);
+            return RET_OK;
+#else
+            return Tracer_charge(self, frame);
+#endif
 
+#if OPCODE_EVENTS
+        case PyTrace_OPCODE:
+            // Only contract frames trace opcodes
+            return Tracer_charge(self, frame);
+#endif
 
-     return RET_OK;
- }
+        default:
+            return RET_OK;
+    }
+}
 
 static PyObject *
 Tracer_start(Tracer *self, PyObject *args)
@@ -171,6 +675,13 @@ Tracer_start(Tracer *self, PyObject *args)
     PyEval_SetTrace((Py_tracefunc)Tracer_trace, (PyObject*)self);
     self->cost = 0;
 
+    if (self->profile != NULL) {
+        PyDict_Clear(self->profile);
+    }
+
+    Tracer_clear_allocations(self);
+    Tracer_count_allocations(self);
+
     self->started = 1;
     return Py_BuildValue("");
 }
@@ -180,6 +691,7 @@ Tracer_stop(Tracer *self, PyObject *args)
 {
     if (self->started) {
         PyEval_SetTrace(NULL, NULL);
+        Tracer_stop_counting_allocations(self);
         self->started = 0;
     }
 
@@ -199,8 +711,9 @@ Tracer_reset(Tracer *self)
     self->cost = 0;
     self->stamp_supplied = 0;
     self->started = 0;
-    self->last_frame_mem_usage = 0;
-    self->total_mem_usage = 0;
+    Tracer_stop_counting_allocations(self);
+    Tracer_clear_allocations(self);
+    Py_CLEAR(self->profile);
 
     return Py_BuildValue("");
 }
@@ -217,6 +730,7 @@ Tracer_add_cost(Tracer *self, PyObject *args, PyObject *kwds)
     if (self->cost > self->stamp_supplied) {
          PyErr_SetString(PyExc_AssertionError, "The cost has exceeded the stamp supplied!\n");
          PyEval_SetTrace(NULL, NULL);
+         Tracer_stop_counting_allocations(self);
          self->started = 0;
          return NULL;
      }
@@ -224,6 +738,133 @@ Tracer_add_cost(Tracer *self, PyObject *args, PyObject *kwds)
     return Py_BuildValue("");
 }
 
+static PyObject *
+Tracer_set_costs(Tracer *self, PyObject *args)
+{
+    // Takes the price of every opcode as a buffer of OPCODE_COUNT unsigned long longs, the stamp ceiling and optionally
+    // the memory ceiling in bytes
+    Py_buffer costs;
+    unsigned long long max_stamps;
+    unsigned long long max_memory = DEFAULT_MAX_MEMORY;
+
+    if (!PyArg_ParseTuple(args, "y*K|K", &costs, &max_stamps, &max_memory)) {
+        return NULL;
+    }
+
+    if (costs.len != sizeof(self->opcode_costs)) {
+        PyBuffer_Release(&costs);
+        PyErr_Format(PyExc_ValueError, "Cost table must hold %d opcodes", OPCODE_COUNT);
+        return NULL;
+    }
+
+    memcpy(self->opcode_costs, costs.buf, sizeof(self->opcode_costs));
+    self->max_stamps = max_stamps;
+    self->max_memory = max_memory;
+
+    PyBuffer_Release(&costs);
+
+    return Py_BuildValue("");
+}
+
+static PyObject *
+Tracer_set_block_costs(Tracer *self, PyObject *args)
+{
+    // Takes a code object and the cost of each of its basic blocks as ((offset, cost), ...)
+    PyCodeObject *code;
+    PyObject *table;
+
+    if (!PyArg_ParseTuple(args, "O!O", &PyCode_Type, &code, &table)) {
+        return NULL;
+    }
+
+    if (contract_code_index < 0) {
+        return Py_BuildValue("");
+    }
+
+    PyObject *items = PySequence_Fast(table, "Block costs must be a sequence of (offset, cost) pairs");
+    if (items == NULL) {
+        return NULL;
+    }
+
+    Py_ssize_t length = PyBytes_GET_SIZE(code->co_code) / sizeof(_Py_CODEUNIT);
+    BlockCosts *blocks = PyMem_Malloc(sizeof(BlockCosts) + length * sizeof(unsigned long long));
+    if (blocks == NULL) {
+        Py_DECREF(items);
+        return PyErr_NoMemory();
+    }
+
+    blocks->length = length;
+    for (Py_ssize_t i = 0; i < length; i++) {
+        blocks->costs[i] = NOT_A_BLOCK;
+    }
+
+    for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(items); i++) {
+        Py_ssize_t offset;
+        unsigned long long cost;
+
+        if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(items, i), "nK", &offset, &cost)) {
+            goto error;
+        }
+
+        if (offset < 0 || offset % sizeof(_Py_CODEUNIT) != 0 || offset / (Py_ssize_t)sizeof(_Py_CODEUNIT) >= length
+                || cost == NOT_A_BLOCK) {
+            PyErr_SetString(PyExc_ValueError, "Block cost does not fit the code object");
+            goto error;
+        }
+
+        blocks->costs[offset / sizeof(_Py_CODEUNIT)] = cost;
+    }
+
+    Py_DECREF(items);
+
+    // Replaces a table or the contract flag set before
+    free_code_extra(get_block_costs(code));
+
+    if (_PyCode_SetExtra((PyObject *)code, contract_code_index, blocks) != 0) {
+        PyMem_Free(blocks);
+        return NULL;
+    }
+
+    return Py_BuildValue("");
+
+error:
+    Py_DECREF(items);
+    PyMem_Free(blocks);
+    return NULL;
+}
+
+static PyObject *
+Tracer_set_profiling(Tracer *self, PyObject *args)
+{
+    int enabled;
+
+    if (!PyArg_ParseTuple(args, "p", &enabled)) {
+        return NULL;
+    }
+
+    if (!enabled) {
+        Py_CLEAR(self->profile);
+    }
+    else if (self->profile == NULL) {
+        self->profile = PyDict_New();
+        if (self->profile == NULL) {
+            return NULL;
+        }
+    }
+
+    return Py_BuildValue("");
+}
+
+static PyObject *
+Tracer_get_profile(Tracer *self, PyObject *args)
+{
+    if (self->profile == NULL) {
+        return PyDict_New();
+    }
+
+    return PyDict_Copy(self->profile);
+}
+
 static PyObject *
 Tracer_get_stamp_used(Tracer *self, PyObject *args, PyObject *kwds)
 {
@@ -234,13 +875,13 @@ Tracer_get_stamp_used(Tracer *self, PyObject *args, PyObject *kwds)
 static PyObject *
 Tracer_get_last_frame_mem_usage(Tracer *self, PyObject *args, PyObject *kwds)
 {
-    return Py_BuildValue("L", self->last_frame_mem_usage);
+    return Py_BuildValue("K", self->memory);
 }
 
 static PyObject *
 Tracer_get_total_mem_usage(Tracer *self, PyObject *args, PyObject *kwds)
 {
-    return Py_BuildValue("L", self->total_mem_usage);
+    return Py_BuildValue("K", self->peak_memory);
 }
 
 static PyObject *
@@ -272,14 +913,26 @@ Tracer_methods[] = {
     { "set_stamp",  (PyCFunction) Tracer_set_stamp,     METH_VARARGS,
             PyDoc_STR("Set the stamp before starting the tracer") },
 
+    { "set_costs",  (PyCFunction) Tracer_set_costs,     METH_VARARGS,
+            PyDoc_STR("Set the cost of every opcode and the most stamps and memory a transaction can use") },
+
+    { "set_block_costs",  (PyCFunction) Tracer_set_block_costs,     METH_VARARGS,
+            PyDoc_STR("Set the cost of each basic block of a code object, charged when the block is entered") },
+
+    { "set_profiling",  (PyCFunction) Tracer_set_profiling,     METH_VARARGS,
+            PyDoc_STR("Record the cost of every line of contract code. Turned off again by reset.") },
+
+    { "get_profile",  (PyCFunction) Tracer_get_profile,     METH_VARARGS,
+            PyDoc_STR("Get the cost charged to each line as {(code, line): cost}") },
+
     { "get_stamp_used",  (PyCFunction) Tracer_get_stamp_used,     METH_VARARGS,
             PyDoc_STR("Get the stamp usage after it's been completed") },
 
     { "get_last_frame_mem_usage",  (PyCFunction) Tracer_get_last_frame_mem_usage,     METH_VARARGS,
-            PyDoc_STR("Get the memory usage of the last Python frame processed.") },
+            PyDoc_STR("Get the bytes allocated by the transaction and not freed yet") },
 
     { "get_total_mem_usage",  (PyCFunction) Tracer_get_total_mem_usage,     METH_VARARGS,
-            PyDoc_STR("Get the total memory usage after it's been completed") },
+            PyDoc_STR("Get the most bytes the transaction had allocated at once") },
 
     { "is_started",  (PyCFunction) Tracer_is_started,     METH_VARARGS,
             PyDoc_STR("Returns 1 if tracer is started, 0 if not.") },
@@ -362,6 +1015,9 @@ PyInit_tracer(void)
 
     TracerType.tp_new = PyType_GenericNew;
 
+    contract_key = PyUnicode_InternFromString("__contract__");
+    contract_code_index = _PyEval_RequestCodeExtraIndex(free_code_extra);
+
     if (PyType_Ready(&TracerType) < 0) {
         Py_DECREF(mod);
         Py_DECREF(&TracerType);
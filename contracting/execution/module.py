@@ -4,12 +4,19 @@ import importlib.util
 from importlib.abc import Loader, MetaPathFinder, PathEntryFinder
 from importlib import invalidate_caches, __import__
 from importlib.machinery import ModuleSpec
-from contracting.db.driver import ContractDriver
+from contracting.db.driver import ContractDriver, ReadOnlyDriver
 from contracting.stdlib import env
-from contracting.execution.runtime import rt
-from types import ModuleType
+from contracting.execution.runtime import rt, get_runtime
+from contracting.execution.cache import CODE_CACHE, NAMESPACE_CACHE
+from contracting.compilation.blocks import load_block_costs
+from contracting.db.orm import Datum
+from contracting.stdlib.bridge.decimal import ContractingDecimal
+from contracting.stdlib.bridge.time import Datetime, Timedelta
+from contextlib import ContextDecorator
+from types import ModuleType, FunctionType
 import marshal
 import builtins
+import hashlib
 
 # This function overrides the __import__ function, which is the builtin function that is called whenever Python runs
 # an 'import' statement. If the globals dictionary contains {'__contract__': True}, then this function will make sure
@@ -27,21 +34,40 @@ def is_valid_import(name):
 
 
 def restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
-    if globals is not None and globals.get('__contract__') is True:
-        spec = importlib.util.find_spec(name)
-        if spec is None or not isinstance(spec.loader, DatabaseLoader):
-            raise ImportError("module {} cannot be imported in a smart contract.".format(name))
+    if globals is None or globals.get('__contract__') is not True:
+        return __import__(name, globals, locals, fromlist, level)
 
-    return __import__(name, globals, locals, fromlist, level)
+    # Contracts import through the runtime of their thread, which keeps a copy of every contract it loaded
+    module = rt.modules.get(name)
+    if module is None:
+        if rt.restricted_imports:
+            spec = importlib.util.find_spec(name)
+            if spec is None or not isinstance(spec.loader, DatabaseLoader):
+                raise ImportError("module {} cannot be imported in a smart contract.".format(name))
 
+        module = rt.import_contract(name)
 
-def enable_restricted_imports():
+    # A contract body being recorded for reuse remembers the contracts it imported
+    frames = rt.import_frames
+    if frames and name in rt.loaded_modules and name not in frames[-1].imports:
+        frames[-1].imports.append(name)
+
+    return module
+
+
+def install_restricted_import():
+    # Stays installed, as contracts may be running on other threads. Code that isn't a contract imports as usual.
     builtins.__import__ = restricted_import
+
+
+def enable_restricted_imports():
+    install_restricted_import()
+    rt.restricted_imports = True
 #    builtins.float = ContractingDecimal
 
 
 def disable_restricted_imports():
-    builtins.__import__ = __import__
+    rt.restricted_imports = False
 
 
 def uninstall_builtins():
@@ -53,7 +79,8 @@ def uninstall_builtins():
 
 
 def install_database_loader(driver=ContractDriver()):
-    DatabaseFinder.driver = driver
+    rt.loader_driver = driver
+    install_restricted_import()
     if DatabaseFinder not in sys.meta_path:
         sys.meta_path.insert(0, DatabaseFinder)
 
@@ -64,6 +91,15 @@ def uninstall_database_loader():
         sys.meta_path.remove(DatabaseFinder)
 
 
+def enable_warm_modules():
+    DatabaseFinder.warm = True
+
+
+def disable_warm_modules():
+    DatabaseFinder.warm = False
+    NAMESPACE_CACHE.clear()
+
+
 def install_system_contracts(directory=''):
     pass
 
@@ -75,50 +111,204 @@ def install_system_contracts(directory=''):
 
 
 class DatabaseFinder:
+    # Used by runtimes that never had a loader installed
     driver = ContractDriver()
+    warm = True
 
     def find_spec(self, fullname, path=None, target=None):
-        if MODULE_CACHE.get(self) is None:
-            if DatabaseFinder.driver.get_contract(self) is None:
+        # Contracts are top level modules, so submodules of packages are never looked up in the database
+        if '.' in self:
+            return None
+
+        started_at = _metering_state() if _warm() else None
+        driver = rt.loader_driver or DatabaseFinder.driver
+
+        if self not in CODE_CACHE:
+            if driver.get_contract(self) is None:
                 return None
-        return ModuleSpec(self, DatabaseLoader(DatabaseFinder.driver))
+        return ModuleSpec(self, DatabaseLoader(driver, started_at=started_at))
+
+
+# While warm modules are enabled, the executed namespace of every contract is kept in NAMESPACE_CACHE so that importing
+# it in a later transaction does not re-run the contract body. The stamps the body cost are charged again on reuse so
+# that metering stays identical to a cold import.
+
+_MISSING = object()
+
+
+def _warm():
+    # Simulations read through a ReadOnlyDriver of their own, which the namespaces of blocks are not bound to and which
+    # is gone once they are done, so they neither reuse nor record namespaces and leave the ones kept for blocks in place
+    return DatabaseFinder.warm and not isinstance(rt.env.get('__Driver'), ReadOnlyDriver)
+
+
+def _metering_state():
+    stamps = rt.tracer.get_stamp_used() if rt.tracer.is_started() else None
+    return stamps, rt.accesses
+
+
+# Values a contract body may leave in its namespace and still be reused. Anything mutable could be changed by one
+# transaction and seen by the next.
+IMMUTABLE_TYPES = (int, float, str, bytes, bool, type(None), ContractingDecimal, Datetime, Timedelta)
+
+
+def _is_reusable_value(v):
+    if isinstance(v, IMMUTABLE_TYPES) or isinstance(v, ModuleType):
+        return True
+
+    if isinstance(v, (tuple, frozenset)):
+        return all(_is_reusable_value(i) for i in v)
+
+    if isinstance(v, FunctionType):
+        f = getattr(v, '__wrapped__', v)
+        defaults = (f.__defaults__ or ()) + tuple((f.__kwdefaults__ or {}).values())
+        return all(_is_reusable_value(d) for d in defaults)
+
+    if isinstance(v, Datum):
+        return _is_reusable_value(getattr(v, '_default_value', None))
+
+    return False
+
+
+def _pure_calls():
+    # The only calls a reusable contract body may make itself: building ORM objects, decorating exported functions,
+    # literal decimals and times, and importing other contracts
+    stdlib = env.gather()
+    calls = {stdlib[name].__init__.__code__ for name in ('Variable', 'Hash', 'ForeignVariable', 'ForeignHash')}
+    calls.update({
+        stdlib['__export'].__init__.__code__,
+        ContextDecorator.__call__.__code__,
+        ContractingDecimal.__init__.__code__,
+        Datetime.__init__.__code__,
+        Timedelta.__init__.__code__,
+        restricted_import.__code__,
+    })
+    return calls
+
+
+class _ImportFrame:
+    pure_calls = None
+
+    def __init__(self, code=None, previous=None):
+        self.code = code
+        self.previous = previous
+        self.imports = []
+        self.children_cost = 0
+        self.children_accesses = 0
+        self.pure = True
+
+        if _ImportFrame.pure_calls is None:
+            _ImportFrame.pure_calls = _pure_calls()
+
+    def profile(self, frame, event, arg):
+        # Watch the calls made directly from the contract body. Anything with side effects outside of the namespace
+        # (seeding random, calling other contracts, builtins) would not happen again if the namespace were reused.
+        if event == 'call':
+            if frame.f_back is not None and frame.f_back.f_code is self.code \
+                    and frame.f_code not in _ImportFrame.pure_calls:
+                self.pure = False
+        elif event == 'c_call':
+            if frame.f_code is self.code:
+                self.pure = False
+
+        # Keep any profiler that was already installed informed
+        if self.previous is not None:
+            self.previous(frame, event, arg)
+
+
+class WarmModule:
+    def __init__(self, scope, stdlib, defined, cost, imports, code_hash):
+        self.scope = scope
+        self.stdlib = stdlib
+        self.defined = defined
+        self.cost = cost
+        self.imports = imports
+        self.code_hash = code_hash
 
+        # ORM objects in the scope are bound to the driver that was active when the body ran, and the scope itself is
+        # only ever used by the runtime that ran it
+        self.driver = rt.env.get('__Driver')
+        self.runtime = get_runtime()
+        self.env_keys = set(rt.env.keys())
 
-MODULE_CACHE = {}
+    def is_valid(self, code_hash):
+        if self.code_hash != code_hash or self.driver is not rt.env.get('__Driver') or self.runtime is not get_runtime():
+            return False
+
+        # Entries recorded without metering have no cost to charge
+        return self.cost is not None or not rt.tracer.is_started()
+
+    def refresh(self, environment):
+        # Swap the environment of the previous transaction for the current one, leaving the names that the contract
+        # body defined itself untouched
+        for k in self.env_keys - self.defined:
+            v = self.stdlib.get(k, _MISSING)
+            if v is _MISSING:
+                self.scope.pop(k, None)
+            else:
+                self.scope[k] = v
+
+        for k, v in environment.items():
+            if k not in self.defined:
+                self.scope[k] = v
+
+        self.scope.update({'__contract__': True})
+        self.env_keys = set(environment.keys())
 
 
 class DatabaseLoader(Loader):
-    def __init__(self, d=ContractDriver()):
+    def __init__(self, d=ContractDriver(), started_at=None):
         self.d = d
+        self.started_at = started_at
 
     def create_module(self, spec):
         return None
 
-    def exec_module(self, module):
-        # fetch the individual contract
-        code = MODULE_CACHE.get(module.__name__)
+    def load_code(self, name):
+        entry = CODE_CACHE.get(name)
 
-        if MODULE_CACHE.get(module.__name__) is None:
-            code = self.d.get_compiled(module.__name__)
+        if entry is None:
+            code = self.d.get_compiled(name)
             if code is None:
-                raise ImportError("Module {} not found".format(module.__name__))
+                raise ImportError("Module {} not found".format(name))
 
             if type(code) != bytes:
                 code = bytes.fromhex(code)
 
-            code = marshal.loads(code)
-            MODULE_CACHE[module.__name__] = code
+            entry = (hashlib.sha3_256(code).hexdigest(), marshal.loads(code))
+
+            # Contracts submitted before block costs existed are charged per opcode
+            costs = self.d.get_block_costs(name)
+            if costs is not None:
+                load_block_costs(rt.tracer, entry[1], costs, rt.cost_schedule)
+
+            CODE_CACHE.set(name, entry)
+
+        return entry
+
+    def exec_module(self, module):
+        # fetch the individual contract
+        code_hash, code = self.load_code(module.__name__)
 
         if code is None:
             raise ImportError("Module {} not found".format(module.__name__))
 
-        scope = env.gather()
+        if _warm() and self.exec_warm_module(module, code_hash):
+            self._report_to_importer()
+            return
+
+        stdlib = env.gather()
+        scope = dict(stdlib)
         scope.update(rt.env)
 
         scope.update({'__contract__': True})
 
         # execute the module with the std env and update the module to pass forward
-        exec(code, scope)
+        if _warm():
+            self.exec_and_record(module.__name__, code, code_hash, scope, stdlib)
+            self._report_to_importer()
+        else:
+            exec(code, scope)
 
         # Update the module's attributes with the new scope
         vars(module).update(scope)
@@ -126,5 +316,78 @@ class DatabaseLoader(Loader):
 
         rt.loaded_modules.append(module.__name__)
 
+    def exec_and_record(self, name, code, code_hash, scope, stdlib):
+        before = dict(scope)
+        stamps, accesses = _metering_state()
+
+        profiler = sys.getprofile()
+
+        frame = _ImportFrame(code=code, previous=profiler)
+        rt.import_frames.append(frame)
+
+        # The imports the body makes are recorded as they go through restricted_import
+        install_restricted_import()
+
+        sys.setprofile(frame.profile)
+
+        try:
+            exec(code, scope)
+        finally:
+            sys.setprofile(profiler)
+            rt.import_frames.pop()
+
+        # A body that reads or writes state can cost something different next time, so it is never reused
+        if rt.accesses - accesses - frame.children_accesses > 0 or not frame.pure:
+            return
+
+        cost = None
+        if stamps is not None and rt.tracer.is_started():
+            cost = rt.tracer.get_stamp_used() - stamps - frame.children_cost
+
+        defined = {k for k, v in scope.items() if before.get(k, _MISSING) is not v}
+
+        if not all(_is_reusable_value(scope[k]) for k in defined if k != '__builtins__'):
+            return
+
+        NAMESPACE_CACHE.set(name, WarmModule(scope=scope, stdlib=stdlib, defined=defined, cost=cost,
+                                             imports=frame.imports, code_hash=code_hash))
+
+    def exec_warm_module(self, module, code_hash):
+        warm = NAMESPACE_CACHE.get(module.__name__, validate=lambda w: w.is_valid(code_hash))
+        if warm is None:
+            return False
+
+        if rt.tracer.is_started():
+            rt.tracer.add_cost(warm.cost)
+
+            # The body didn't run, so its cost is profiled as a whole rather than by line
+            if rt.profiling:
+                rt.module_costs[module.__name__] = rt.module_costs.get(module.__name__, 0) + warm.cost
+
+        # Import the same contracts the body imported, at the same cost they would have had
+        for name in warm.imports:
+            rt.import_contract(name)
+
+        warm.refresh(rt.env)
+
+        vars(module).update(warm.scope)
+        del vars(module)['__builtins__']
+
+        rt.loaded_modules.append(module.__name__)
+
+        return True
+
+    def _report_to_importer(self):
+        # Attribute the cost of this import (including the lookup in find_spec) to the contract importing it
+        if not rt.import_frames or self.started_at is None:
+            return
+
+        stamps, accesses = self.started_at
+        now_stamps, now_accesses = _metering_state()
+
+        if stamps is not None and now_stamps is not None:
+            rt.import_frames[-1].children_cost += now_stamps - stamps
+        rt.import_frames[-1].children_accesses += now_accesses - accesses
+
     def module_repr(self, module):
         return '<module {!r} (smart contract)>'.format(module.__name__)
@@ -0,0 +1,233 @@
+from contracting.db.driver import ContractDriver
+from contracting.execution.cache import CODE_CACHE
+from contracting.execution.runtime import rt
+from contracting.execution.metering.costs import schedule_at
+from contracting.compilation.blocks import load_block_costs
+from collections import OrderedDict
+from copy import deepcopy
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.popen_fork
+import marshal
+import pickle
+import os
+
+# Optimistic parallel execution. Every transaction of a batch is run in a forked worker against a snapshot of the state
+# at the start of the batch, recording each key it read or scanned. The results are then merged in order: a transaction
+# that read something an earlier transaction of the batch wrote is executed again serially, everything else is applied
+# as it is. The outputs and resulting state are the same as running the batch with execute_bag.
+
+
+class SnapshotDriver(ContractDriver):
+    # Runs transactions against a copy of another driver's state. Nothing is ever written to the database; the writes
+    # of a transaction are left in pending_writes for the parent process to apply.
+    def __init__(self, base: ContractDriver):
+        super().__init__(driver=base.driver)
+        self.snapshot = base.cache.copy()
+        self.snapshot_sizes = dict(base.sizes)
+        self.snapshot_touched = set(base.touched)
+
+        # Layers are never changed once pushed, so they are shared
+        self.layers = list(base.layers)
+        self.layered = dict(base.layered)
+
+        self.reset()
+
+    def reset(self):
+        self.cache = self.snapshot.copy()
+        self.sizes = dict(self.snapshot_sizes)
+        self.touched = set(self.snapshot_touched)
+        self.reads = set()
+        self.pending_writes = {}
+
+        # Every key read, marked or not, and every prefix scanned
+        self.accessed = set()
+        self.prefixes = set()
+
+    def get(self, key: str, mark=True):
+        self.accessed.add(key)
+        return super().get(key, mark=mark)
+
+    def get_many(self, keys, mark=True):
+        self.accessed.update(keys)
+        return super().get_many(keys, mark=mark)
+
+    def peek(self, key: str):
+        self.accessed.add(key)
+        return super().peek(key)
+
+    def iter_items(self, prefix='', start_after=None, limit=None):
+        self.prefixes.add(prefix)
+        return super().iter_items(prefix=prefix, start_after=start_after, limit=limit)
+
+    def commit(self):
+        pass
+
+
+class Speculation:
+    def __init__(self, status_code, result, stamps_used, writes, reads, accessed, prefixes, loaded, profile=None):
+        self.status_code = status_code
+        self.result = result
+        self.stamps_used = stamps_used
+        self.writes = writes
+        self.reads = reads
+        self.accessed = accessed
+        self.prefixes = prefixes
+
+        # Contracts whose code was fetched from the database, as {name: (code hash, marshalled code, block costs)}
+        self.loaded = loaded
+
+        self.profile = profile
+
+    def conflicts(self, written):
+        # A transaction is only valid if nothing it looked at changed since the snapshot, and if it fetched the same
+        # contract code a serial run would have (fetching code costs stamps)
+        if not self.accessed.isdisjoint(written):
+            return True
+
+        for prefix in self.prefixes:
+            if any(k.startswith(prefix) for k in written):
+                return True
+
+        return any(name in CODE_CACHE for name in self.loaded)
+
+
+# Set in the parent right before the pool is forked, so workers inherit it instead of pickling it
+_BATCH = None
+_WORKER_DRIVER = None
+
+
+def _start_worker():
+    global _WORKER_DRIVER
+    _WORKER_DRIVER = SnapshotDriver(_BATCH['driver'])
+
+
+def _execute_speculatively(i):
+    executor = _BATCH['executor']
+    driver = _WORKER_DRIVER
+
+    # Every transaction starts from the snapshot, including the contract code that was already loaded
+    driver.reset()
+    CODE_CACHE.entries = OrderedDict(_BATCH['code'])
+
+    output = executor.execute(**_BATCH['transactions'][i], auto_commit=_BATCH['auto_commit'], driver=driver)
+
+    return record(output, driver, _BATCH['code'])
+
+
+def record(output, driver, cached):
+    # The speculation for a transaction just executed against driver, with cached being the contract code that was
+    # loaded before it ran. None if the result cannot be sent back to the parent process.
+    loaded = {name: code_payload(name, driver) for name in CODE_CACHE.entries.keys() - cached.keys()}
+
+    speculation = Speculation(status_code=output['status_code'],
+                              result=output['result'],
+                              stamps_used=output['stamps_used'],
+                              writes=driver.pending_writes,
+                              reads=driver.reads,
+                              accessed=driver.accessed,
+                              prefixes=driver.prefixes,
+                              loaded=loaded,
+                              profile=output.get('profile'))
+
+    # Results that cannot be sent back to the parent are left for it to execute itself
+    try:
+        pickle.dumps(speculation)
+    except Exception:
+        return None
+
+    return speculation
+
+
+def code_payload(name, driver):
+    # Marshalling drops the block costs registered on the code, so they are sent along with it
+    code_hash, code = CODE_CACHE.entries[name]
+    return code_hash, marshal.dumps(code), driver.get_block_costs(name, mark=False)
+
+
+def load_code_payload(payload):
+    code_hash, code, costs = payload
+
+    code = marshal.loads(code)
+    if costs is not None:
+        load_block_costs(rt.tracer, code, costs, rt.cost_schedule)
+
+    return code_hash, code
+
+
+def apply(speculation, driver, auto_commit):
+    if auto_commit and speculation.status_code == 1:
+        driver.clear_pending_state()
+
+    driver.reads.update(speculation.reads)
+
+    for k, v in speculation.writes.items():
+        driver.set(k, v)
+
+    if auto_commit:
+        driver.commit()
+
+    for name, payload in speculation.loaded.items():
+        CODE_CACHE.set(name, load_code_payload(payload))
+
+    output = {
+        'status_code': speculation.status_code,
+        'result': speculation.result,
+        'stamps_used': speculation.stamps_used,
+        'writes': deepcopy(driver.pending_writes),
+        'reads': driver.reads
+    }
+
+    if speculation.profile is not None:
+        output['profile'] = speculation.profile
+
+    return output
+
+
+def speculate(executor, transactions, driver, auto_commit=False, processes=None):
+    global _BATCH
+
+    processes = processes or os.cpu_count()
+
+    # Switch schedules before forking, or every worker would drop the code it inherits when the first transaction does
+    rt.use_cost_schedule(schedule_at(transactions[0].get('environment', {}).get('block_num')))
+
+    _BATCH = {
+        'executor': executor,
+        'driver': driver,
+        'transactions': transactions,
+        'auto_commit': auto_commit,
+        'code': OrderedDict(CODE_CACHE.entries)
+    }
+
+    try:
+        with multiprocessing.get_context('fork').Pool(processes, initializer=_start_worker) as pool:
+            chunksize = max(1, len(transactions) // (processes * 4))
+            return pool.map(_execute_speculatively, range(len(transactions)), chunksize=chunksize)
+    finally:
+        _BATCH = None
+
+
+def execute_parallel(executor, transactions, driver, auto_commit=False, processes=None):
+    speculations = speculate(executor, transactions, driver, auto_commit=auto_commit, processes=processes)
+    return merge(executor, transactions, speculations, driver, auto_commit=auto_commit)
+
+
+def merge(executor, transactions, speculations, driver, auto_commit=False, apply=apply):
+    # Applies the speculations in order, executing again the ones that are missing or conflict
+    outputs = []
+    written = set()
+
+    for tx, speculation in zip(transactions, speculations):
+        if speculation is None or speculation.conflicts(written):
+            before = dict(driver.pending_writes)
+            output = executor.execute(**tx, auto_commit=auto_commit, driver=driver)
+
+            written.update(k for k, v in driver.pending_writes.items() if k not in before or before[k] is not v)
+        else:
+            output = apply(speculation, driver, auto_commit)
+            written.update(speculation.writes)
+
+        outputs.append(output)
+
+    return outputs
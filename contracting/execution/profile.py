@@ -0,0 +1,222 @@
+from contracting.execution.cache import CODE_CACHE, NAMESPACE_CACHE
+from contracting.compilation.blocks import code_objects
+from contracting import config
+import json
+import time
+import sys
+
+# Per transaction profiles. The tracer reports what each line of contract code cost, and the runtime what each key read
+# or written cost. Costs are in the tracer's units, where 1000 is one stamp.
+
+
+def contract_names():
+    # Which contract each loaded code object belongs to
+    names = {}
+    with CODE_CACHE.lock:
+        entries = list(CODE_CACHE.entries.items())
+
+    for name, (code_hash, code) in entries:
+        for c in code_objects(code):
+            names[c] = name
+
+    return names
+
+
+def add(totals, key, cost):
+    totals[key] = totals.get(key, 0) + cost
+
+
+def build_profile(line_costs, read_costs, write_costs, module_costs={}):
+    profile = {
+        'contracts': {},
+        'functions': {},
+        'lines': {},
+        'reads': dict(read_costs),
+        'writes': dict(write_costs),
+    }
+
+    names = contract_names()
+
+    for (code, line), cost in line_costs.items():
+        # Code that was not loaded from the database (a constructor run on submission) is named after its file
+        contract = names.get(code, code.co_filename)
+        function = '{}.{}'.format(contract, code.co_name)
+
+        add(profile['contracts'], contract, cost)
+        add(profile['functions'], function, cost)
+        add(profile['lines'], '{}:{}'.format(function, line), cost)
+
+    # Warm modules are charged what their body cost when it last ran
+    for contract, cost in module_costs.items():
+        add(profile['contracts'], contract, cost)
+        add(profile['functions'], '{}.<module>'.format(contract), cost)
+
+    for costs in (read_costs, write_costs):
+        for key, cost in costs.items():
+            add(profile['contracts'], key.split(config.INDEX_SEPARATOR)[0], cost)
+
+    return profile
+
+
+# Time spent outside of contract code: the executor, the ORM, the driver and the standard library
+SANDBOX = '<sandbox>'
+
+METRICS = {'time', 'stamps'}
+
+
+class Instrumentation:
+    # Aggregates profiles over many transactions. Pass one to an Executor and every transaction it executes is profiled
+    # and timed. Wall time is measured with a profile hook on contract frames, so it is split between contract functions
+    # and the sandbox code they call into.
+    def __init__(self):
+        self.transactions = 0
+        self.time = 0
+        self.stamps_used = 0
+
+        # {'contract.function': {'calls', 'time', 'self_time', 'stamps'}}. Stamps are what the function's own code cost.
+        self.functions = {}
+
+        # Time and cost spent in the last frame of each call stack, keyed by stack as 'a;b;c'. Costs here include the
+        # reads and writes made while the frame ran.
+        self.stack_times = {}
+        self.stack_costs = {}
+
+        # {contract: {'count', 'cost'}}
+        self.reads = {}
+        self.writes = {}
+
+        # {cache: {'hits', 'misses'}}
+        self.caches = {'code': {'hits': 0, 'misses': 0}, 'namespace': {'hits': 0, 'misses': 0}}
+
+        # Set for the transaction being executed
+        self.tracer = None
+        self.contract_time = 0
+        self.stack = []
+        self.previous = None
+        self.started_at = None
+        self.cache_stats = None
+        self.names = {}
+
+    def start(self, tracer):
+        self.tracer = tracer
+        self.contract_time = 0
+        self.stack = []
+        self.started_at = time.perf_counter()
+        self.cache_stats = {'code': CODE_CACHE.stats(), 'namespace': NAMESPACE_CACHE.stats()}
+
+        self.previous = sys.getprofile()
+        sys.setprofile(self.profile)
+
+    def stop(self, output):
+        sys.setprofile(self.previous)
+
+        elapsed = time.perf_counter() - self.started_at
+
+        self.transactions += 1
+        self.time += elapsed
+        self.stamps_used += output['stamps_used']
+
+        # Whatever was not spent under a contract frame went to the sandbox
+        add(self.stack_times, SANDBOX, elapsed - self.contract_time)
+
+        profile = output.get('profile')
+        if profile is not None:
+            for function, cost in profile['functions'].items():
+                self.function(function)['stamps'] += cost
+
+            for totals, costs in ((self.reads, profile['reads']), (self.writes, profile['writes'])):
+                for key, cost in costs.items():
+                    contract = totals.setdefault(key.split(config.INDEX_SEPARATOR)[0], {'count': 0, 'cost': 0})
+                    contract['count'] += 1
+                    contract['cost'] += cost
+
+        for name, cache in (('code', CODE_CACHE), ('namespace', NAMESPACE_CACHE)):
+            stats = cache.stats()
+            self.caches[name]['hits'] += stats['hits'] - self.cache_stats[name]['hits']
+            self.caches[name]['misses'] += stats['misses'] - self.cache_stats[name]['misses']
+
+    def function(self, name):
+        if name not in self.functions:
+            self.functions[name] = {'calls': 0, 'time': 0, 'self_time': 0, 'stamps': 0}
+        return self.functions[name]
+
+    def function_name(self, code):
+        name = self.names.get(code)
+        if name is None:
+            contract = contract_names().get(code, code.co_filename)
+            name = '{}.{}'.format(contract, code.co_name)
+            self.names[code] = name
+
+        return name
+
+    def profile(self, frame, event, arg):
+        if event == 'call':
+            if frame.f_globals.get('__contract__') is True:
+                self.enter(self.function_name(frame.f_code), frame)
+
+            # Only the first sandbox frame under a contract frame is timed, it covers everything below it
+            elif len(self.stack) > 0 and self.stack[-1][0] != SANDBOX:
+                self.enter(SANDBOX, frame)
+
+        elif event == 'return':
+            if len(self.stack) > 0 and self.stack[-1][1] is frame:
+                self.leave()
+
+    def enter(self, name, frame):
+        # [name, frame, started at, cost when started, time in children, cost of children]
+        self.stack.append([name, frame, time.perf_counter(), self.tracer.get_stamp_used(), 0, 0])
+
+    def leave(self):
+        name, frame, started_at, cost, children_time, children_cost = self.stack.pop()
+
+        elapsed = time.perf_counter() - started_at
+        spent = self.tracer.get_stamp_used() - cost
+
+        stack = ';'.join([entry[0] for entry in self.stack] + [name])
+        add(self.stack_times, stack, elapsed - children_time)
+        add(self.stack_costs, stack, spent - children_cost)
+
+        if name != SANDBOX:
+            function = self.function(name)
+            function['calls'] += 1
+            function['time'] += elapsed
+            function['self_time'] += elapsed - children_time
+
+        if len(self.stack) > 0:
+            self.stack[-1][4] += elapsed
+            self.stack[-1][5] += spent
+        else:
+            self.contract_time += elapsed
+
+    def folded(self, metric='time'):
+        # Folded stacks, one 'a;b;c value' line per stack, as read by flamegraph.pl and speedscope. Time is in
+        # microseconds and stamps in the tracer's units.
+        if metric not in METRICS:
+            raise ValueError('Metric must be one of {}.'.format(', '.join(sorted(METRICS))))
+
+        if metric == 'time':
+            values = {stack: int(t * 1000000) for stack, t in self.stack_times.items()}
+        else:
+            values = self.stack_costs
+
+        return ''.join('{} {}\n'.format(stack, value) for stack, value in sorted(values.items()) if value > 0)
+
+    def summary(self):
+        caches = {}
+        for name, stats in self.caches.items():
+            lookups = stats['hits'] + stats['misses']
+            caches[name] = dict(stats, hit_rate=stats['hits'] / lookups if lookups > 0 else None)
+
+        return {
+            'transactions': self.transactions,
+            'time': self.time,
+            'sandbox_time': self.time - sum(f['self_time'] for f in self.functions.values()),
+            'stamps_used': self.stamps_used,
+            'functions': self.functions,
+            'reads': self.reads,
+            'writes': self.writes,
+            'caches': caches
+        }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=4, sort_keys=True)
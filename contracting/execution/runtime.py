@@ -1,8 +1,13 @@
 import sys
+import random
+import importlib
+import threading
+from contextvars import ContextVar
 from contracting import config
-import contracting
-import os
 from contracting.execution.metering.tracer import Tracer
+from contracting.execution.metering.costs import schedule_at
+from contracting.execution.cache import price_contract_caches
+from contracting.execution.profile import build_profile
 
 
 class Context:
@@ -49,76 +54,199 @@ class Context:
         return self._get_state()['owner']
 
 
-_context = Context({
-        'this': None,
-        'caller': None,
-        'owner': None,
-        'signer': None
-    })
+class ContextProxy:
+    # Stands in for the context of the current runtime, so that contracts always see the transaction they are part of
+    def __getattr__(self, name):
+        return getattr(get_runtime().context, name)
+
 
 WRITE_MAX = 1024 * 64
 
+# Contracts are imported one at a time, across every runtime, and taken out of sys.modules once they are loaded. Each
+# runtime keeps its own copy of the contracts it imported, bound to its own driver and environment.
+IMPORT_LOCK = threading.RLock()
+
+
 class Runtime:
-    cu_path = contracting.__path__[0]
-    cu_path = os.path.join(cu_path, 'execution', 'metering', 'cu_costs.const')
+    # Everything a transaction needs while it runs. Each execution context (each thread, unless one is set explicitly)
+    # has a Runtime of its own, so executors on different threads don't share a tracer, environment or context.
+    def __init__(self):
+        # Names of the contract modules imported during the transaction, and the modules themselves
+        self.loaded_modules = []
+        self.modules = {}
+
+        self.env = {}
+        self.stamps = 0
+
+        self.writes = 0
 
-    os.environ['CU_COST_FNAME'] = cu_path
+        # Count of every metered driver access. Lets the module loader tell whether a contract body touched state.
+        self.accesses = 0
 
-    loaded_modules = []
+        self.tracer = Tracer()
 
-    env = {}
-    stamps = 0
+        # The cost schedule the tracer is currently charging with
+        self.cost_schedule = None
 
-    writes = 0
+        self.signer = None
 
-    tracer = Tracer()
+        self.context = Context({
+            'this': None,
+            'caller': None,
+            'owner': None,
+            'signer': None
+        })
 
-    signer = None
+        # Driver the database loader fetches contracts with
+        self.loader_driver = None
 
-    context = _context
+        # Whether contracts may only import other contracts, and the contract bodies being executed, innermost last
+        self.restricted_imports = False
+        self.import_frames = []
 
-    @classmethod
-    def set_up(cls, stmps, meter):
+        # Random state of the contract random module
+        self.random = random.Random()
+        self.seeded = False
+
+        # Set while a metered transaction is being profiled, along with the cost of each key it read and wrote and of
+        # each warm module it reused
+        self.profiling = False
+        self.read_costs = {}
+        self.write_costs = {}
+        self.module_costs = {}
+
+        self.use_cost_schedule(schedule_at())
+
+    def set_up(self, stmps, meter, profile=False):
         if meter:
-            cls.stamps = stmps
-            cls.tracer.set_stamp(stmps)
-            cls.tracer.start()
+            self.stamps = stmps
+            self.tracer.set_stamp(stmps)
+
+            self.profiling = profile
+            self.tracer.set_profiling(profile)
+
+            self.tracer.start()
+
+        self.context._reset()
+
+    def use_cost_schedule(self, schedule):
+        # Opcode prices and the stamp and memory ceilings can change at a block height
+        price_contract_caches(schedule)
+
+        if self.cost_schedule is schedule:
+            return
+
+        self.tracer.set_costs(schedule.buffer(), schedule.max_stamps, schedule.max_memory)
+        self.cost_schedule = schedule
+
+    def import_contract(self, name):
+        module = self.modules.get(name)
+        if module is not None:
+            return module
+
+        with IMPORT_LOCK:
+            module = importlib.import_module(name)
+
+            if vars(module).get('__contract__') is True:
+                sys.modules.pop(name, None)
+                self.modules[name] = module
+
+        return module
+
+    def clean_up(self):
+        self.tracer.stop()
+        self.tracer.reset()
+        self.stamps = 0
+        self.writes = 0
 
-        cls.context._reset()
+        self.signer = None
 
-    @classmethod
-    def clean_up(cls):
-        cls.tracer.stop()
-        cls.tracer.reset()
-        cls.stamps = 0
-        cls.writes = 0
+        # Other runtimes may be loading the same contracts
+        with IMPORT_LOCK:
+            for mod in self.loaded_modules:
+                if sys.modules.get(mod) is not None:
+                    del sys.modules[mod]
 
-        cls.signer = None
+        self.loaded_modules = []
+        self.modules = {}
+        self.env = {}
 
-        for mod in cls.loaded_modules:
-            if sys.modules.get(mod) is not None:
-                del sys.modules[mod]
+        self.seeded = False
 
-        cls.loaded_modules = []
-        cls.env = {}
+        self.profiling = False
+        self.read_costs = {}
+        self.write_costs = {}
+        self.module_costs = {}
 
-    @classmethod
-    def deduct_read(cls, key, value):
-        if cls.tracer.is_started():
-            cost = len(key) + len(value)
+    def profile(self):
+        return build_profile(self.tracer.get_profile(), self.read_costs, self.write_costs, self.module_costs)
+
+    def deduct_read(self, key, value):
+        self.deduct_read_size(len(key) + len(value), key=key)
+
+    def deduct_read_size(self, size, key=None):
+        # size is the number of bytes in the encoded key and value
+        self.accesses += 1
+        if self.tracer.is_started():
+            cost = size
             cost *= config.READ_COST_PER_BYTE
-            cls.tracer.add_cost(cost)
 
-    @classmethod
-    def deduct_write(cls, key, value):
-        if key is not None and cls.tracer.is_started():
-            cost = len(key) + len(value)
-            cls.writes += cost
+            if self.profiling and key is not None:
+                self.read_costs[key] = self.read_costs.get(key, 0) + cost
+
+            self.tracer.add_cost(cost)
+
+    def deduct_write(self, key, value):
+        if key is None:
+            self.accesses += 1
+            return
+        self.deduct_write_size(len(key) + len(value), key=key)
+
+    def deduct_write_size(self, size, key=None):
+        self.accesses += 1
+        if self.tracer.is_started():
+            cost = size
+            self.writes += cost
 
-            assert cls.writes < WRITE_MAX, 'You have exceeded the maximum write capacity per transaction!'
+            assert self.writes < WRITE_MAX, 'You have exceeded the maximum write capacity per transaction!'
 
             stamp_cost = cost * config.WRITE_COST_PER_BYTE
-            cls.tracer.add_cost(stamp_cost)
+
+            if self.profiling and key is not None:
+                self.write_costs[key] = self.write_costs.get(key, 0) + stamp_cost
+
+            self.tracer.add_cost(stamp_cost)
+
+
+_runtime = ContextVar('runtime', default=None)
+
+
+def get_runtime():
+    # The runtime of the current execution context, made the first time it's needed
+    runtime = _runtime.get()
+    if runtime is None:
+        runtime = Runtime()
+        _runtime.set(runtime)
+
+    return runtime
+
+
+def set_runtime(runtime):
+    # Binds a runtime to the current execution context. Returns a token that reset_runtime takes to undo it.
+    return _runtime.set(runtime)
+
+
+def reset_runtime(token):
+    _runtime.reset(token)
+
+
+class RuntimeProxy:
+    # Stands in for the runtime of the current execution context
+    def __getattr__(self, name):
+        return getattr(get_runtime(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_runtime(), name, value)
 
 
-rt = Runtime()
+rt = RuntimeProxy()
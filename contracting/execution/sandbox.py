@@ -0,0 +1,366 @@
+from contracting.execution.cache import CODE_CACHE
+from contracting.execution.runtime import rt
+from contracting.execution.metering.costs import schedule_at
+from contracting.execution import parallel
+from collections import OrderedDict
+from copy import deepcopy
+import multiprocessing
+# Imported up front, or forking a worker would import them while the database loader is installed
+import multiprocessing.connection
+import multiprocessing.popen_fork
+import pickle
+import os
+
+# Sandboxed execution for executors in production mode. Transactions are executed by a pool of worker processes that
+# are forked once and kept warm, with the database loader, the standard library and the contracts they loaded left in
+# place between transactions. Workers never write to the database: they send back what a transaction did, and the
+# parent applies the outputs in order and commits them, so the outputs are the same as executing in process. A worker
+# that dies only takes the transaction it was executing down with it, and is replaced.
+#
+# A worker sees the state the parent had when it was forked, plus every write the parent applied through the sandbox
+# since. When the driver's state changed any other way (written to directly, its pending writes dropped, layers applied
+# or rolled back), the workers are out of date and are forked again before they are sent another transaction.
+
+
+class SandboxError(Exception):
+    pass
+
+
+_MISSING = object()
+
+# Stands in for the speculation of a transaction whose worker died
+CRASHED = object()
+
+
+class SandboxDriver(parallel.SnapshotDriver):
+    # The state inside a worker. It is kept up to date with the writes the parent sends rather than started over for
+    # every transaction, so only the writes of the last transaction are undone when it's done.
+    def __init__(self, base):
+        self.undo = {}
+        super().__init__(base)
+
+        self.cache = self.snapshot
+        self.sizes = self.snapshot_sizes
+        self.touched = self.snapshot_touched
+
+    def remember(self, key):
+        if key not in self.undo:
+            self.undo[key] = self.cache.get(key, _MISSING)
+
+    def undo_writes(self):
+        for key, value in self.undo.items():
+            self.sizes.pop(key, None)
+
+            if value is _MISSING:
+                self.cache.pop(key, None)
+            else:
+                self.cache[key] = value
+
+        self.undo = {}
+
+    def reset(self):
+        self.undo_writes()
+
+        self.reads = set()
+        self.pending_writes = {}
+        self.accessed = set()
+        self.prefixes = set()
+
+    def sync(self, writes):
+        # Writes the parent applied since the worker was last sent a transaction
+        for key, value in writes.items():
+            self.sizes.pop(key, None)
+            self.cache[key] = value
+
+    def set(self, key, value, mark=True):
+        self.remember(key)
+        super().set(key, value, mark=mark)
+
+    def put(self, key, value):
+        self.remember(key)
+        super().put(key, value)
+
+    def clear_pending_state(self):
+        # Only the transaction's own writes are dropped. What it accessed still decides whether it conflicts.
+        self.undo_writes()
+
+        self.reads.clear()
+        self.pending_writes.clear()
+
+
+# Set in the worker when it is forked. Contract code the worker has, as {name: (code hash, code object)}, priced with
+# the schedule the worker's runtime is using.
+_DRIVER = None
+_CODE = {}
+
+
+def _serve(executor, connection, parent_end):
+    global _DRIVER, _CODE
+
+    # The ends of the pipes that belong to the parent are closed, or a worker would never see the parent go away
+    parent_end.close()
+    for worker in executor.sandbox.workers:
+        worker.connection.close()
+
+    # Inside the worker, transactions are executed in process
+    executor.sandbox = None
+
+    _DRIVER = SandboxDriver(executor.driver)
+    _CODE = dict(CODE_CACHE.entries)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+
+        if message is None:
+            return
+
+        try:
+            reply = _execute(executor, **message)
+        except Exception as e:
+            # Raised again in the parent, as it would have been in process
+            _DRIVER.reset()
+            reply = SandboxError(str(e)) if not _picklable(e) else e
+
+        connection.send(reply)
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return False
+
+    return True
+
+
+def _use_schedule(block_num):
+    # Code is priced with the schedule it runs under, so code kept from another schedule is dropped
+    schedule = schedule_at(block_num)
+    if rt.cost_schedule is not schedule:
+        _CODE.clear()
+        rt.use_cost_schedule(schedule)
+
+
+def _execute(executor, transactions, auto_commit, writes, code, payloads):
+    driver = _DRIVER
+    driver.sync(writes)
+
+    _use_schedule(transactions[0].get('environment', {}).get('block_num'))
+
+    for name, payload in payloads.items():
+        _CODE[name] = parallel.load_code_payload(payload)
+
+    speculations = []
+    for tx in transactions:
+        _use_schedule(tx.get('environment', {}).get('block_num'))
+
+        # Every transaction starts with the contract code the parent has loaded, as it would in process
+        cached = OrderedDict((name, _CODE[name]) for name in code if name in _CODE)
+
+        driver.reset()
+        CODE_CACHE.entries = OrderedDict(cached)
+
+        output = executor.execute(**tx, auto_commit=auto_commit, driver=driver)
+
+        for name in CODE_CACHE.entries.keys() - cached.keys():
+            _CODE[name] = CODE_CACHE.entries[name]
+
+        speculations.append(parallel.record(output, driver, cached))
+
+    driver.reset()
+
+    return speculations, {name: code_hash for name, (code_hash, c) in _CODE.items()}
+
+
+class Worker:
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+
+        # Writes the parent applied that haven't been sent to the worker yet
+        self.writes = {}
+
+        # Hash of the code of each contract the worker has
+        self.code = {name: code_hash for name, (code_hash, c) in CODE_CACHE.entries.items()}
+
+    def stop(self):
+        self.connection.close()
+
+        self.process.terminate()
+        self.process.join()
+
+
+class Sandbox:
+    def __init__(self, executor, processes=None):
+        self.executor = executor
+        self.processes = processes or os.cpu_count()
+        self.workers = []
+
+        # Version of the driver's state the workers have
+        self.version = None
+
+    def spawn(self):
+        context = multiprocessing.get_context('fork')
+
+        connection, child = context.Pipe()
+        process = context.Process(target=_serve, args=(self.executor, child, connection), daemon=True)
+        process.start()
+
+        child.close()
+
+        return Worker(process, connection)
+
+    def start(self, driver):
+        # Workers are forked the first time they are needed, again for any that died since, and all of them again if
+        # the state changed in a way they did not see
+        if driver.version != self.version:
+            self.terminate()
+
+        for i, worker in enumerate(self.workers):
+            if not worker.process.is_alive():
+                worker.stop()
+                self.workers[i] = self.spawn()
+
+        while len(self.workers) < self.processes:
+            self.workers.append(self.spawn())
+
+        self.follow(driver)
+
+    def follow(self, driver):
+        # The workers have every change made to the driver so far, or have it queued
+        self.version = driver.version
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.stop()
+
+        self.workers = []
+
+    def replace(self, worker):
+        worker.stop()
+        self.workers[self.workers.index(worker)] = self.spawn()
+
+    def message(self, worker, transactions, auto_commit, driver):
+        # The code the worker is missing is sent along with the transactions
+        payloads = {name: parallel.code_payload(name, driver) for name, (code_hash, c) in CODE_CACHE.entries.items()
+                    if worker.code.get(name) != code_hash}
+
+        message = {
+            'transactions': transactions,
+            'auto_commit': auto_commit,
+            'writes': worker.writes,
+            'code': list(CODE_CACHE.entries.keys()),
+            'payloads': payloads
+        }
+
+        worker.writes = {}
+
+        return message
+
+    def speculate(self, transactions, driver, auto_commit=False):
+        # Splits the transactions between the workers, every one executed against the current state
+        self.start(driver)
+
+        # The code sent to workers is priced with the schedule of the first transaction, as it is in process
+        rt.use_cost_schedule(schedule_at(transactions[0].get('environment', {}).get('block_num')))
+
+        speculations = [CRASHED] * len(transactions)
+
+        shares = []
+        for i in range(min(len(self.workers), len(transactions))):
+            share = list(range(i, len(transactions), len(self.workers)))
+            batch = [transactions[j] for j in share]
+
+            try:
+                self.workers[i].connection.send(self.message(self.workers[i], batch, auto_commit, driver))
+            except OSError:
+                # It died before it was sent anything, so its replacement gets the transactions instead
+                self.replace(self.workers[i])
+                self.workers[i].connection.send(self.message(self.workers[i], batch, auto_commit, driver))
+
+            shares.append((self.workers[i], share))
+
+        for worker, share in shares:
+            try:
+                reply = worker.connection.recv()
+            except (EOFError, OSError):
+                self.replace(worker)
+                continue
+
+            if isinstance(reply, Exception):
+                raise reply
+
+            results, worker.code = reply
+
+            for j, speculation in zip(share, results):
+                speculations[j] = speculation
+
+        return speculations
+
+    def written(self, writes):
+        for worker in self.workers:
+            worker.writes.update(writes)
+
+    def apply(self, speculation, driver, auto_commit):
+        output = parallel.apply(speculation, driver, auto_commit)
+        self.written(speculation.writes)
+        self.follow(driver)
+
+        return output
+
+    def execute(self, tx, auto_commit=False):
+        # tx holds every keyword argument of Executor.execute but auto_commit and driver
+        driver = self.executor.driver
+        speculation = self.speculate([tx], driver, auto_commit=auto_commit)[0]
+
+        if speculation is CRASHED:
+            return self.crashed(tx, driver, auto_commit)
+
+        # Results that cannot be sent back are left for the parent to execute itself
+        if speculation is None:
+            before = dict(driver.pending_writes)
+            output = self.executor.execute_in_process(**tx, auto_commit=auto_commit, driver=driver)
+
+            self.written({k: v for k, v in driver.pending_writes.items() if before.get(k, _MISSING) is not v})
+            self.follow(driver)
+
+            return output
+
+        return self.apply(speculation, driver, auto_commit)
+
+    def execute_parallel(self, transactions, auto_commit=False):
+        driver = self.executor.driver
+
+        speculations = self.speculate(transactions, driver, auto_commit=auto_commit)
+        speculations = [None if s is CRASHED else s for s in speculations]
+
+        # Transactions that conflict, or whose worker died, are executed again one at a time
+        return parallel.merge(self.executor, transactions, speculations, driver, auto_commit=auto_commit,
+                              apply=self.apply)
+
+    def crashed(self, tx, driver, auto_commit):
+        # A transaction that takes its worker down fails, and pays for every stamp it was given, the same as one that
+        # ran out of them
+        if auto_commit:
+            driver.clear_pending_state()
+
+        metering = tx['metering'] if tx['metering'] is not None else self.executor.metering
+        if metering:
+            balance = self.executor.stamps.deduct(driver, tx['sender'], tx['stamps'], tx['stamp_cost'])
+            self.written({self.executor.stamps.key(tx['sender']): balance})
+
+        if auto_commit:
+            driver.commit()
+
+        self.follow(driver)
+
+        return {
+            'status_code': 1,
+            'result': SandboxError('The worker executing the transaction exited.'),
+            'stamps_used': tx['stamps'],
+            'writes': deepcopy(driver.pending_writes),
+            'reads': driver.reads
+        }
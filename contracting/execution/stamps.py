@@ -0,0 +1,74 @@
+from contracting.stdlib.bridge.decimal import ContractingDecimal
+from contracting.db.cache import MISSING
+from contracting import config
+
+# Stamp accounting. Stamps are paid for out of the sender's balance in the currency contract, which is checked before a
+# transaction runs and charged once it's done. Both happen while the tracer is stopped, so the balance is read and
+# written straight through the driver's cache rather than through the metered get and set.
+#
+# While a batch is open, the ledger keeps the balances it read and charged through the batch's driver, so a sender's
+# balance is only read once for both the check and the charge, and once for every transaction of theirs after that.
+# Charges are still written through to the driver as they are made, so the outputs and pending writes are the same.
+
+
+class StampLedger:
+    def __init__(self, currency_contract='currency', balances_hash='balances'):
+        self.prefix = '{}{}{}{}'.format(currency_contract, config.INDEX_SEPARATOR, balances_hash, config.DELIMITER)
+
+        # The driver of the open batch, and {key: balance} for the balances read or charged through it
+        self.driver = None
+        self.balances = {}
+
+    def begin(self, driver):
+        self.driver = driver
+        self.balances = {}
+
+    def end(self):
+        self.driver = None
+        self.balances = {}
+
+    def key(self, sender):
+        return self.prefix + sender
+
+    def kept(self, driver, key):
+        # A balance is only used while it is still the value the driver holds, and while the driver already counts it
+        # as read, so using it marks and returns the same as reading it again
+        if driver is not self.driver:
+            return MISSING
+
+        balance = self.balances.get(key, MISSING)
+        if balance is MISSING or key not in driver.touched or driver.cache.get(key, MISSING) is not balance:
+            return MISSING
+
+        return balance
+
+    def keep(self, driver, key, balance):
+        # Absent balances are marked as read every time they are read, so they are never kept
+        if driver is self.driver and balance is not None:
+            self.balances[key] = balance
+
+    def balance(self, driver, sender):
+        key = self.key(sender)
+
+        balance = self.kept(driver, key)
+        if balance is MISSING:
+            balance = driver.peek(key)
+            self.keep(driver, key, balance)
+
+        if balance is None:
+            balance = 0
+
+        return balance
+
+    def can_pay(self, driver, sender, stamps, stamp_cost):
+        return self.balance(driver, sender) * stamp_cost >= stamps
+
+    def deduct(self, driver, sender, stamps_used, stamp_cost):
+        # A kept balance is read again if the transaction itself changed it
+        to_deduct = ContractingDecimal(stamps_used / stamp_cost)
+
+        balance = max(self.balance(driver, sender) - to_deduct, 0)
+        driver.put(self.key(sender), balance)
+        self.keep(driver, self.key(sender), balance)
+
+        return balance
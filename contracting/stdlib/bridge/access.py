@@ -1,4 +1,4 @@
-from contracting.execution.runtime import rt
+from contracting.execution.runtime import rt, ContextProxy
 from contextlib import ContextDecorator
 from contracting.db.driver import ContractDriver
 from typing import Any
@@ -31,7 +31,7 @@ class __export(ContextDecorator):
 
 exports = {
     '__export': __export,
-    'ctx': rt.context,
+    'ctx': ContextProxy(),
     'rt': rt,
     'Any': Any
 }
@@ -1,4 +1,3 @@
-import importlib
 from types import FunctionType, ModuleType
 from contracting.config import PRIVATE_METHOD_PREFIX
 from contracting.db.orm import Datum
@@ -59,7 +58,7 @@ def import_module(name):
     if _driver.get_contract(name) is None:
         raise ImportError
 
-    m = importlib.import_module(name, package=None)
+    m = rt.import_contract(name)
 
     return m
 
@@ -1,40 +1,42 @@
 from contracting.db.orm import Variable, Hash, ForeignVariable, ForeignHash
 from contracting.db.contract import Contract
-from contracting.execution.runtime import rt
+from contracting.execution.runtime import get_runtime
+
+
+def _use_runtime_driver(kwargs):
+    # ORM objects made by a contract read and write through the driver of the runtime executing it
+    driver = get_runtime().env.get('__Driver')
+    if driver is not None:
+        kwargs['driver'] = driver
 
 
 class V(Variable):
     def __init__(self, *args, **kwargs):
-        if rt.env.get('__Driver') is not None:
-            kwargs['driver'] = rt.env.get('__Driver')
+        _use_runtime_driver(kwargs)
         super().__init__(*args, **kwargs)
 
 
 class H(Hash):
     def __init__(self, *args, **kwargs):
-        if rt.env.get('__Driver') is not None:
-            kwargs['driver'] = rt.env.get('__Driver')
+        _use_runtime_driver(kwargs)
         super().__init__(*args, **kwargs)
 
 
 class FV(ForeignVariable):
     def __init__(self, *args, **kwargs):
-        if rt.env.get('__Driver') is not None:
-            kwargs['driver'] = rt.env.get('__Driver')
+        _use_runtime_driver(kwargs)
         super().__init__(*args, **kwargs)
 
 
 class FH(ForeignHash):
     def __init__(self, *args, **kwargs):
-        if rt.env.get('__Driver') is not None:
-            kwargs['driver'] = rt.env.get('__Driver')
+        _use_runtime_driver(kwargs)
         super().__init__(*args, **kwargs)
 
 
 class C(Contract):
     def __init__(self, *args, **kwargs):
-        if rt.env.get('__Driver') is not None:
-            kwargs['driver'] = rt.env.get('__Driver')
+        _use_runtime_driver(kwargs)
         super().__init__(*args, **kwargs)
 
 
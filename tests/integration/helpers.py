@@ -0,0 +1,36 @@
+# Transactions shared by the integration tests. Contract files are opened relative to tests/integration, which the tests
+# are run from.
+
+
+def submission_kwargs_for_file(f):
+    # Get the file name only by splitting off directories
+    split = f.split('/')
+    split = split[-1]
+
+    # Now split off the .s
+    split = split.split('.')
+    contract_name = split[0]
+
+    with open(f) as file:
+        contract_code = file.read()
+
+    return {
+        'name': contract_name,
+        'code': contract_code,
+    }
+
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+
+def transfer(sender, to, amount, contract_name='erc20_clone'):
+    return {
+        'sender': sender,
+        'contract_name': contract_name,
+        'function_name': 'transfer',
+        'kwargs': {'amount': amount, 'to': to}
+    }
@@ -0,0 +1,135 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver
+from contracting.execution.executor import Executor
+from contracting.execution.cache import NAMESPACE_CACHE
+from tests.integration.helpers import submission_kwargs_for_file, TEST_SUBMISSION_KWARGS, transfer
+
+
+class TestExecuteBag(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.set_up_state()
+
+        self.e = Executor(driver=self.d, metering=False)
+
+    def set_up_state(self):
+        self.d.flush()
+
+        with open('../../contracting/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission',
+                            code=contract)
+        self.d.commit()
+
+        e = Executor(driver=self.d, metering=False)
+        e.execute(**TEST_SUBMISSION_KWARGS,
+                  kwargs=submission_kwargs_for_file('./test_contracts/erc20_clone.s.py'), auto_commit=True)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_bag_returns_one_output_per_transaction(self):
+        txs = [transfer('stu', 'colin', 1), transfer('stu', 'raghu', 2), transfer('colin', 'stu', 3)]
+
+        outputs = self.e.execute_bag(txs)
+
+        self.assertEqual(len(outputs), 3)
+        for output in outputs:
+            self.assertEqual(output['status_code'], 0)
+
+        self.assertEqual(self.d.get('erc20_clone.balances:stu'), 1000000 - 1 - 2 + 3)
+        self.assertEqual(self.d.get('erc20_clone.balances:raghu'), 2)
+
+    def test_bag_outputs_match_single_executions(self):
+        txs = [transfer('stu', 'colin', 10), transfer('colin', 'raghu', 1000), transfer('colin', 'raghu', 5)]
+
+        expected = []
+        for tx in txs:
+            output = self.e.execute(**tx)
+            output['reads'] = set(output['reads'])
+            expected.append(output)
+
+        self.set_up_state()
+
+        outputs = self.e.execute_bag(txs)
+
+        for output, single in zip(outputs, expected):
+            self.assertEqual(output['status_code'], single['status_code'])
+            self.assertEqual(output['stamps_used'], single['stamps_used'])
+            self.assertEqual(output['writes'], single['writes'])
+            self.assertEqual(str(output['result']), str(single['result']))
+
+    def test_failed_transaction_does_not_stop_bag(self):
+        txs = [transfer('raghu', 'stu', 100), transfer('stu', 'raghu', 100)]
+
+        outputs = self.e.execute_bag(txs)
+
+        self.assertEqual(outputs[0]['status_code'], 1)
+        self.assertEqual(outputs[1]['status_code'], 0)
+
+    def test_transaction_environment_overrides_bag_environment(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, auto_commit=True, kwargs={
+            'name': 'i_use_now',
+            'code': '@export\ndef get_now():\n    return now\n'
+        })
+
+        txs = [
+            {'sender': 'stu', 'contract_name': 'i_use_now', 'function_name': 'get_now', 'kwargs': {}},
+            {'sender': 'stu', 'contract_name': 'i_use_now', 'function_name': 'get_now', 'kwargs': {},
+             'environment': {'now': 2}},
+        ]
+
+        outputs = self.e.execute_bag(txs, environment={'now': 1})
+
+        self.assertEqual(outputs[0]['result'], 1)
+        self.assertEqual(outputs[1]['result'], 2)
+
+    def test_modules_stay_warm_between_bags(self):
+        self.e.execute_bag([transfer('stu', 'colin', 1)])
+
+        hits = NAMESPACE_CACHE.hits
+        self.e.execute_bag([transfer('stu', 'colin', 1)])
+
+        self.assertGreater(NAMESPACE_CACHE.hits, hits)
+
+    def test_access_list_of_a_warm_contract(self):
+        self.e.execute_bag([transfer('stu', 'colin', 1)])
+
+        keys = self.e.access_list(transfer('stu', 'raghu', 1), self.d)
+
+        for key in ('currency.balances:stu', 'erc20_clone.__owner__', 'erc20_clone.supply',
+                    'erc20_clone.balances:stu', 'erc20_clone.balances:raghu'):
+            self.assertIn(key, keys)
+
+    def test_bag_reads_what_it_predicted_in_one_round_trip(self):
+        self.e.execute_bag([transfer('stu', 'colin', 1)], auto_commit=True)
+        self.d.cache.clear()
+
+        fetched = []
+        get = self.d.driver.get
+        self.d.driver.get = lambda key: fetched.append(key) or get(key)
+
+        self.e.execute_bag([transfer('stu', 'raghu', 1), transfer('colin', 'stu', 1)])
+
+        self.assertEqual(fetched, [])
+
+    def test_prefetching_does_not_change_outputs(self):
+        e = Executor(driver=self.d)
+        txs = [transfer('stu', 'colin', 10), transfer('colin', 'raghu', 5)]
+
+        e.execute_bag([transfer('stu', 'colin', 1)], auto_commit=True)
+        self.d.cache.clear()
+
+        prefetched = [(o['stamps_used'], o['writes']) for o in e.execute_bag(txs, auto_commit=True)]
+        reads = set(self.d.reads)
+
+        self.set_up_state()
+
+        e.execute_bag([transfer('stu', 'colin', 1)], auto_commit=True)
+        self.d.cache.clear()
+
+        expected = [(o['stamps_used'], o['writes']) for o in [e.execute(**tx, auto_commit=True) for tx in txs]]
+
+        self.assertEqual(prefetched, expected)
+        self.assertEqual(reads, self.d.reads)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver
+from contracting.execution.executor import Executor
+from tests.integration.helpers import submission_kwargs_for_file, TEST_SUBMISSION_KWARGS, transfer
+
+
+class TestExecuteParallel(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.set_up_state()
+
+        self.e = Executor(driver=self.d, metering=False)
+
+    def set_up_state(self):
+        self.d.flush()
+
+        with open('../../contracting/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission',
+                            code=contract)
+        self.d.commit()
+
+        e = Executor(driver=self.d, metering=False)
+        e.execute(**TEST_SUBMISSION_KWARGS,
+                  kwargs=submission_kwargs_for_file('./test_contracts/erc20_clone.s.py'), auto_commit=True)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def assert_same_as_bag(self, txs, **kwargs):
+        expected = self.e.execute_bag(txs, **kwargs)
+        expected_writes = dict(self.d.pending_writes)
+        expected_reads = set(self.d.reads)
+
+        self.set_up_state()
+
+        outputs = self.e.execute_parallel(txs, processes=2, **kwargs)
+
+        self.assertEqual(self.d.reads, expected_reads)
+
+        self.assertEqual(len(outputs), len(expected))
+        for output, serial in zip(outputs, expected):
+            self.assertEqual(output['status_code'], serial['status_code'])
+            self.assertEqual(output['stamps_used'], serial['stamps_used'])
+            self.assertEqual(output['writes'], serial['writes'])
+            self.assertEqual(str(output['result']), str(serial['result']))
+
+        self.assertEqual(self.d.pending_writes, expected_writes)
+
+    def test_independent_transactions_match_bag(self):
+        self.assert_same_as_bag([transfer('stu', 'colin', 1), transfer('stu', 'raghu', 2)])
+
+    def test_conflicting_transactions_match_bag(self):
+        self.assert_same_as_bag([transfer('stu', 'colin', 1000),
+                                 transfer('colin', 'raghu', 1050),
+                                 transfer('raghu', 'stu', 1000),
+                                 transfer('raghu', 'stu', 1000)])
+
+    def test_failed_transactions_match_bag(self):
+        self.assert_same_as_bag([transfer('raghu', 'stu', 100), transfer('stu', 'raghu', 100)])
+
+    def test_auto_commit_writes_state(self):
+        self.e.execute_parallel([transfer('stu', 'colin', 1000), transfer('colin', 'raghu', 1050)],
+                                auto_commit=True, processes=2)
+
+        self.d.clear_pending_state()
+
+        self.assertEqual(self.d.get('erc20_clone.balances:colin'), 50)
+        self.assertEqual(self.d.get('erc20_clone.balances:raghu'), 1050)
+
+    def test_environment_is_passed_to_workers(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, auto_commit=True, kwargs={
+            'name': 'i_use_now',
+            'code': '@export\ndef get_now():\n    return now\n'
+        })
+
+        txs = [
+            {'sender': 'stu', 'contract_name': 'i_use_now', 'function_name': 'get_now', 'kwargs': {}},
+            {'sender': 'stu', 'contract_name': 'i_use_now', 'function_name': 'get_now', 'kwargs': {},
+             'environment': {'now': 2}},
+        ]
+
+        outputs = self.e.execute_parallel(txs, environment={'now': 1}, processes=2)
+
+        self.assertEqual(outputs[0]['result'], 1)
+        self.assertEqual(outputs[1]['result'], 2)
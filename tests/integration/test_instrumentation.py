@@ -0,0 +1,92 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver
+from contracting.execution.executor import Executor
+from contracting.execution.profile import Instrumentation, SANDBOX
+from tests.integration.helpers import submission_kwargs_for_file, TEST_SUBMISSION_KWARGS
+import contracting
+import json
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+
+        with open(contracting.__path__[0] + '/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        Executor(driver=self.d).execute(**TEST_SUBMISSION_KWARGS,
+                                        kwargs=submission_kwargs_for_file('./test_contracts/currency.s.py'),
+                                        metering=False, auto_commit=True)
+
+        self.instrumentation = Instrumentation()
+        self.e = Executor(driver=self.d, instrumentation=self.instrumentation)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def transfer(self, to):
+        return self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': to}, auto_commit=True)
+
+    def test_transactions_are_aggregated(self):
+        outputs = [self.transfer(to) for to in ('colin', 'raghu', 'colin')]
+
+        summary = self.instrumentation.summary()
+
+        self.assertEqual(summary['transactions'], 3)
+        self.assertEqual(summary['stamps_used'], sum(o['stamps_used'] for o in outputs))
+        self.assertEqual(summary['functions']['currency.transfer']['calls'], 3)
+        self.assertGreater(summary['functions']['currency.transfer']['stamps'], 0)
+        self.assertGreater(summary['reads']['currency']['count'], 0)
+        self.assertGreater(summary['writes']['currency']['cost'], 0)
+
+    def test_profile_is_only_returned_when_asked_for(self):
+        self.assertNotIn('profile', self.transfer('colin'))
+
+        output = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'}, profile=True)
+        self.assertIn('profile', output)
+
+    def test_time_is_split_between_contracts_and_sandbox(self):
+        self.transfer('colin')
+
+        stacks = dict(line.rsplit(' ', 1) for line in self.instrumentation.folded('time').splitlines())
+
+        self.assertIn(SANDBOX, stacks)
+        self.assertIn('currency.transfer', stacks)
+        self.assertIn('currency.transfer;{}'.format(SANDBOX), stacks)
+
+    def test_stamps_can_be_folded(self):
+        self.transfer('colin')
+
+        stacks = dict(line.rsplit(' ', 1) for line in self.instrumentation.folded('stamps').splitlines())
+
+        self.assertGreater(int(stacks['currency.transfer']), 0)
+
+    def test_unknown_metric_fails(self):
+        with self.assertRaises(ValueError):
+            self.instrumentation.folded('memory')
+
+    def test_cache_hit_rates(self):
+        self.transfer('colin')
+        self.transfer('colin')
+
+        caches = self.instrumentation.summary()['caches']
+
+        self.assertGreater(caches['code']['hits'], 0)
+        self.assertGreater(caches['namespace']['hit_rate'], 0)
+
+    def test_summary_is_json(self):
+        self.transfer('colin')
+
+        self.assertEqual(json.loads(self.instrumentation.to_json())['transactions'], 1)
+
+    def test_batches_are_not_run_in_parallel(self):
+        txs = [{'sender': 'stu', 'contract_name': 'currency', 'function_name': 'transfer',
+                'kwargs': {'amount': 1, 'to': to}} for to in ('colin', 'raghu')]
+
+        self.e.execute_parallel(txs)
+
+        self.assertEqual(self.instrumentation.transactions, 2)
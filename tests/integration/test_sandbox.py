@@ -0,0 +1,185 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver
+from contracting.execution.executor import Executor
+from contracting.execution.sandbox import SandboxError
+from tests.integration import helpers
+from tests.integration.helpers import submission_kwargs_for_file, TEST_SUBMISSION_KWARGS
+import os
+
+
+def transfer(to, amount=1):
+    # Currency, rather than erc20_clone, sent by stu
+    return helpers.transfer('stu', to, amount, contract_name='currency')
+
+
+class CrashingExecutor(Executor):
+    # Takes the worker down when asked to execute a function named crash
+    def execute_in_process(self, *args, **kwargs):
+        if kwargs.get('function_name') == 'crash' and self.sandbox is None:
+            os._exit(1)
+
+        return super().execute_in_process(*args, **kwargs)
+
+
+class TestSandbox(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.set_up_state()
+
+        self.e = Executor(driver=self.d, production=True, processes=2)
+
+    def set_up_state(self):
+        self.d.flush()
+
+        with open('../../contracting/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        Executor(driver=self.d, metering=False).execute(**TEST_SUBMISSION_KWARGS,
+                                                        kwargs=submission_kwargs_for_file('./test_contracts/currency.s.py'),
+                                                        auto_commit=True)
+
+    def tearDown(self):
+        self.e.sandbox.terminate()
+        self.d.flush()
+
+    def test_outputs_are_the_same_as_in_process(self):
+        txs = [transfer('colin'), transfer('raghu', amount=2), transfer('colin', amount=10 ** 12)]
+
+        outputs = [self.e.execute(**tx, auto_commit=True) for tx in txs]
+        balances = [self.d.get('currency.balances:' + name) for name in ('stu', 'colin', 'raghu')]
+
+        self.set_up_state()
+
+        e = Executor(driver=self.d)
+        expected = [e.execute(**tx, auto_commit=True) for tx in txs]
+
+        for output, serial in zip(outputs, expected):
+            self.assertEqual(output['status_code'], serial['status_code'])
+            self.assertEqual(output['stamps_used'], serial['stamps_used'])
+            self.assertEqual(str(output['result']), str(serial['result']))
+
+        self.assertEqual(balances, [self.d.get('currency.balances:' + name) for name in ('stu', 'colin', 'raghu')])
+
+    def test_reads_are_the_same_as_in_process(self):
+        txs = [transfer('colin'), transfer('raghu', amount=2)]
+
+        self.d.reads.clear()
+        for tx in txs:
+            self.e.execute(**tx)
+        reads = set(self.d.reads)
+
+        self.set_up_state()
+
+        e = Executor(driver=self.d)
+        self.d.reads.clear()
+        for tx in txs:
+            e.execute(**tx)
+
+        self.assertEqual(reads, self.d.reads)
+
+    def test_workers_are_kept_between_transactions(self):
+        self.e.execute(**transfer('colin'), auto_commit=True)
+        pids = [w.process.pid for w in self.e.sandbox.workers]
+
+        self.e.execute(**transfer('colin'), auto_commit=True)
+
+        self.assertEqual(pids, [w.process.pid for w in self.e.sandbox.workers])
+
+    def test_workers_see_earlier_transactions(self):
+        for _ in range(3):
+            self.e.execute(**transfer('colin'), auto_commit=True)
+
+        output = self.e.execute('stu', 'currency', 'balance', kwargs={'account': 'colin'})
+
+        self.assertEqual(output['result'], 103)
+
+    def test_nothing_is_written_by_the_workers(self):
+        output = self.e.execute(**transfer('raghu'))
+
+        self.assertEqual(output['writes']['currency.balances:raghu'], 1)
+        self.assertIsNone(self.d.driver.get('currency.balances:raghu'))
+
+    def test_dead_worker_is_replaced(self):
+        self.e.execute(**transfer('colin'), auto_commit=True)
+
+        worker = self.e.sandbox.workers[0]
+        worker.process.kill()
+        worker.process.join()
+
+        output = self.e.execute(**transfer('colin'), auto_commit=True)
+
+        self.assertEqual(output['status_code'], 0)
+        self.assertNotEqual(self.e.sandbox.workers[0].process.pid, worker.process.pid)
+
+    def test_crash_fails_the_transaction_and_charges_its_stamps(self):
+        e = CrashingExecutor(driver=self.d, production=True, processes=1)
+        before = self.d.get('currency.balances:stu')
+
+        try:
+            output = e.execute('stu', 'currency', 'crash', kwargs={}, stamps=1000, auto_commit=True)
+
+            self.assertEqual(output['status_code'], 1)
+            self.assertIsInstance(output['result'], SandboxError)
+            self.assertEqual(output['stamps_used'], 1000)
+            self.assertLess(self.d.get('currency.balances:stu'), before)
+
+            # The next transaction gets a new worker
+            self.assertEqual(e.execute(**transfer('colin'), auto_commit=True)['status_code'], 0)
+        finally:
+            e.sandbox.terminate()
+
+    def test_private_functions_are_refused_before_reaching_a_worker(self):
+        with self.assertRaises(AssertionError):
+            self.e.execute('stu', 'currency', '__transfer', kwargs={})
+
+        self.assertEqual(self.e.sandbox.workers, [])
+
+    def test_execute_parallel_is_the_same_as_execute_bag(self):
+        txs = [transfer(to) for to in ('colin', 'raghu', 'colin', 'tejas', 'raghu')]
+
+        outputs = self.e.execute_parallel(txs)
+        writes = dict(self.d.pending_writes)
+
+        self.set_up_state()
+
+        expected = Executor(driver=self.d).execute_bag(txs)
+
+        for output, serial in zip(outputs, expected):
+            self.assertEqual(output['status_code'], serial['status_code'])
+            self.assertEqual(output['stamps_used'], serial['stamps_used'])
+            self.assertEqual(output['writes'], serial['writes'])
+
+        self.assertEqual(writes, self.d.pending_writes)
+
+    def test_explicit_driver_executes_in_process(self):
+        self.e.execute(**transfer('colin'), driver=ContractDriver(driver=self.d.driver))
+
+        self.assertEqual(self.e.sandbox.workers, [])
+
+    def balance(self, name):
+        return self.e.execute('stu', 'currency', 'balance', kwargs={'account': name})['result']
+
+    def test_workers_drop_writes_the_driver_dropped(self):
+        self.e.execute(**transfer('raghu'))
+        self.d.clear_pending_state()
+
+        self.assertIsNone(self.balance('raghu'))
+
+    def test_workers_see_writes_made_to_the_driver_directly(self):
+        self.balance('colin')
+
+        self.d.set('currency.balances:colin', 7)
+
+        self.assertEqual(self.balance('colin'), 7)
+
+    def test_workers_see_layers_applied_and_rolled_back(self):
+        self.balance('colin')
+
+        self.d.soft_apply('1', {'currency.balances:colin': 5})
+        self.assertEqual(self.balance('colin'), 5)
+
+        self.d.rollback()
+        self.assertEqual(self.balance('colin'), 100)
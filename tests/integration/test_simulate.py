@@ -0,0 +1,116 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver, ReadOnlyDriver
+from contracting.execution.executor import Executor
+from contracting.execution import runtime
+from contracting.execution.cache import NAMESPACE_CACHE
+from tests.integration.helpers import submission_kwargs_for_file, TEST_SUBMISSION_KWARGS
+import threading
+
+
+class TestSimulate(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+
+        with open('../../contracting/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        Executor(driver=self.d, metering=False).execute(**TEST_SUBMISSION_KWARGS,
+                                                        kwargs=submission_kwargs_for_file('./test_contracts/currency.s.py'),
+                                                        auto_commit=True)
+
+        self.e = Executor(driver=self.d)
+
+        # Loading contract code costs stamps the first time, whichever way it's called
+        self.e.execute('stu', 'currency', 'balance', kwargs={'account': 'colin'})
+
+    def tearDown(self):
+        self.d.flush()
+
+    def balance(self, account):
+        return self.e.simulate('stu', 'currency', 'balance', kwargs={'account': account})
+
+    def test_reads_cost_the_same_and_charge_nothing(self):
+        executed = self.e.execute('stu', 'currency', 'balance', kwargs={'account': 'colin'})
+        before = self.d.get('currency.balances:stu')
+
+        simulated = self.balance('colin')
+
+        self.assertEqual(simulated['status_code'], 0)
+        self.assertEqual(simulated['result'], 100)
+        self.assertEqual(simulated['stamps_used'], executed['stamps_used'])
+        self.assertNotIn('writes', simulated)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), before)
+
+    def test_writes_fail(self):
+        pending = dict(self.d.pending_writes)
+
+        output = self.e.simulate('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'})
+
+        self.assertEqual(output['status_code'], 1)
+        self.assertIsInstance(output['result'], AssertionError)
+        self.assertEqual(self.d.pending_writes, pending)
+        self.assertEqual(self.balance('colin')['result'], 100)
+
+    def test_only_committed_state_is_read(self):
+        self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'})
+        self.assertEqual(self.balance('colin')['result'], 100)
+
+        self.d.commit()
+        self.assertEqual(self.balance('colin')['result'], 101)
+
+    def test_driver_must_be_read_only(self):
+        with self.assertRaises(AssertionError):
+            self.e.simulate('stu', 'currency', 'balance', kwargs={'account': 'colin'}, driver=self.d)
+
+    def test_each_simulation_sees_what_was_committed_before_it(self):
+        self.assertEqual(self.balance('colin')['result'], 100)
+
+        self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'}, auto_commit=True)
+
+        self.assertEqual(self.balance('colin')['result'], 101)
+
+    def test_runtime_keeps_its_driver_after_a_simulation(self):
+        self.e.simulate('stu', 'currency', 'balance', kwargs={'account': 'colin'},
+                        driver=ReadOnlyDriver(driver=self.d.driver))
+
+        self.assertIs(runtime.rt.env['__Driver'], self.d)
+        self.assertNotIsInstance(runtime.rt.loader_driver, ReadOnlyDriver)
+
+    def test_simulation_between_transactions_leaves_the_warm_namespace(self):
+        self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'}, auto_commit=True)
+        warm = NAMESPACE_CACHE.get('currency')
+        self.assertIsNotNone(warm)
+
+        self.balance('colin')
+
+        misses = NAMESPACE_CACHE.misses
+        self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'}, auto_commit=True)
+
+        self.assertEqual(NAMESPACE_CACHE.misses, misses)
+        self.assertIs(NAMESPACE_CACHE.get('currency'), warm)
+
+    def test_simulations_run_alongside_execution(self):
+        results = []
+
+        def simulate():
+            for _ in range(20):
+                output = self.balance('raghu')
+                results.append((output['status_code'], output['stamps_used']))
+
+        thread = threading.Thread(target=simulate)
+        thread.start()
+
+        outputs = [self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'colin'}, auto_commit=True)
+                   for _ in range(20)]
+
+        thread.join()
+
+        self.assertTrue(all(o['status_code'] == 0 for o in outputs))
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(results[0][0], 0)
+        self.assertEqual(self.d.get('currency.balances:colin'), 120)
@@ -3,6 +3,8 @@ from contracting.db.driver import ContractDriver
 from contracting.execution.executor import Executor
 from contracting.config import STAMPS_PER_TAU
 from contracting.execution import runtime
+from contracting.execution.metering.costs import CostSchedule, read_costs, register_schedule, unregister_schedule, \
+    schedule_at
 import contracting
 
 def submission_kwargs_for_file(f):
@@ -129,3 +131,35 @@ class TestMetering(TestCase):
                                 )
         self.assertNotEquals(self.e.driver.pending_writes['currency.balances:stu'], prior_balance)
 
+    def test_cost_schedule_follows_block_height(self):
+        register_schedule(CostSchedule(version=2, costs={k: v * 10 for k, v in read_costs().items()}, height=100))
+
+        try:
+            before = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'},
+                                    environment={'block_num': 99})
+
+            after = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'},
+                                   environment={'block_num': 100})
+        finally:
+            unregister_schedule(2)
+            runtime.rt.use_cost_schedule(schedule_at())
+
+        self.assertEqual(before['status_code'], 0)
+        self.assertEqual(after['status_code'], 0)
+        self.assertGreater(after['stamps_used'], before['stamps_used'])
+
+    def test_profile_shows_where_stamps_went(self):
+        # Load the contract first, so that neither execution pays for fetching its code
+        self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'})
+
+        plain = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'})
+        self.assertNotIn('profile', plain)
+
+        output = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'}, profile=True)
+        profile = output['profile']
+
+        self.assertEqual(output['stamps_used'], plain['stamps_used'])
+        self.assertIn('currency.transfer', profile['functions'])
+        self.assertIn('currency.balances:stu', profile['reads'])
+        self.assertIn('currency.balances:colin', profile['writes'])
+        self.assertEqual(sum(profile['contracts'].values()) // 1000 + 1, output['stamps_used'])
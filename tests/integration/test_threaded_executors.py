@@ -0,0 +1,89 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver, Driver
+from contracting.execution.executor import Executor
+from tests.integration.helpers import submission_kwargs_for_file, TEST_SUBMISSION_KWARGS
+import contracting
+import threading
+import sys
+
+
+def state(collection):
+    d = ContractDriver(driver=Driver(collection=collection))
+    d.flush()
+
+    with open(contracting.__path__[0] + '/contracts/submission.s.py') as f:
+        contract = f.read()
+
+    d.set_contract(name='submission', code=contract)
+    d.commit()
+
+    Executor(driver=d).execute(**TEST_SUBMISSION_KWARGS,
+                               kwargs=submission_kwargs_for_file('./test_contracts/currency.s.py'),
+                               metering=False, auto_commit=True)
+
+    return d
+
+
+class TestThreadedExecutors(TestCase):
+    def setUp(self):
+        self.drivers = [state('threads_a'), state('threads_b'), state('threads_c')]
+
+        # Switch threads as often as possible, so that transactions interleave
+        self.interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.interval)
+
+        for d in self.drivers:
+            d.flush()
+
+    def transfers(self, driver, to, outputs):
+        e = Executor(driver=driver)
+        for i in range(20):
+            outputs.append(e.execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': to}, auto_commit=True))
+
+    def run_on_threads(self, *runs):
+        threads = [threading.Thread(target=self.transfers, args=run) for run in runs]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+    def test_executors_on_threads_keep_to_their_own_driver(self):
+        a, b, _ = self.drivers
+        colin = a.get('currency.balances:colin')
+
+        outputs_a, outputs_b = [], []
+        self.run_on_threads((a, 'colin', outputs_a), (b, 'raghu', outputs_b))
+
+        self.assertTrue(all(o['status_code'] == 0 for o in outputs_a + outputs_b))
+
+        self.assertEqual(a.get('currency.balances:colin'), colin + 20)
+        self.assertEqual(b.get('currency.balances:raghu'), 20)
+
+        self.assertIsNone(a.get('currency.balances:raghu'))
+        self.assertEqual(b.get('currency.balances:colin'), colin)
+
+    def test_stamps_are_the_same_as_on_one_thread(self):
+        a, b, c = self.drivers
+
+        # Load the contract first, so that no run pays for fetching its code
+        for d in self.drivers:
+            Executor(driver=d).execute('stu', 'currency', 'transfer', kwargs={'amount': 1, 'to': 'raghu'},
+                                       auto_commit=True)
+
+        serial = []
+        self.transfers(c, 'colin', serial)
+
+        outputs_a, outputs_b = [], []
+        self.run_on_threads((a, 'colin', outputs_a), (b, 'colin', outputs_b))
+
+        expected = [o['stamps_used'] for o in serial]
+
+        self.assertEqual([o['stamps_used'] for o in outputs_a], expected)
+        self.assertEqual([o['stamps_used'] for o in outputs_b], expected)
+        self.assertEqual(a.get('currency.balances:colin'), c.get('currency.balances:colin'))
+        self.assertEqual(b.get('currency.balances:colin'), c.get('currency.balances:colin'))
@@ -1,6 +1,7 @@
 import secrets
 from contracting.db.driver import ContractDriver
 from contracting.execution.executor import Executor
+from contracting.execution.profile import Instrumentation
 
 def submission_kwargs_for_file(f):
     # Get the file name only by splitting off directories
@@ -35,13 +36,13 @@ with open('../../contracting/contracts/submission.s.py') as f:
 
 d.set_contract(name='submission',
                     code=contract,
-                    author='sys')
+                    owner='sys')
 d.commit()
 
 recipients = [secrets.token_hex(16) for _ in range(1000)]
 
-
-e = Executor()
+instrumentation = Instrumentation()
+e = Executor(metering=False, instrumentation=instrumentation)
 
 e.execute(**TEST_SUBMISSION_KWARGS,
           kwargs=submission_kwargs_for_file('../integration/test_contracts/erc20_clone.s.py'))
@@ -52,24 +53,22 @@ import datetime
 for i in range(20):
     now = datetime.datetime.now()
 
-    # profiler = Profiler()
-    # profiler.start()
     for r in recipients:
-        _, res, _ = e.execute(sender='stu',
+        e.execute(sender='stu',
                   contract_name='erc20_clone',
                   function_name='transfer',
                   kwargs={
                       'amount': 1,
                       'to': r
                   })
-        print(res)
-
-    # profiler.stop()
 
     print(datetime.datetime.now() - now)
 
 d.flush()
 
-# print(profiler.last_session.duration)
-# print(profiler.output_text(unicode=True, color=True, show_all=True))
+# Render with flamegraph.pl or speedscope
+with open('prof_transfer.folded', 'w') as f:
+    f.write(instrumentation.folded())
 
+with open('prof_transfer.json', 'w') as f:
+    f.write(instrumentation.to_json())
@@ -0,0 +1,68 @@
+from unittest import TestCase
+from contracting.compilation.blocks import code_objects, leaders, block_costs, block_costs_for_code, \
+    dump_block_costs, load_block_costs
+from contracting.execution.metering.costs import CostSchedule, DEFAULT_SCHEDULE, read_costs
+import dis
+
+
+class RecordingTracer:
+    def __init__(self):
+        self.tables = []
+
+    def set_block_costs(self, code, costs):
+        self.tables.append((code, costs))
+
+
+class TestBlocks(TestCase):
+    def test_straight_line_code_is_one_block(self):
+        code = compile('a = 1\nb = a + 2\n', '', 'exec')
+
+        self.assertEqual(leaders(code), {0})
+
+    def test_jump_targets_start_blocks(self):
+        code = compile('if a:\n    b = 1\nelse:\n    b = 2\n', '', 'exec')
+
+        targets = {i.argval for i in dis.get_instructions(code) if i.opcode in dis.hasjabs or i.opcode in dis.hasjrel}
+
+        self.assertTrue(targets.issubset(leaders(code)))
+        self.assertGreater(len(leaders(code)), 1)
+
+    def test_blocks_add_up_to_every_opcode(self):
+        code = compile('for i in range(10):\n    if i:\n        a = i * 2\n', '', 'exec')
+
+        expected = sum(DEFAULT_SCHEDULE.costs[op] for op in code.co_code[::2])
+        total = sum(cost for offset, cost in block_costs_for_code(code, DEFAULT_SCHEDULE.costs))
+
+        self.assertEqual(total, expected)
+
+    def test_nested_code_objects_get_their_own_table(self):
+        code = compile('def f():\n    def g():\n        return 1\n    return g\n', '', 'exec')
+
+        self.assertEqual(len(list(code_objects(code))), 3)
+        self.assertEqual(len(block_costs(code, DEFAULT_SCHEDULE.costs)), 3)
+
+    def test_load_block_costs_registers_every_code_object(self):
+        code = compile('def f(a):\n    return a\n', '', 'exec')
+        tracer = RecordingTracer()
+
+        load_block_costs(tracer, code, dump_block_costs(code, DEFAULT_SCHEDULE), DEFAULT_SCHEDULE)
+
+        self.assertEqual([c for c, _ in tracer.tables], list(code_objects(code)))
+        self.assertEqual(tuple(t for _, t in tracer.tables), block_costs(code, DEFAULT_SCHEDULE.costs))
+
+    def test_load_block_costs_accepts_hex(self):
+        code = compile('a = 1', '', 'exec')
+        tracer = RecordingTracer()
+
+        load_block_costs(tracer, code, dump_block_costs(code, DEFAULT_SCHEDULE).hex(), DEFAULT_SCHEDULE)
+
+        self.assertEqual(len(tracer.tables), 1)
+
+    def test_costs_from_another_schedule_are_added_up_again(self):
+        code = compile('a = 1\nb = 2\n', '', 'exec')
+        tracer = RecordingTracer()
+
+        doubled = CostSchedule(version=2, costs={k: v * 2 for k, v in read_costs().items()})
+        load_block_costs(tracer, code, dump_block_costs(code, DEFAULT_SCHEDULE), doubled)
+
+        self.assertEqual(tracer.tables[0][1], block_costs_for_code(code, doubled.costs))
@@ -0,0 +1,151 @@
+from unittest import TestCase
+from contracting.execution.metering.costs import CostSchedule, DEFAULT_SCHEDULE, SCHEDULES, read_costs, \
+    validate_costs, register_schedule, unregister_schedule, schedule_at, commit_height, UNKNOWN_OPCODE_COST
+from contracting.execution.metering import costs as costs_module
+from contracting.db.driver import ContractDriver
+from contracting.execution.runtime import rt
+from contracting.execution.cache import CODE_CACHE
+from array import array
+import subprocess
+import threading
+import sys
+import dis
+import os
+
+
+class TestCosts(TestCase):
+    def setUp(self):
+        costs_module._committed_height = None
+
+    def tearDown(self):
+        for version in list(SCHEDULES):
+            if version != DEFAULT_SCHEDULE.version:
+                unregister_schedule(version)
+
+        costs_module._committed_height = None
+        rt.use_cost_schedule(schedule_at())
+
+    def test_default_schedule_prices_every_opcode(self):
+        for opcode in dis.opmap.values():
+            self.assertEqual(DEFAULT_SCHEDULE.costs[opcode], read_costs()[opcode])
+
+    def test_missing_opcode_is_rejected(self):
+        costs = read_costs()
+        del costs[dis.opmap['BINARY_ADD' if 'BINARY_ADD' in dis.opmap else 'BINARY_OP']]
+
+        with self.assertRaises(ValueError):
+            validate_costs(costs)
+
+    def test_negative_cost_is_rejected(self):
+        costs = read_costs()
+        costs[dis.opmap['NOP']] = -1
+
+        with self.assertRaises(ValueError):
+            CostSchedule(version=2, costs=costs)
+
+    def test_buffer_holds_every_opcode(self):
+        costs = array('Q')
+        costs.frombytes(DEFAULT_SCHEDULE.buffer())
+
+        self.assertEqual(list(costs), DEFAULT_SCHEDULE.costs)
+        self.assertEqual(len(costs), 256)
+
+    def test_schedule_at_picks_latest_schedule_in_effect(self):
+        later = CostSchedule(version=2, costs=read_costs(), height=100)
+        register_schedule(later)
+
+        self.assertIs(schedule_at(0), DEFAULT_SCHEDULE)
+        self.assertIs(schedule_at(99), DEFAULT_SCHEDULE)
+        self.assertIs(schedule_at(100), later)
+
+    def test_schedule_at_no_height_is_the_one_in_effect_at_the_committed_height(self):
+        later = CostSchedule(version=2, costs=read_costs(), height=100)
+        register_schedule(later)
+
+        self.assertIs(schedule_at(), DEFAULT_SCHEDULE)
+
+        commit_height(99)
+        self.assertIs(schedule_at(), DEFAULT_SCHEDULE)
+
+        commit_height(100)
+        self.assertIs(schedule_at(), later)
+
+        # Heights only move forward
+        commit_height(50)
+        self.assertIs(schedule_at(), later)
+
+    def test_committing_a_block_commits_its_height(self):
+        later = CostSchedule(version=2, costs=read_costs(), height=100)
+        register_schedule(later)
+
+        driver = ContractDriver()
+        driver.at_height(100)
+        driver.set('a', 1)
+
+        self.assertIs(schedule_at(), DEFAULT_SCHEDULE)
+
+        driver.commit()
+
+        self.assertIs(schedule_at(), later)
+
+        driver.flush()
+
+    def test_version_cannot_be_registered_twice(self):
+        with self.assertRaises(ValueError):
+            register_schedule(CostSchedule(version=DEFAULT_SCHEDULE.version, costs=read_costs()))
+
+    def test_default_schedule_cannot_be_removed(self):
+        with self.assertRaises(ValueError):
+            unregister_schedule(DEFAULT_SCHEDULE.version)
+
+    def test_switching_schedules_keeps_loaded_contracts_apart(self):
+        CODE_CACHE.set('priced', ('hash', None))
+
+        rt.use_cost_schedule(CostSchedule(version=2, costs=read_costs()))
+        self.assertNotIn('priced', CODE_CACHE)
+
+        rt.use_cost_schedule(DEFAULT_SCHEDULE)
+        self.assertIn('priced', CODE_CACHE)
+
+        CODE_CACHE.pop('priced')
+
+    def test_other_thread_switching_schedules_keeps_loaded_contracts(self):
+        CODE_CACHE.set('priced', ('hash', None))
+
+        def simulate():
+            rt.use_cost_schedule(CostSchedule(version=2, costs=read_costs()))
+            CODE_CACHE.set('priced', ('other hash', None))
+
+        thread = threading.Thread(target=simulate)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(CODE_CACHE.get('priced'), ('hash', None))
+
+        CODE_CACHE.pop('priced')
+
+    def test_schedule_missing_an_opcode_is_priced_by_default(self):
+        costs = read_costs()
+        del costs[dis.opmap['NOP']]
+
+        schedule = CostSchedule(version=2, costs=costs)
+
+        self.assertEqual(schedule.unpriced, ['NOP'])
+        self.assertEqual(schedule.costs[dis.opmap['NOP']], UNKNOWN_OPCODE_COST)
+
+    def test_schedule_missing_an_opcode_cannot_be_registered(self):
+        costs = read_costs()
+        del costs[dis.opmap['NOP']]
+
+        with self.assertRaises(ValueError):
+            register_schedule(CostSchedule(version=2, costs=costs))
+
+    def test_executor_imports_on_this_interpreter(self):
+        # In a new interpreter, as the schedules are made when the package is first imported
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + sys.path))
+
+        result = subprocess.run([sys.executable, '-c', 'from contracting.execution.executor import Executor'],
+                                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from contracting.db.encoder import encode, decode, safe_repr, convert_dict, convert_dict
+from contracting.db.encoder import encode, decode, safe_repr, convert_dict, convert_dict, encode_binary, decode_binary, \
+    encode_value, decode_value, BINARY
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from datetime import datetime
 from contracting.stdlib.bridge.decimal import ContractingDecimal
@@ -294,3 +295,75 @@ class TestEncode(TestCase):
         d2 = convert_dict(d)
 
         self.assertEqual(expected, d2)
+
+
+class TestEncodeBinary(TestCase):
+    def test_int_round_trips(self):
+        for i in [0, 1, -1, 127, 128, -129, 2 ** 64, -(2 ** 100)]:
+            self.assertEqual(decode_binary(encode_binary(i)), i)
+
+    def test_str_round_trips(self):
+        for s in ['', 'hello', 'ünïcödé']:
+            self.assertEqual(decode_binary(encode_binary(s)), s)
+
+    def test_constants_round_trip(self):
+        self.assertIsNone(decode_binary(encode_binary(None)))
+        self.assertIs(decode_binary(encode_binary(True)), True)
+        self.assertIs(decode_binary(encode_binary(False)), False)
+
+    def test_large_int_is_smaller_than_json(self):
+        self.assertLess(len(encode_binary(2 ** 64)), len(encode(2 ** 64)))
+
+    def test_decimal_round_trips_to_contracting_decimal(self):
+        d = ContractingDecimal('1.098409840984')
+        self.assertEqual(decode_binary(encode_binary(d)), d)
+        self.assertEqual(type(decode_binary(encode_binary(d))), ContractingDecimal)
+
+    def test_float_round_trips_like_json(self):
+        self.assertEqual(decode_binary(encode_binary(1.5)), decode(encode(1.5)))
+
+    def test_bytes_round_trip(self):
+        self.assertEqual(decode_binary(encode_binary(b'\x00\xff')), b'\x00\xff')
+
+    def test_datetime_round_trips(self):
+        d = Datetime(2019, 1, 2, 3, 4, 5, 6)
+        self.assertEqual(decode_binary(encode_binary(d)), d)
+
+    def test_timedelta_round_trips(self):
+        t = Timedelta(days=-3, seconds=40)
+        self.assertEqual(decode_binary(encode_binary(t)), t)
+
+    def test_nested_structures_round_trip(self):
+        d = {
+            'a': [1, 'two', {'three': ContractingDecimal('3.3')}],
+            'b': None,
+            'c': {'d': [Datetime(2019, 1, 1)]}
+        }
+
+        self.assertEqual(decode_binary(encode_binary(d)), d)
+
+    def test_dict_keys_are_coerced_like_json(self):
+        d = {1: 'a', None: 'b', True: 'c'}
+        self.assertEqual(decode_binary(encode_binary(d)), decode(encode(d)))
+
+    def test_encoding_is_deterministic(self):
+        d = {'x': [1, 2, 3], 'y': 'z'}
+        self.assertEqual(encode_binary(d), encode_binary(dict(d)))
+
+    def test_unknown_types_raise_type_error(self):
+        with self.assertRaises(TypeError):
+            encode_binary(object())
+
+    def test_decode_falls_back_to_json(self):
+        self.assertEqual(decode_binary(b'{"__fixed__":"0.5"}'), ContractingDecimal('0.5'))
+        self.assertEqual(decode_binary('"howdy"'), 'howdy')
+
+    def test_decode_truncated_returns_none(self):
+        self.assertIsNone(decode_binary(encode_binary('hello')[:-1]))
+
+    def test_encode_value_selects_encoding(self):
+        self.assertEqual(encode_value(123), b'123')
+        self.assertEqual(encode_value(123, BINARY), encode_binary(123))
+
+        self.assertEqual(decode_value(b'123'), 123)
+        self.assertEqual(decode_value(encode_binary(123), BINARY), 123)
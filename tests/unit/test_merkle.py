@@ -0,0 +1,129 @@
+from unittest import TestCase
+from contracting.db.driver import InMemDriver
+from contracting.db.merkle import MerkleTree, verify, bucket_hash, EMPTY, NODE_PREFIX
+
+
+class TestMerkleTree(TestCase):
+    def setUp(self):
+        self.store = InMemDriver()
+        self.tree = MerkleTree(self.store, depth=2)
+
+    def write(self, writes):
+        # Written to the state and to the tree in one batch, as a driver commits
+        self.store.batch_set({**writes, **self.tree.nodes(writes)})
+
+    def test_empty_tree(self):
+        self.assertEqual(self.tree.root(), EMPTY)
+
+    def test_root_changes_with_the_state(self):
+        self.write({'a': 1})
+        root = self.tree.root()
+
+        self.write({'a': 2})
+
+        self.assertNotEqual(root, self.tree.root())
+
+    def test_root_does_not_depend_on_the_order_of_writes(self):
+        self.write({'a': 1, 'b': 2, 'c': 3})
+
+        other = MerkleTree(InMemDriver(), depth=2)
+        other.update({'c': 3})
+        other.update({'a': 1})
+        other.update({'b': 2})
+
+        self.assertEqual(self.tree.root(), other.root())
+
+    def test_deleting_every_key_empties_the_tree(self):
+        self.write({'a': 1, 'b': 2})
+        self.tree.root()
+
+        self.write({'a': None, 'b': None})
+
+        self.assertEqual(self.tree.root(), EMPTY)
+        self.assertEqual(self.store.iter(NODE_PREFIX), [])
+
+    def test_deleting_a_key_gives_back_the_previous_root(self):
+        self.write({'a': 1})
+        root = self.tree.root()
+
+        self.write({'b': 2})
+        self.tree.root()
+
+        self.write({'b': None})
+
+        self.assertEqual(self.tree.root(), root)
+
+    def test_only_written_paths_are_hashed_again(self):
+        self.write({'key{}'.format(i): i for i in range(100)})
+        self.tree.root()
+
+        written = []
+        batch_set = self.store.batch_set
+        self.store.batch_set = lambda writes: written.append(writes) or batch_set(writes)
+
+        self.write({'key1': 'changed'})
+
+        # The state write, one bucket and two interior nodes
+        self.assertEqual(len(written), 1)
+        self.assertEqual(len(written[0]), 4)
+
+    def test_nodes_are_not_listed_with_the_state(self):
+        self.write({'a': 1, 'b': 2})
+
+        self.assertEqual(self.store.keys(), ['a', 'b'])
+        self.assertEqual(self.store.iter(''), ['a', 'b'])
+        self.assertEqual(list(self.store.iter_items()), [('a', 1), ('b', 2)])
+
+        self.assertNotEqual(self.store.iter(NODE_PREFIX), [])
+
+    def test_incremental_root_is_the_same_as_a_rebuild(self):
+        self.write({'key{}'.format(i): i for i in range(50)})
+        self.tree.root()
+        self.write({'key{}'.format(i): None for i in range(0, 50, 3)})
+        self.write({'key7': [1, 2], 'new': 'value'})
+
+        root = self.tree.root()
+
+        self.tree.rebuild(self.store.iter_items())
+
+        self.assertEqual(self.tree.root(), root)
+
+    def test_proof_of_a_value(self):
+        self.write({'key{}'.format(i): i for i in range(50)})
+        root = self.tree.root()
+
+        proof = self.tree.proof('key3')
+
+        self.assertTrue(verify(root, 'key3', 3, proof))
+        self.assertFalse(verify(root, 'key3', 4, proof))
+        self.assertFalse(verify(root, 'key3', None, proof))
+
+    def test_proof_of_an_absent_key(self):
+        self.write({'key{}'.format(i): i for i in range(50)})
+        root = self.tree.root()
+
+        proof = self.tree.proof('nothing')
+
+        self.assertTrue(verify(root, 'nothing', None, proof))
+        self.assertFalse(verify(root, 'nothing', 1, proof))
+
+    def test_proof_does_not_verify_against_another_root(self):
+        self.write({'a': 1})
+        proof = self.tree.proof('a')
+
+        self.write({'b': 2})
+
+        self.assertFalse(verify(self.tree.root(), 'a', 1, proof))
+
+    def test_relabelled_bucket_does_not_prove_a_key_absent(self):
+        self.write({'currency.balances:bob': 100, 'currency.balances:alice': 5})
+        root = self.tree.root()
+
+        proof = self.tree.proof('currency.balances:bob')
+
+        forged = list(proof)
+        forged[0] = dict(proof[0])
+        forged[0]['currency.balances:bob\x00'] = forged[0].pop('currency.balances:bob')
+
+        self.assertNotEqual(bucket_hash(forged[0]), bucket_hash(proof[0]))
+        self.assertFalse(verify(root, 'currency.balances:bob', None, forged))
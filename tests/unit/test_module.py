@@ -1,5 +1,6 @@
 from unittest import TestCase
 from contracting.execution.module import *
+from contracting.execution.cache import LRUCache, CODE_CACHE, NAMESPACE_CACHE
 import types
 import glob
 
@@ -67,6 +68,177 @@ class TestDatabaseLoader(TestCase):
         self.assertEqual(self.dl.module_repr(module), "<module 'howdy' (smart contract)>")
 
 
+class TestWarmModules(TestCase):
+    def setUp(self):
+        self.dl = DatabaseLoader()
+        enable_warm_modules()
+
+    def tearDown(self):
+        enable_warm_modules()
+        rt.env = {}
+        self.dl.d.flush()
+
+    def test_warm_module_body_only_runs_once(self):
+        self.dl.d.set_contract('warm_once', 'def b():\n    return 1337\n')
+
+        first = types.ModuleType('warm_once')
+        self.dl.exec_module(first)
+
+        second = types.ModuleType('warm_once')
+        self.dl.exec_module(second)
+
+        self.assertIs(first.b, second.b)
+
+    def test_cold_module_body_runs_every_time(self):
+        disable_warm_modules()
+
+        self.dl.d.set_contract('warm_cold', 'b = [1337]')
+
+        first = types.ModuleType('warm_cold')
+        self.dl.exec_module(first)
+
+        second = types.ModuleType('warm_cold')
+        self.dl.exec_module(second)
+
+        self.assertIsNot(first.b, second.b)
+
+    def test_warm_module_gets_new_environment(self):
+        self.dl.d.set_contract('warm_env', 'b = 1337')
+
+        rt.env = {'now': 1, 'block_num': 10}
+        first = types.ModuleType('warm_env')
+        self.dl.exec_module(first)
+
+        rt.env = {'now': 2}
+        second = types.ModuleType('warm_env')
+        self.dl.exec_module(second)
+
+        self.assertEqual(second.now, 2)
+        self.assertFalse(hasattr(second, 'block_num'))
+
+    def test_warm_module_keeps_names_it_defined(self):
+        self.dl.d.set_contract('warm_defined', 'now = 1337')
+
+        rt.env = {'now': 1}
+        first = types.ModuleType('warm_defined')
+        self.dl.exec_module(first)
+
+        rt.env = {'now': 2}
+        second = types.ModuleType('warm_defined')
+        self.dl.exec_module(second)
+
+        self.assertEqual(second.now, 1337)
+
+    def test_disable_warm_modules_clears_them(self):
+        self.dl.d.set_contract('warm_cleared', 'b = 1337')
+
+        self.dl.exec_module(types.ModuleType('warm_cleared'))
+        self.assertIn('warm_cleared', NAMESPACE_CACHE)
+
+        disable_warm_modules()
+
+        self.assertNotIn('warm_cleared', NAMESPACE_CACHE)
+
+    def test_reuse_counts_as_hit(self):
+        self.dl.d.set_contract('warm_hits', 'b = 1337')
+
+        NAMESPACE_CACHE.reset_stats()
+
+        self.dl.exec_module(types.ModuleType('warm_hits'))
+        self.dl.exec_module(types.ModuleType('warm_hits'))
+
+        self.assertEqual(NAMESPACE_CACHE.misses, 1)
+        self.assertEqual(NAMESPACE_CACHE.hits, 1)
+
+    def test_new_code_invalidates_module(self):
+        self.dl.d.set_contract('warm_replaced', 'b = 1')
+        self.dl.exec_module(types.ModuleType('warm_replaced'))
+
+        self.dl.d.delete_contract('warm_replaced')
+        self.assertNotIn('warm_replaced', NAMESPACE_CACHE)
+        self.assertNotIn('warm_replaced', CODE_CACHE)
+
+        self.dl.d.set_contract('warm_replaced', 'b = 2')
+
+        module = types.ModuleType('warm_replaced')
+        self.dl.exec_module(module)
+
+        self.assertEqual(module.b, 2)
+
+    def test_stale_code_hash_is_not_reused(self):
+        self.dl.d.set_contract('warm_stale', 'def b():\n    return 1\n')
+
+        first = types.ModuleType('warm_stale')
+        self.dl.exec_module(first)
+
+        code_hash, code = CODE_CACHE.get('warm_stale')
+        CODE_CACHE.set('warm_stale', ('different', code))
+
+        second = types.ModuleType('warm_stale')
+        self.dl.exec_module(second)
+
+        self.assertIsNot(first.b, second.b)
+
+    def test_mutable_values_are_not_reused(self):
+        self.dl.d.set_contract('warm_mutable', 'b = [1337]')
+
+        first = types.ModuleType('warm_mutable')
+        self.dl.exec_module(first)
+
+        second = types.ModuleType('warm_mutable')
+        self.dl.exec_module(second)
+
+        self.assertNotIn('warm_mutable', NAMESPACE_CACHE)
+        self.assertIsNot(first.b, second.b)
+
+    def test_body_with_side_effects_is_not_reused(self):
+        self.dl.d.set_contract('warm_side_effects', 'b = len("1337")')
+
+        self.dl.exec_module(types.ModuleType('warm_side_effects'))
+
+        self.assertNotIn('warm_side_effects', NAMESPACE_CACHE)
+
+
+class TestLRUCache(TestCase):
+    def test_get_set(self):
+        c = LRUCache(maxsize=2)
+        c.set('a', 1)
+
+        self.assertEqual(c.get('a'), 1)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.hits, 1)
+        self.assertEqual(c.misses, 1)
+
+    def test_least_recently_used_is_evicted(self):
+        c = LRUCache(maxsize=2)
+        c.set('a', 1)
+        c.set('b', 2)
+
+        c.get('a')
+        c.set('c', 3)
+
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+        self.assertIn('c', c)
+        self.assertEqual(c.evictions, 1)
+
+    def test_invalid_entries_are_dropped(self):
+        c = LRUCache()
+        c.set('a', 1)
+
+        self.assertIsNone(c.get('a', validate=lambda v: v == 2))
+        self.assertNotIn('a', c)
+        self.assertEqual(c.misses, 1)
+
+    def test_stats(self):
+        c = LRUCache(maxsize=1)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('b')
+
+        self.assertDictEqual(c.stats(), {'hits': 1, 'misses': 0, 'evictions': 1, 'size': 1})
+
+
 class TestInstallLoader(TestCase):
     def test_install_loader(self):
         uninstall_database_loader()
@@ -94,6 +266,18 @@ class TestInstallLoader(TestCase):
 
         self.assertEqual(testing.a, 1234567890)
 
+    def test_submodules_are_not_looked_up(self):
+        driver = ContractDriver()
+        driver.reads.clear()
+
+        install_database_loader(driver=driver)
+
+        try:
+            self.assertIsNone(DatabaseFinder.find_spec('multiprocessing.pool', None))
+            self.assertEqual(driver.reads, set())
+        finally:
+            uninstall_database_loader()
+
 
 driver = ContractDriver()
 
@@ -1,5 +1,8 @@
 from unittest import TestCase
 from contracting.db.driver import CacheDriver, Driver
+from contracting.db.cache import entry_size
+from contracting.db.encoder import encode_kv
+from contracting.execution.runtime import rt
 
 
 class TestCacheDriver(TestCase):
@@ -64,7 +67,8 @@ class TestCacheDriver(TestCase):
 
         self.c.clear_pending_state()
 
-        self.assertFalse(len(self.c.cache) > 0)
+        self.assertNotIn('thing1', self.c.cache)
+        self.assertNotIn('thing2', self.c.cache)
         self.assertFalse(len(self.c.reads) > 0)
         self.assertFalse(len(self.c.pending_writes) > 0)
 
@@ -141,9 +145,10 @@ class TestCacheDriver(TestCase):
 
         self.c.hard_apply('1')
 
+        # The change for '2' is still pending on top
         res = self.c.get('thing1')
 
-        self.assertEqual(res, 7777)
+        self.assertEqual(res, 6666)
 
         self.assertEqual(self.c.driver.get('thing1'), 7777)
 
@@ -240,3 +245,385 @@ class TestCacheDriver(TestCase):
         self.c.rollback()
 
         self.assertDictEqual(self.c.pending_deltas, {})
+
+    def test_get_many_merges_cache_and_db(self):
+        self.d.set('a', 1)
+        self.d.set('b', 2)
+
+        self.c.set('b', 20)
+
+        self.assertDictEqual(self.c.get_many(['a', 'b', 'c']), {'a': 1, 'b': 20, 'c': None})
+
+        self.assertEqual(self.c.cache['a'], 1)
+        self.assertSetEqual(self.c.reads, {'a', 'c'})
+
+    def test_values_are_not_encoded_for_sizes_when_not_metering(self):
+        self.d.set('thing', 1234)
+
+        self.c.get('thing')
+        self.c.set('thing2', 1234)
+
+        self.assertDictEqual(self.c.sizes, {})
+
+    def test_metered_size_is_remembered_for_cached_values(self):
+        rt.set_up(stmps=1000000, meter=True)
+
+        self.d.set('thing', 'howdy')
+        self.c.get('thing')
+
+        size = self.c.sizes['thing']
+
+        rt.tracer.stop()
+        rt.clean_up()
+
+        k, v = encode_kv('thing', 'howdy')
+        self.assertEqual(size, len(k) + len(v))
+
+    def test_set_replaces_metered_size(self):
+        rt.set_up(stmps=1000000, meter=True)
+
+        self.c.set('thing', 'a')
+        self.c.set('thing', 'abcdef')
+
+        size = self.c.sizes['thing']
+
+        rt.tracer.stop()
+        rt.clean_up()
+
+        k, v = encode_kv('thing', 'abcdef')
+        self.assertEqual(size, len(k) + len(v))
+
+    def test_mutable_values_are_not_sized_ahead_of_time(self):
+        rt.set_up(stmps=1000000, meter=True)
+
+        self.c.set('thing', {'a': 1})
+
+        rt.tracer.stop()
+        rt.clean_up()
+
+        self.assertNotIn('thing', self.c.sizes)
+
+    def test_soft_apply_does_not_read_the_db(self):
+        self.d.set('thing1', 9999)
+
+        get = self.d.get
+        self.d.get = lambda key: self.fail('Read {} from the db'.format(key))
+
+        try:
+            self.c.soft_apply('0', {'thing1': 8888})
+        finally:
+            self.d.get = get
+
+        self.assertDictEqual(self.c.pending_deltas, {'0': {'thing1': (9999, 8888)}})
+
+    def test_layers_are_read_newest_first(self):
+        self.d.set('thing1', 1)
+        self.d.set('thing2', 2)
+
+        self.c.soft_apply('0', {'thing1': 10, 'thing2': 20})
+        self.c.soft_apply('1', {'thing1': 100})
+
+        self.assertEqual(self.c.get('thing1'), 100)
+        self.assertEqual(self.c.get('thing2'), 20)
+        self.assertDictEqual(self.c.get_many(['thing1', 'thing2']), {'thing1': 100, 'thing2': 20})
+
+    def test_layered_values_are_not_cached(self):
+        self.c.soft_apply('0', {'thing1': 8888})
+        self.c.get('thing1')
+
+        self.assertNotIn('thing1', self.c.cache)
+
+    def test_layers_outlive_clear_pending_state(self):
+        self.c.soft_apply('0', {'thing1': 8888})
+        self.c.clear_pending_state()
+
+        self.assertEqual(self.c.get('thing1'), 8888)
+
+    def test_deleted_in_a_layer_hides_the_db(self):
+        self.d.set('thing1', 9999)
+
+        self.c.soft_apply('0', {'thing1': None})
+
+        self.assertIsNone(self.c.get('thing1'))
+
+    def test_hlcs_out_of_order_are_layered_in_order(self):
+        self.c.soft_apply('1', {'thing1': 7777})
+        self.c.soft_apply('0', {'thing1': 8888})
+
+        self.assertEqual(self.c.get('thing1'), 7777)
+
+        self.c.hard_apply('0')
+
+        self.assertEqual(self.d.get('thing1'), 8888)
+        self.assertEqual(self.c.get('thing1'), 7777)
+
+    def test_hard_apply_writes_in_one_batch(self):
+        batches = []
+        batch_set = self.d.batch_set
+        self.d.batch_set = lambda writes: batches.append(dict(writes)) or batch_set(writes)
+
+        self.c.soft_apply('0', {'thing1': 1, 'thing2': 2})
+        self.c.soft_apply('1', {'thing1': 10})
+        self.c.soft_apply('2', {'thing3': 3})
+
+        self.c.hard_apply('1')
+
+        self.assertEqual(batches, [{'thing1': 10, 'thing2': 2}])
+        self.assertEqual(self.c.get('thing3'), 3)
+        self.assertIsNone(self.d.get('thing3'))
+
+    def test_hard_apply_of_unknown_hlc_does_nothing(self):
+        self.c.soft_apply('0', {'thing1': 8888})
+        self.c.hard_apply('5')
+
+        self.assertIsNone(self.d.get('thing1'))
+        self.assertEqual(len(self.c.layers), 1)
+
+    def test_rollback_puts_back_uncommitted_writes(self):
+        self.c.set('thing1', 9999)
+
+        self.c.soft_apply('0', {'thing1': 8888})
+        self.assertNotIn('thing1', self.c.pending_writes)
+
+        self.c.rollback()
+
+        self.assertEqual(self.c.get('thing1'), 9999)
+        self.assertEqual(self.c.pending_writes['thing1'], 9999)
+
+
+class TestCacheDriverReadCache(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = CacheDriver(self.d)
+
+        self.fetched = []
+        get = self.d.get
+        self.d.get = lambda key: self.fetched.append(key) or get(key)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_absent_keys_are_only_read_from_db_once(self):
+        self.assertIsNone(self.c.get('thing'))
+        self.assertIsNone(self.c.get('thing'))
+        self.assertIsNone(self.c.peek('thing'))
+
+        self.assertEqual(self.fetched, ['thing'])
+
+    def test_absent_keys_are_marked_as_read(self):
+        self.c.get('thing')
+        self.c.reads.clear()
+
+        self.c.get('thing')
+
+        self.assertIn('thing', self.c.reads)
+
+    def test_deleted_key_is_read_as_absent(self):
+        self.d.set('thing', 1)
+
+        self.c.delete('thing')
+
+        self.assertIsNone(self.c.get('thing'))
+        self.assertEqual(self.fetched, [])
+
+    def test_stats(self):
+        self.d.set('thing', 1)
+
+        self.c.get('thing')
+        self.c.get('thing')
+        self.c.get('other')
+        self.c.get('other')
+
+        stats = self.c.cache.stats()
+
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['negative_hits'], 1)
+        self.assertEqual(stats['size'], 2)
+
+    def test_least_recently_read_values_are_evicted(self):
+        self.c = CacheDriver(self.d, cache_size=entry_size('thing1', None) * 2)
+
+        self.c.get('thing1')
+        self.c.get('thing2')
+        self.c.get('thing1')
+        self.c.get('thing3')
+
+        self.assertIn('thing1', self.c.cache)
+        self.assertNotIn('thing2', self.c.cache)
+        self.assertEqual(self.c.cache.stats()['evictions'], 1)
+
+    def test_evicted_values_are_read_from_db_again(self):
+        self.d.set('thing1', 1)
+        self.c = CacheDriver(self.d, cache_size=entry_size('thing1', 1))
+
+        self.c.get('thing1')
+        self.c.get('thing2')
+
+        self.assertEqual(self.c.get('thing1'), 1)
+        self.assertEqual(self.fetched, ['thing1', 'thing2', 'thing1'])
+
+    def test_written_values_are_never_evicted(self):
+        self.c = CacheDriver(self.d, cache_size=entry_size('thing1', 1))
+
+        self.c.set('thing1', 1)
+        self.c.set('thing2', 2)
+        self.c.get('thing3')
+
+        self.assertEqual(self.c.get('thing1'), 1)
+        self.assertEqual(self.c.get('thing2'), 2)
+        self.assertEqual(self.fetched, ['thing3'])
+
+
+    def test_values_changed_in_place_are_evicted_at_the_size_they_were_cached_with(self):
+        self.d.set('thing1', [1])
+        self.c = CacheDriver(self.d, cache_size=entry_size('thing1', self.d.get('thing1')) + entry_size('thing2', None))
+
+        self.c.get('thing1')
+        self.c.cache['thing1'].extend(range(1000))
+
+        self.c.get('thing2')
+        self.c.get('thing3')
+
+        self.assertNotIn('thing1', self.c.cache)
+        self.assertEqual(self.c.cache.clean_size, entry_size('thing2', None) + entry_size('thing3', None))
+
+
+class TestCacheDriverWarmCache(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = CacheDriver(self.d)
+
+        self.fetched = []
+        get = self.d.get
+        self.d.get = lambda key: self.fetched.append(key) or get(key)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_committed_values_are_kept_between_blocks(self):
+        self.c.set('thing', 1)
+        self.c.commit()
+        self.c.clear_pending_state()
+
+        self.assertEqual(self.c.get('thing'), 1)
+        self.assertEqual(self.fetched, [])
+
+    def test_read_values_are_kept_between_blocks(self):
+        self.d.set('thing', 1)
+
+        self.c.get('thing')
+        self.c.clear_pending_state()
+
+        self.assertEqual(self.c.get('thing'), 1)
+        self.assertEqual(self.fetched, ['thing'])
+
+    def test_uncommitted_writes_are_dropped(self):
+        self.d.set('thing', 1)
+
+        self.c.set('thing', 2)
+        self.c.clear_pending_state()
+
+        self.assertEqual(self.c.get('thing'), 1)
+
+    def test_values_that_can_change_in_place_are_dropped(self):
+        self.d.set('thing', [1, 2])
+
+        self.c.get('thing').append(3)
+        self.c.clear_pending_state()
+
+        self.assertEqual(self.c.get('thing'), [1, 2])
+
+    def test_first_read_of_a_block_is_marked(self):
+        self.d.set('thing', 1)
+
+        self.c.get('thing')
+        self.c.clear_pending_state()
+
+        self.c.get('thing')
+        self.assertIn('thing', self.c.reads)
+
+        self.c.reads.clear()
+        self.c.get('thing')
+        self.assertEqual(self.c.reads, set())
+
+    def test_hard_applied_values_are_cached(self):
+        self.c.soft_apply('0', {'thing': 1})
+        self.c.hard_apply('0')
+
+        self.assertEqual(self.c.get('thing'), 1)
+        self.assertEqual(self.fetched, [])
+
+    def test_hard_apply_does_not_hide_newer_layers(self):
+        self.c.soft_apply('0', {'thing': 1})
+        self.c.soft_apply('1', {'thing': 2})
+        self.c.hard_apply('0')
+
+        self.assertEqual(self.c.get('thing'), 2)
+
+        self.c.rollback()
+
+        self.assertEqual(self.c.get('thing'), 1)
+
+
+class TestCacheDriverPrefetch(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.d.set('thing1', 1)
+        self.d.set('thing2', 2)
+
+        self.c = CacheDriver(self.d)
+
+        self.fetched = []
+        get_many = self.d.get_many
+        self.d.get_many = lambda keys: self.fetched.append(sorted(keys)) or get_many(keys)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_keys_are_loaded_at_once(self):
+        self.c.prefetch(['thing1', 'thing2', 'thing3'])
+
+        self.assertEqual(self.fetched, [['thing1', 'thing2', 'thing3']])
+        self.assertEqual(self.c.cache['thing1'], 1)
+        self.assertIsNone(self.c.cache['thing3'])
+
+    def test_keys_in_memory_are_not_loaded(self):
+        self.c.set('thing1', 10)
+        self.c.soft_apply('0', {'thing2': 20})
+
+        self.c.prefetch(['thing1', 'thing2'])
+
+        self.assertEqual(self.fetched, [])
+
+    def test_prefetched_keys_are_marked_when_read(self):
+        self.c.prefetch(['thing1'])
+        self.assertEqual(self.c.reads, set())
+
+        self.c.get('thing1')
+        self.assertIn('thing1', self.c.reads)
+
+    def read_cost(self, key):
+        rt.set_up(stmps=1000000, meter=True)
+        self.c.get(key)
+        rt.tracer.stop()
+
+        cost = rt.tracer.get_stamp_used()
+        rt.clean_up()
+
+        return cost
+
+    def test_prefetched_keys_cost_the_same_to_read(self):
+        self.c.prefetch(['thing1'])
+        prefetched = self.read_cost('thing1')
+
+        self.c.clear_pending_state()
+        self.c.cache.clear()
+
+        self.assertEqual(prefetched, self.read_cost('thing1'))
@@ -1,6 +1,9 @@
 from unittest import TestCase
-from contracting.db.driver import ContractDriver, Driver
+from contracting.db.driver import ContractDriver, ReadOnlyDriver, Driver
+from contracting.db.merkle import verify, NODE_PREFIX
 from contracting.stdlib.bridge.time import Datetime
+from contracting.compilation.blocks import dump_block_costs
+from contracting.execution.runtime import rt
 
 import marshal
 from datetime import datetime
@@ -279,6 +282,45 @@ class TestContractDriver(TestCase):
 
         self.assertDictEqual(items, kvs_2)
 
+    def test_iter_items_merges_cache_and_db_in_key_order(self):
+        self.c.driver.set('pref_a', 1)
+        self.c.driver.set('pref_c', 3)
+        self.c.driver.set('pref_d', 4)
+
+        self.c.set('pref_b', 2)
+        self.c.set('pref_c', 30)
+        self.c.set('pref_d', None)
+
+        items = list(self.c.iter_items('pref_'))
+
+        self.assertListEqual(items, [('pref_a', 1), ('pref_b', 2), ('pref_c', 30)])
+
+    def test_iter_items_limit_and_start_after(self):
+        for i in range(10):
+            self.c.driver.set('pref_{}'.format(i), i)
+
+        self.c.set('pref_3', None)
+
+        page = list(self.c.iter_items('pref_', limit=3))
+        self.assertListEqual(page, [('pref_0', 0), ('pref_1', 1), ('pref_2', 2)])
+
+        page = list(self.c.iter_items('pref_', start_after=page[-1][0], limit=3))
+        self.assertListEqual(page, [('pref_4', 4), ('pref_5', 5), ('pref_6', 6)])
+
+    def test_iter_items_only_reads_what_it_yields(self):
+        for i in range(10):
+            self.c.driver.set('pref_{}'.format(i), i)
+
+        list(self.c.iter_items('pref_', limit=2))
+
+        self.assertSetEqual(self.c.reads, {'pref_0', 'pref_1'})
+
+    def test_items_skips_deleted_keys(self):
+        self.c.driver.set('pref_a', 1)
+        self.c.set('pref_a', None)
+
+        self.assertDictEqual(self.c.items('pref_'), {})
+
     def test_make_key_no_args(self):
         c = 'stubucks'
         v = 'balances'
@@ -378,6 +420,206 @@ print('hello, world!')
 
         self.assertEqual(self.c.get_contract('test'), code)
         self.assertEqual(self.c.get_compiled('test'), code_blob)
+        self.assertEqual(self.c.get_block_costs('test'), dump_block_costs(code_obj, rt.cost_schedule))
         self.assertEqual(self.c.get_owner('test'), 'something')
         self.assertEqual(self.c.get_time_submitted('test'), time)
 
+
+class TestReadOnlyDriver(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.d.set('a', 1)
+
+        self.c = ReadOnlyDriver(self.d)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_reads_committed_state(self):
+        self.assertEqual(self.c.get('a'), 1)
+        self.assertEqual(self.c.items(), {'a': 1})
+
+    def test_writes_fail(self):
+        with self.assertRaises(AssertionError):
+            self.c.set('a', 2)
+
+        with self.assertRaises(AssertionError):
+            self.c.delete('a')
+
+        with self.assertRaises(AssertionError):
+            self.c.put('a', 2)
+
+        self.assertEqual(self.c.pending_writes, {})
+        self.assertEqual(self.d.get('a'), 1)
+
+    def test_values_read_are_kept(self):
+        self.c.get('a')
+        self.d.set('a', 2)
+
+        self.assertEqual(self.c.get('a'), 1)
+
+
+class TestContractDriverLayers(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = ContractDriver(self.d)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_items_include_layers(self):
+        self.d.set('a.b:1', 1)
+        self.d.set('a.b:2', 2)
+
+        self.c.soft_apply('0', {'a.b:2': 20, 'a.b:3': 30})
+        self.c.soft_apply('1', {'a.b:1': None})
+
+        self.assertDictEqual(self.c.items('a.b:'), {'a.b:2': 20, 'a.b:3': 30})
+
+    def test_soft_applied_code_replaces_loaded_contract(self):
+        self.c.set_contract(name='thing', code='a = 1')
+        self.c.commit()
+
+        self.c.soft_apply('0', {'thing.__code__': 'a = 2'})
+
+        self.assertEqual(self.c.get_contract('thing'), 'a = 2')
+
+        self.c.rollback()
+
+        self.assertEqual(self.c.get_contract('thing'), 'a = 1')
+
+
+class TestContractDriverWarmCache(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = ContractDriver(self.d)
+
+        self.c.set_contract(name='thing', code='a = 1')
+        self.c.set('thing.b', 2)
+        self.c.commit()
+        self.c.clear_pending_state()
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_deleted_contract_is_not_read_from_the_cache(self):
+        self.assertEqual(self.c.get_contract('thing'), 'a = 1')
+
+        self.c.delete_contract('thing')
+
+        self.assertIsNone(self.c.get_contract('thing'))
+        self.assertIsNone(self.c.get('thing.b'))
+
+    def test_other_contracts_stay_cached(self):
+        self.c.set('other.b', 3)
+        self.c.commit()
+        self.c.clear_pending_state()
+
+        self.c.delete_contract('thing')
+
+        self.assertIn('other.b', self.c.cache)
+
+    def test_flush_empties_the_cache(self):
+        self.c.flush()
+
+        self.assertEqual(len(self.c.cache), 0)
+        self.assertIsNone(self.c.get('thing.b'))
+
+
+class TestContractDriverStateRoot(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = ContractDriver(self.d, merkle=True)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_commit_changes_the_root(self):
+        root = self.c.state_root()
+
+        self.c.set('a.b', 1)
+        self.assertEqual(self.c.state_root(), root)
+
+        self.c.commit()
+        self.assertNotEqual(self.c.state_root(), root)
+
+    def test_hard_apply_changes_the_root(self):
+        self.c.set('a.b', 1)
+        self.c.commit()
+
+        self.c.soft_apply('0', {'a.b': 2})
+        root = self.c.state_root()
+
+        self.c.hard_apply('0')
+
+        self.assertNotEqual(self.c.state_root(), root)
+
+    def test_root_is_the_same_as_a_rebuild(self):
+        self.c.set_contract(name='thing', code='a = 1')
+        self.c.set('thing.b', 2)
+        self.c.commit()
+        self.c.soft_apply('0', {'thing.b': 3, 'thing.c': 4})
+        self.c.hard_apply('0')
+        self.c.delete_contract('thing')
+        self.c.set('other.b', 5)
+        self.c.commit()
+
+        root = self.c.state_root()
+
+        self.c.rebuild_state_tree()
+
+        self.assertEqual(self.c.state_root(), root)
+
+    def test_proof_of_a_committed_value(self):
+        self.c.set('a.b', 1)
+        self.c.commit()
+
+        self.assertTrue(verify(self.c.state_root(), 'a.b', 1, self.c.state_proof('a.b')))
+
+    def test_commit_writes_the_state_and_the_tree_in_one_batch(self):
+        self.c.set('a.b', 1)
+
+        written = []
+        batch_set = self.d.batch_set
+        self.d.batch_set = lambda writes: written.append(writes) or batch_set(writes)
+
+        self.c.commit()
+
+        self.assertEqual(len(written), 1)
+        self.assertIn('a.b', written[0])
+        self.assertTrue(any(k.startswith(NODE_PREFIX) for k in written[0]))
+
+    def test_hard_apply_writes_the_state_and_the_tree_in_one_batch(self):
+        self.c.soft_apply('0', {'a.b': 1})
+
+        written = []
+        batch_set = self.d.batch_set
+        self.d.batch_set = lambda writes: written.append(writes) or batch_set(writes)
+
+        self.c.hard_apply('0')
+
+        self.assertEqual(len(written), 1)
+        self.assertIn('a.b', written[0])
+        self.assertTrue(any(k.startswith(NODE_PREFIX) for k in written[0]))
+
+    def test_nodes_are_not_listed_with_the_state(self):
+        self.c.set('a.b', 1)
+        self.c.set('a.c', 2)
+        self.c.commit()
+
+        self.assertEqual(self.d.keys(), ['a.b', 'a.c'])
+        self.assertEqual(self.c.keys(), ['a.b', 'a.c'])
+        self.assertEqual(self.c.items(), {'a.b': 1, 'a.c': 2})
+        self.assertEqual(list(self.c.iter_items('')), [('a.b', 1), ('a.c', 2)])
+
+    def test_drivers_without_a_tree_have_no_root(self):
+        with self.assertRaises(AssertionError):
+            ContractDriver(self.d).state_root()
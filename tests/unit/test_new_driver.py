@@ -1,5 +1,7 @@
 from unittest import TestCase
-from contracting.db.driver import Driver, InMemDriver, FSDriver, LMDBDriver
+from contracting.db.driver import Driver, InMemDriver, FSDriver, LMDBDriver, convert_encoding, prefix_successor
+from contracting.db.encoder import BINARY, JSON, encode_binary
+from contracting.stdlib.bridge.decimal import ContractingDecimal
 import random
 
 
@@ -207,6 +209,33 @@ class TestDriver(TestCase):
 
         self.assertListEqual(prefix_2_keys[:5], p2)
 
+    def test_iter_items_pages_in_key_order(self):
+        for k in ['b3', 'a1', 'b1', 'c1', 'b2']:
+            self.d.set(k, k.upper())
+
+        self.assertListEqual(list(self.d.iter_items(prefix='b')), [('b1', 'B1'), ('b2', 'B2'), ('b3', 'B3')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', limit=2)), [('b1', 'B1'), ('b2', 'B2')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', start_after='b1')), [('b2', 'B2'), ('b3', 'B3')])
+
+    def test_get_many_returns_none_for_missing_keys(self):
+        self.d.set('a', 1)
+        self.d.set('b', 'b')
+
+        self.assertDictEqual(self.d.get_many(['a', 'b', 'c']), {'a': 1, 'b': 'b', 'c': None})
+
+    def test_batch_set_sets_and_deletes(self):
+        self.d.set('b', 'b')
+
+        self.d.batch_set({
+            'a': 1,
+            'b': None,
+            'c': {'x': 1}
+        })
+
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertIsNone(self.d.get('b'))
+        self.assertDictEqual(self.d.get('c'), {'x': 1})
+
     def test_key_error_if_getitem_doesnt_exist(self):
         with self.assertRaises(KeyError):
             print(self.d['thing'])
@@ -251,6 +280,21 @@ class TestDriver(TestCase):
         self.assertListEqual(keys, got_keys)
 
 
+    def test_iter_does_not_treat_prefix_as_pattern(self):
+        self.d.set('con.x', 1)
+        self.d.set('conAx', 2)
+        self.d.set('con.y', 3)
+
+        self.assertListEqual(self.d.iter(prefix='con.'), ['con.x', 'con.y'])
+        self.assertListEqual(self.d.iter(prefix='con.', length=1), ['con.x'])
+
+    def test_prefix_successor(self):
+        self.assertEqual(prefix_successor('abc'), 'abd')
+        self.assertEqual(prefix_successor('a' + chr(0x10FFFF)), 'b')
+        self.assertEqual(prefix_successor('a' + chr(0xD7FF)), 'a' + chr(0xE000))
+        self.assertIsNone(prefix_successor(''))
+
+
 class TestInMemDriver(TestCase):
     # Flush this sucker every test
     def setUp(self):
@@ -455,6 +499,33 @@ class TestInMemDriver(TestCase):
 
         self.assertListEqual(prefix_2_keys[:5], p2)
 
+    def test_iter_items_pages_in_key_order(self):
+        for k in ['b3', 'a1', 'b1', 'c1', 'b2']:
+            self.d.set(k, k.upper())
+
+        self.assertListEqual(list(self.d.iter_items(prefix='b')), [('b1', 'B1'), ('b2', 'B2'), ('b3', 'B3')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', limit=2)), [('b1', 'B1'), ('b2', 'B2')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', start_after='b1')), [('b2', 'B2'), ('b3', 'B3')])
+
+    def test_get_many_returns_none_for_missing_keys(self):
+        self.d.set('a', 1)
+        self.d.set('b', 'b')
+
+        self.assertDictEqual(self.d.get_many(['a', 'b', 'c']), {'a': 1, 'b': 'b', 'c': None})
+
+    def test_batch_set_sets_and_deletes(self):
+        self.d.set('b', 'b')
+
+        self.d.batch_set({
+            'a': 1,
+            'b': None,
+            'c': {'x': 1}
+        })
+
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertIsNone(self.d.get('b'))
+        self.assertDictEqual(self.d.get('c'), {'x': 1})
+
     def test_key_error_if_getitem_doesnt_exist(self):
         with self.assertRaises(KeyError):
             print(self.d['thing'])
@@ -498,6 +569,33 @@ class TestInMemDriver(TestCase):
 
         self.assertListEqual(keys, got_keys)
 
+    def test_overwriting_key_does_not_duplicate_it(self):
+        self.d.set('a', 1)
+        self.d.set('a', 2)
+
+        self.assertListEqual(self.d.keys(), ['a'])
+        self.assertListEqual(self.d.iter(prefix='a'), ['a'])
+
+    def test_deleted_keys_are_not_iterated(self):
+        for k in ['ab', 'ac', 'ad', 'b']:
+            self.d.set(k, k)
+
+        self.d.delete('ac')
+        del self.d['b']
+        self.d.delete('zz')
+
+        self.assertListEqual(self.d.iter(prefix='a'), ['ab', 'ad'])
+        self.assertListEqual(self.d.keys(), ['ab', 'ad'])
+
+    def test_iter_only_walks_keys_under_prefix(self):
+        for k in ['a', 'ab:1', 'ab:2', 'abc', 'b:1', 'c']:
+            self.d.set(k, k)
+
+        self.assertListEqual(self.d.iter(prefix='ab:'), ['ab:1', 'ab:2'])
+        self.assertListEqual(self.d.iter(prefix='b'), ['b:1'])
+        self.assertListEqual(self.d.iter(prefix='bb'), [])
+        self.assertListEqual(self.d.iter(prefix='d'), [])
+
 
 class TestFSDriver(TestCase):
     # Flush this sucker every test
@@ -703,6 +801,33 @@ class TestFSDriver(TestCase):
 
         self.assertListEqual(prefix_2_keys[:5], p2)
 
+    def test_iter_items_pages_in_key_order(self):
+        for k in ['b3', 'a1', 'b1', 'c1', 'b2']:
+            self.d.set(k, k.upper())
+
+        self.assertListEqual(list(self.d.iter_items(prefix='b')), [('b1', 'B1'), ('b2', 'B2'), ('b3', 'B3')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', limit=2)), [('b1', 'B1'), ('b2', 'B2')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', start_after='b1')), [('b2', 'B2'), ('b3', 'B3')])
+
+    def test_get_many_returns_none_for_missing_keys(self):
+        self.d.set('a', 1)
+        self.d.set('b', 'b')
+
+        self.assertDictEqual(self.d.get_many(['a', 'b', 'c']), {'a': 1, 'b': 'b', 'c': None})
+
+    def test_batch_set_sets_and_deletes(self):
+        self.d.set('b', 'b')
+
+        self.d.batch_set({
+            'a': 1,
+            'b': None,
+            'c': {'x': 1}
+        })
+
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertIsNone(self.d.get('b'))
+        self.assertDictEqual(self.d.get('c'), {'x': 1})
+
     def test_key_error_if_getitem_doesnt_exist(self):
         with self.assertRaises(KeyError):
             print(self.d['thing'])
@@ -951,6 +1076,39 @@ class TestLMDBDriver(TestCase):
 
         self.assertListEqual(prefix_2_keys[:5], p2)
 
+    def test_iter_items_pages_in_key_order(self):
+        for k in ['b3', 'a1', 'b1', 'c1', 'b2']:
+            self.d.set(k, k.upper())
+
+        self.assertListEqual(list(self.d.iter_items(prefix='b')), [('b1', 'B1'), ('b2', 'B2'), ('b3', 'B3')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', limit=2)), [('b1', 'B1'), ('b2', 'B2')])
+        self.assertListEqual(list(self.d.iter_items(prefix='b', start_after='b1')), [('b2', 'B2'), ('b3', 'B3')])
+
+    def test_iter_items_keeps_the_prefix_key_when_starting_before_it(self):
+        for k in ['a1', 'b', 'b1']:
+            self.d.set(k, k.upper())
+
+        self.assertListEqual(list(self.d.iter_items(prefix='b', start_after='a1')), [('b', 'B'), ('b1', 'B1')])
+
+    def test_get_many_returns_none_for_missing_keys(self):
+        self.d.set('a', 1)
+        self.d.set('b', 'b')
+
+        self.assertDictEqual(self.d.get_many(['a', 'b', 'c']), {'a': 1, 'b': 'b', 'c': None})
+
+    def test_batch_set_sets_and_deletes(self):
+        self.d.set('b', 'b')
+
+        self.d.batch_set({
+            'a': 1,
+            'b': None,
+            'c': {'x': 1}
+        })
+
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertIsNone(self.d.get('b'))
+        self.assertDictEqual(self.d.get('c'), {'x': 1})
+
     def test_key_error_if_getitem_doesnt_exist(self):
         with self.assertRaises(KeyError):
             print(self.d['thing'])
@@ -992,4 +1150,50 @@ class TestLMDBDriver(TestCase):
 
         got_keys = self.d.keys()
 
-        self.assertListEqual(keys, got_keys)
\ No newline at end of file
+        self.assertListEqual(keys, got_keys)
+
+
+class TestBinaryEncoding(TestCase):
+    def setUp(self):
+        self.d = InMemDriver(encoding=BINARY)
+        self.d.flush()
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_values_are_stored_binary(self):
+        self.d.set('a', 'hello')
+        self.assertEqual(self.d.db[b'a'], encode_binary('hello'))
+
+    def test_get_set(self):
+        value = {'a': [1, ContractingDecimal('2.5')]}
+        self.d.set('thing', value)
+        self.assertEqual(self.d.get('thing'), value)
+
+    def test_fs_driver_binary_get_set(self):
+        d = FSDriver(encoding=BINARY)
+        d.flush()
+
+        d.set('stu.balances:colin', ContractingDecimal('100.5'))
+        self.assertEqual(d.get('stu.balances:colin'), ContractingDecimal('100.5'))
+
+        d.flush()
+
+    def test_convert_encoding_json_to_binary(self):
+        d = InMemDriver()
+        d.set('a', 1)
+        d.set('b', {'c': ContractingDecimal('1.5')})
+
+        convert_encoding(d, BINARY, batch_size=1)
+
+        self.assertEqual(d.encoding, BINARY)
+        self.assertEqual(d.db[b'a'], encode_binary(1))
+        self.assertEqual(d.get('b'), {'c': ContractingDecimal('1.5')})
+
+    def test_convert_encoding_binary_to_json(self):
+        self.d.set('a', 'x')
+
+        convert_encoding(self.d, JSON)
+
+        self.assertEqual(self.d.db[b'a'], b'"x"')
+        self.assertEqual(self.d.get('a'), 'x')
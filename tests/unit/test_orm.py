@@ -326,6 +326,28 @@ class TestHash(TestCase):
 
         self.assertDictEqual(kvs, got)
 
+    def test_iter_yields_keys_relative_to_hash(self):
+        h = Hash('blah', 'scoob', driver=driver)
+
+        h['1'] = 123
+        h['2'] = 456
+        h['x', 'y'] = 789
+
+        self.assertListEqual(list(h.iter()), [('1', 123), ('2', 456), ('x:y', 789)])
+        self.assertListEqual(list(h.iter('x')), [('x:y', 789)])
+
+    def test_iter_pages_with_limit_and_start_after(self):
+        h = Hash('blah', 'scoob', driver=driver)
+
+        for i in range(5):
+            h[i] = i
+
+        page = list(h.iter(limit=2))
+        self.assertListEqual(page, [('0', 0), ('1', 1)])
+
+        page = list(h.iter(start_after=page[-1][0], limit=2))
+        self.assertListEqual(page, [('2', 2), ('3', 3)])
+
     def test_items_multi_hash_returns_kv_pairs(self):
         contract = 'blah'
         name = 'scoob'
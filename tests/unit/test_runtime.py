@@ -1,8 +1,14 @@
 from unittest import TestCase
 from contracting.execution import runtime
+from contracting.compilation.blocks import dump_block_costs, load_block_costs
+from contracting.execution.metering.costs import CostSchedule, read_costs, register_schedule, unregister_schedule, \
+    schedule_at, DEFAULT_SCHEDULE
+from contracting.db.driver import ContractDriver, InMemDriver
+from collections import OrderedDict
 import sys
 import psutil
 import os
+import threading
 
 
 class TestRuntime(TestCase):
@@ -139,4 +145,231 @@ class TestRuntime(TestCase):
         with self.assertRaises(AssertionError):
             runtime.rt.deduct_write('a', 'b' * 32 * 1024)
 
-        runtime.rt.clean_up()
\ No newline at end of file
+        runtime.rt.clean_up()
+
+    def measure(self, f, *args):
+        runtime.rt.set_up(stmps=1000000, meter=True)
+        f(*args)
+        runtime.rt.tracer.stop()
+        used = runtime.rt.tracer.get_stamp_used()
+        runtime.rt.clean_up()
+        return used
+
+    def test_tracer_charges_every_opcode_on_a_line(self):
+        scope = {'__contract__': True}
+        exec('def short(a):\n    return a\n\ndef long(a):\n    return a + a + a + a + a\n', scope)
+
+        self.assertGreater(self.measure(scope['long'], 1), self.measure(scope['short'], 1))
+
+    def test_tracer_does_not_charge_code_outside_of_contracts(self):
+        scope = {}
+        exec('def f(n):\n    for i in range(n):\n        pass\n', scope)
+
+        self.assertEqual(self.measure(scope['f'], 100), self.measure(scope['f'], 0))
+
+    def test_block_costs_charge_the_same_as_every_opcode(self):
+        source = 'def f(n):\n    t = 0\n    for i in range(n):\n        if i % 2:\n            t += i\n    return t\n'
+
+        per_opcode = {'__contract__': True}
+        exec(compile(source, '', 'exec'), per_opcode)
+
+        code = compile(source, '', 'exec')
+        load_block_costs(runtime.rt.tracer, code, dump_block_costs(code, runtime.rt.cost_schedule), runtime.rt.cost_schedule)
+
+        per_block = {'__contract__': True}
+        exec(code, per_block)
+
+        self.assertEqual(self.measure(per_block['f'], 100), self.measure(per_opcode['f'], 100))
+
+    def test_block_costs_must_fit_the_code(self):
+        code = compile('a = 1', '', 'exec')
+
+        with self.assertRaises(ValueError):
+            runtime.rt.tracer.set_block_costs(code, ((1000, 5),))
+
+    def test_set_costs_needs_every_opcode(self):
+        with self.assertRaises(ValueError):
+            runtime.rt.tracer.set_costs(b'\x00' * 8, 1000)
+
+    def test_cost_schedule_changes_at_block_height(self):
+        scope = {'__contract__': True}
+        exec('def f(n):\n    for i in range(n):\n        pass\n', scope)
+
+        register_schedule(CostSchedule(version=2, costs={k: v * 2 for k, v in read_costs().items()}, height=100))
+
+        try:
+            runtime.rt.use_cost_schedule(schedule_at(99))
+            before = self.measure(scope['f'], 100)
+
+            runtime.rt.use_cost_schedule(schedule_at(100))
+            after = self.measure(scope['f'], 100)
+        finally:
+            unregister_schedule(2)
+            runtime.rt.use_cost_schedule(schedule_at())
+
+        self.assertEqual(after, before * 2)
+        self.assertIs(runtime.rt.cost_schedule, DEFAULT_SCHEDULE)
+
+    def allocate(self, n):
+        scope = {'__contract__': True}
+        exec('def f(n):\n    a = [i for i in range(n)]\n    return len(a)\n', scope)
+
+        runtime.rt.set_up(stmps=1000000, meter=True)
+        scope['f'](n)
+        runtime.rt.tracer.stop()
+        memory = runtime.rt.tracer.get_last_frame_mem_usage(), runtime.rt.tracer.get_total_mem_usage()
+        runtime.rt.clean_up()
+        return memory
+
+    def test_memory_freed_by_the_transaction_is_given_back(self):
+        memory, peak = self.allocate(20000)
+
+        self.assertGreater(peak, 20000 * 8)
+        self.assertLess(memory, peak)
+
+    def test_memory_is_counted_for_every_transaction(self):
+        # A high water mark of the process would charge nothing the second time
+        self.allocate(20000)
+        self.assertGreater(self.allocate(20000)[1], 20000 * 8)
+
+    def test_memory_limit_fails_the_transaction(self):
+        schedule = CostSchedule(version=2, costs=read_costs(), max_memory=100000)
+        register_schedule(schedule)
+
+        try:
+            runtime.rt.use_cost_schedule(schedule)
+            self.allocate(1000)
+
+            with self.assertRaises(AssertionError):
+                self.allocate(20000)
+        finally:
+            unregister_schedule(2)
+            runtime.rt.use_cost_schedule(schedule_at())
+
+    def test_memory_the_driver_allocates_is_not_counted(self):
+        # A read that grows the cache's table past the limit, which a node with a colder cache would not have grown
+        driver = ContractDriver(driver=InMemDriver())
+
+        probe = OrderedDict()
+        n = 0
+        while True:
+            size = sys.getsizeof(probe)
+            probe['key{}'.format(n)] = n
+
+            # Every entry adds a node, a resize adds far more
+            if n > 5000 and sys.getsizeof(probe) - size > 100000:
+                break
+            n += 1
+
+        for i in range(n):
+            driver.cache.fill('key{}'.format(i), i)
+
+        before = sys.getsizeof(driver.cache.clean)
+
+        scope = {'__contract__': True, 'driver': driver}
+        exec('def f():\n    return driver.get("other")\n', scope)
+
+        schedule = CostSchedule(version=2, costs=read_costs(), max_memory=100000)
+        register_schedule(schedule)
+
+        try:
+            runtime.rt.use_cost_schedule(schedule)
+
+            runtime.rt.set_up(stmps=1000000, meter=True)
+            scope['f']()
+            runtime.rt.tracer.stop()
+        finally:
+            unregister_schedule(2)
+            runtime.rt.use_cost_schedule(schedule_at())
+
+        self.assertGreater(sys.getsizeof(driver.cache.clean) - before, 100000)
+        self.assertLess(runtime.rt.tracer.get_total_mem_usage(), 100000)
+
+    def test_profile_adds_up_to_stamps_used(self):
+        scope = {'__contract__': True}
+        exec('def f(n):\n    t = 0\n    for i in range(n):\n        t += i\n    return t\n', scope)
+
+        runtime.rt.set_up(stmps=1000000, meter=True, profile=True)
+        scope['f'](10)
+        runtime.rt.tracer.stop()
+
+        profile = runtime.rt.tracer.get_profile()
+        used = runtime.rt.tracer.get_stamp_used()
+
+        runtime.rt.clean_up()
+
+        lines = {line for (code, line) in profile if code is scope['f'].__code__}
+
+        self.assertEqual(sum(profile.values()), used)
+        self.assertEqual(lines, {2, 3, 4, 5})
+
+    def test_profile_records_reads_and_writes_by_key(self):
+        runtime.rt.set_up(stmps=1000000, meter=True, profile=True)
+
+        runtime.rt.deduct_read('con.a', 'bc')
+        runtime.rt.deduct_read('con.a', 'bc')
+        runtime.rt.deduct_write('con.b', 'de')
+
+        profile = runtime.rt.profile()
+
+        runtime.rt.clean_up()
+
+        self.assertEqual(profile['reads'], {'con.a': 14})
+        self.assertEqual(profile['writes'], {'con.b': 175})
+        self.assertEqual(profile['contracts']['con'], 14 + 175)
+
+    def test_profiling_is_off_after_clean_up(self):
+        runtime.rt.set_up(stmps=1000000, meter=True, profile=True)
+        runtime.rt.clean_up()
+
+        runtime.rt.set_up(stmps=1000000, meter=True)
+        runtime.rt.deduct_read('con.a', 'bc')
+
+        self.assertFalse(runtime.rt.profiling)
+        self.assertEqual(runtime.rt.read_costs, {})
+        self.assertEqual(runtime.rt.tracer.get_profile(), {})
+
+    def test_threads_have_a_runtime_of_their_own(self):
+        runtime.rt.env['thread'] = 'main'
+        seen = {}
+
+        def run():
+            seen['runtime'] = runtime.get_runtime()
+            seen['env'] = dict(runtime.rt.env)
+            runtime.rt.env['thread'] = 'other'
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+
+        self.assertIsNot(seen['runtime'], runtime.get_runtime())
+        self.assertIsNot(seen['runtime'].tracer, runtime.rt.tracer)
+        self.assertEqual(seen['env'], {})
+        self.assertEqual(runtime.rt.env['thread'], 'main')
+
+    def test_runtime_can_be_bound(self):
+        bound = runtime.Runtime()
+        token = runtime.set_runtime(bound)
+
+        try:
+            self.assertIs(runtime.get_runtime(), bound)
+
+            runtime.rt.stamps = 5
+            self.assertEqual(bound.stamps, 5)
+        finally:
+            runtime.reset_runtime(token)
+
+        self.assertIsNot(runtime.get_runtime(), bound)
+
+    def test_context_proxy_follows_the_runtime(self):
+        ctx = runtime.ContextProxy()
+        bound = runtime.Runtime()
+        bound.context._base_state = {'this': 'con', 'caller': 'stu', 'owner': None, 'signer': 'stu'}
+
+        token = runtime.set_runtime(bound)
+        try:
+            self.assertEqual(ctx.caller, 'stu')
+        finally:
+            runtime.reset_runtime(token)
+
+        self.assertEqual(ctx.caller, runtime.get_runtime().context.caller)
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver
+from contracting.execution.sandbox import SandboxDriver
+
+
+class TestSandboxDriver(TestCase):
+    def setUp(self):
+        self.base = ContractDriver()
+        self.base.flush()
+
+        self.base.set('a', 1)
+        self.base.commit()
+
+        self.base.set('b', 2)
+
+        self.d = SandboxDriver(self.base)
+
+    def tearDown(self):
+        self.base.flush()
+
+    def test_starts_from_the_base_state(self):
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertEqual(self.d.get('b'), 2)
+
+    def test_reset_undoes_writes(self):
+        self.d.set('a', 10)
+        self.d.set('c', 3)
+        self.d.put('b', 20)
+
+        self.d.reset()
+
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertEqual(self.d.get('b'), 2)
+        self.assertIsNone(self.d.get('c'))
+        self.assertEqual(self.d.pending_writes, {})
+
+    def test_first_value_is_restored_after_many_writes(self):
+        self.d.set('a', 10)
+        self.d.set('a', 100)
+
+        self.d.reset()
+
+        self.assertEqual(self.d.get('a'), 1)
+
+    def test_synced_writes_are_kept(self):
+        self.d.sync({'a': 5, 'c': 6})
+        self.d.set('a', 10)
+
+        self.d.reset()
+
+        self.assertEqual(self.d.get('a'), 5)
+        self.assertEqual(self.d.get('c'), 6)
+
+    def test_clear_pending_state_keeps_what_was_accessed(self):
+        self.d.get('a')
+        self.d.set('b', 20)
+
+        self.d.clear_pending_state()
+
+        self.assertEqual(self.d.get('b'), 2)
+        self.assertEqual(self.d.pending_writes, {})
+        self.assertIn('a', self.d.accessed)
+
+    def test_base_is_not_changed(self):
+        self.d.set('a', 10)
+
+        self.assertEqual(self.base.get('a'), 1)
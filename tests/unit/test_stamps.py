@@ -0,0 +1,138 @@
+from unittest import TestCase
+from contracting.db.driver import ContractDriver
+from contracting.execution.parallel import SnapshotDriver
+from contracting.execution.stamps import StampLedger
+from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+
+class TestStampLedger(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+
+        self.d.set('currency.balances:stu', 100)
+        self.d.commit()
+        self.d.clear_pending_state()
+
+        self.ledger = StampLedger()
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_key(self):
+        self.assertEqual(self.ledger.key('stu'), 'currency.balances:stu')
+
+    def test_other_currency_contract(self):
+        ledger = StampLedger(currency_contract='tau', balances_hash='accounts')
+
+        self.assertEqual(ledger.key('stu'), 'tau.accounts:stu')
+
+    def test_balance_is_fetched_and_marked_once(self):
+        self.assertEqual(self.ledger.balance(self.d, 'stu'), 100)
+        self.assertIn('currency.balances:stu', self.d.reads)
+
+        self.d.reads.clear()
+        self.assertEqual(self.ledger.balance(self.d, 'stu'), 100)
+        self.assertEqual(self.d.reads, set())
+
+    def test_unknown_sender_has_nothing(self):
+        self.assertEqual(self.ledger.balance(self.d, 'raghu'), 0)
+        self.assertFalse(self.ledger.can_pay(self.d, 'raghu', 1, 20))
+
+    def test_can_pay(self):
+        self.assertTrue(self.ledger.can_pay(self.d, 'stu', 2000, 20))
+        self.assertFalse(self.ledger.can_pay(self.d, 'stu', 2001, 20))
+
+    def test_deduct_writes_through_the_cache(self):
+        balance = self.ledger.deduct(self.d, 'stu', 50, 20)
+
+        self.assertEqual(balance, ContractingDecimal('97.5'))
+        self.assertEqual(self.d.pending_writes['currency.balances:stu'], balance)
+        self.assertEqual(self.d.get('currency.balances:stu'), balance)
+
+    def test_deduct_sees_changes_made_by_the_transaction(self):
+        self.d.set('currency.balances:stu', 10)
+
+        self.assertEqual(self.ledger.deduct(self.d, 'stu', 20, 20), 9)
+
+    def test_deduct_never_goes_below_zero(self):
+        self.assertEqual(self.ledger.deduct(self.d, 'stu', 5000, 20), 0)
+
+    def test_snapshot_records_balances_as_accessed(self):
+        self.ledger.balance(self.d, 'stu')
+        snapshot = SnapshotDriver(self.d)
+
+        self.ledger.deduct(snapshot, 'stu', 20, 20)
+
+        self.assertIn('currency.balances:stu', snapshot.accessed)
+        self.assertNotIn('currency.balances:stu', self.d.pending_writes)
+
+
+class TestStampLedgerBatch(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+
+        self.d.set('currency.balances:stu', 100)
+        self.d.commit()
+        self.d.clear_pending_state()
+
+        self.ledger = StampLedger()
+        self.ledger.begin(self.d)
+
+        self.peeks = []
+        peek = self.d.peek
+        self.d.peek = lambda key: self.peeks.append(key) or peek(key)
+
+    def tearDown(self):
+        self.ledger.end()
+        self.d.flush()
+
+    def test_balance_is_read_once_for_the_check_and_the_charge(self):
+        self.assertTrue(self.ledger.can_pay(self.d, 'stu', 2000, 20))
+        balance = self.ledger.deduct(self.d, 'stu', 50, 20)
+
+        self.assertEqual(self.peeks, ['currency.balances:stu'])
+        self.assertEqual(balance, ContractingDecimal('97.5'))
+        self.assertEqual(self.d.pending_writes['currency.balances:stu'], balance)
+
+    def test_charged_balance_is_kept_for_the_next_transaction(self):
+        self.ledger.deduct(self.d, 'stu', 50, 20)
+        self.ledger.deduct(self.d, 'stu', 50, 20)
+
+        self.assertEqual(self.peeks, ['currency.balances:stu'])
+        self.assertEqual(self.d.pending_writes['currency.balances:stu'], 95)
+
+    def test_balance_changed_by_the_transaction_is_read_again(self):
+        self.ledger.balance(self.d, 'stu')
+        self.d.set('currency.balances:stu', 10)
+
+        self.assertEqual(self.ledger.deduct(self.d, 'stu', 20, 20), 9)
+
+    def test_balance_is_read_and_marked_again_after_pending_state_is_cleared(self):
+        self.ledger.deduct(self.d, 'stu', 50, 20)
+        self.d.clear_pending_state()
+
+        self.assertEqual(self.ledger.balance(self.d, 'stu'), 100)
+        self.assertIn('currency.balances:stu', self.d.reads)
+
+    def test_absent_balances_are_not_kept(self):
+        self.ledger.balance(self.d, 'raghu')
+        self.ledger.balance(self.d, 'raghu')
+
+        self.assertEqual(self.peeks, ['currency.balances:raghu'] * 2)
+
+    def test_balances_are_not_kept_for_other_drivers(self):
+        snapshot = SnapshotDriver(self.d)
+
+        self.ledger.balance(snapshot, 'stu')
+
+        self.assertEqual(self.ledger.balances, {})
+
+    def test_balances_are_not_kept_after_the_batch(self):
+        self.ledger.balance(self.d, 'stu')
+        self.ledger.end()
+
+        self.ledger.balance(self.d, 'stu')
+
+        self.assertEqual(len(self.peeks), 2)